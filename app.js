@@ -2,6 +2,18 @@
 let tokenizer = null;
 let textModel = null;
 let selectedImage = null;
+let dishStore = null;
+let dishStorePromise = null;
+
+// Dish embedding files: compact binary matrix + metadata, legacy JS file as fallback
+const EMBEDDINGS_META_URL = 'data/dish_embeddings.meta.json';
+const EMBEDDINGS_JS_URL = 'data/dish_embeddings_data.js';
+
+// Precomputed text embeddings for known dish names (scripts/text_embeddings.py) and an LRU cache for the rest
+const TEXT_EMBEDDINGS_META_URL = 'data/text_embeddings.meta.json';
+const TEXT_EMBEDDING_CACHE_SIZE = 256;
+let knownTextEmbeddingsPromise = null;
+const textEmbeddingCache = new Map();
 
 // DOM elements
 const uploadArea = document.getElementById('upload-area');
@@ -23,6 +35,8 @@ document.addEventListener('DOMContentLoaded', function() {
     log('🚀 AI Menu Visualizer initialized', 'info');
     setupEventListeners();
     loadApiKey();
+    // Start downloading the dish database in the background
+    loadDishEmbeddings().catch(() => {});
 });
 
 // Setup event listeners
@@ -171,9 +185,7 @@ async function processImage() {
         });
         
         // Step 3: Generate embeddings and find similar dishes
-        loadingText.textContent = 'Loading CLIP model...';
-        await loadCLIPModel();
-        
+        // (the CLIP model is only loaded if a dish name has no precomputed embedding)
         loadingText.textContent = 'Finding similar dishes...';
         const results = await findSimilarDishes(dishNames);
         
@@ -327,14 +339,147 @@ async function fetchKeyIngredients(dishName, apiKey) {
     return data.choices[0].message.content.trim();
 }
 
+// Load the dish embedding store once (binary first, legacy JS file as fallback)
+function loadDishEmbeddings() {
+    if (!dishStorePromise) {
+        dishStorePromise = loadBinaryEmbeddings(EMBEDDINGS_META_URL)
+            .catch(error => {
+                log(`⚠️ Binary embeddings unavailable (${error.message}), loading JS file...`, 'warning');
+                return loadLegacyEmbeddings(EMBEDDINGS_JS_URL);
+            })
+            .then(store => {
+                dishStore = store;
+                log(`📚 Loaded ${store.records.length} dish embeddings (${store.dim} dimensions)`, 'success');
+                return store;
+            })
+            .catch(error => {
+                dishStorePromise = null;
+                log(`❌ Error loading dish embeddings: ${error.message}`, 'error');
+                throw error;
+            });
+    }
+    return dishStorePromise;
+}
+
+// Load a float32/float16 embedding matrix as a typed array plus its metadata
+async function loadBinaryEmbeddings(metaUrl) {
+    const metaResponse = await fetch(metaUrl);
+    if (!metaResponse.ok) {
+        throw new Error(`HTTP ${metaResponse.status} for ${metaUrl}`);
+    }
+    const meta = await metaResponse.json();
+    const matrixUrl = new URL(meta.matrix_file, new URL(metaUrl, window.location.href)).href;
+    const matrixResponse = await fetch(matrixUrl);
+    if (!matrixResponse.ok) {
+        throw new Error(`HTTP ${matrixResponse.status} for ${matrixUrl}`);
+    }
+    const buffer = await matrixResponse.arrayBuffer();
+    let matrix;
+    if (meta.dtype === 'int8') {
+        matrix = await dequantizeInt8(new Int8Array(buffer), new URL(meta.scale_file, matrixUrl).href, meta.dim);
+    } else {
+        matrix = meta.dtype === 'float16' ? float16ToFloat32(new Uint16Array(buffer)) : new Float32Array(buffer);
+    }
+    if (matrix.length !== meta.count * meta.dim) {
+        throw new Error(`Embedding matrix has ${matrix.length} values, expected ${meta.count} x ${meta.dim}`);
+    }
+    return createDishStore(meta.records, matrix, meta.dim);
+}
+
+// Load the legacy `const dishEmbeddings = [...]` script and convert it to a store
+function loadLegacyEmbeddings(src) {
+    return new Promise((resolve, reject) => {
+        const fromRecords = () => {
+            const dim = dishEmbeddings.length > 0 ? dishEmbeddings[0].embedding.length : 0;
+            const matrix = new Float32Array(dishEmbeddings.length * dim);
+            dishEmbeddings.forEach((dish, i) => matrix.set(dish.embedding, i * dim));
+            return createDishStore(dishEmbeddings, matrix, dim);
+        };
+        if (typeof dishEmbeddings !== 'undefined') {
+            resolve(fromRecords());
+            return;
+        }
+        const script = document.createElement('script');
+        script.src = src;
+        script.onload = () => resolve(fromRecords());
+        script.onerror = () => reject(new Error(`Could not load ${src}`));
+        document.head.appendChild(script);
+    });
+}
+
+// Row-major embedding matrix with precomputed row norms and per-dish centroids
+function createDishStore(records, matrix, dim) {
+    const norms = new Float32Array(records.length);
+    for (let i = 0; i < records.length; i++) {
+        let sum = 0;
+        for (let j = i * dim; j < (i + 1) * dim; j++) sum += matrix[j] * matrix[j];
+        norms[i] = Math.sqrt(sum);
+    }
+    // Group image rows by dish; each dish gets the normalized mean of its normalized rows
+    const groups = new Map();
+    records.forEach((record, i) => {
+        const key = `${record.cuisine}|${record.dish}`;
+        if (!groups.has(key)) groups.set(key, []);
+        groups.get(key).push(i);
+    });
+    const dishRows = [...groups.values()];
+    const centroids = new Float32Array(dishRows.length * dim);
+    dishRows.forEach((rows, d) => {
+        const centroid = centroids.subarray(d * dim, (d + 1) * dim);
+        for (const i of rows) {
+            if (norms[i] === 0) continue;
+            for (let j = 0; j < dim; j++) centroid[j] += matrix[i * dim + j] / norms[i];
+        }
+        let sum = 0;
+        for (let j = 0; j < dim; j++) sum += centroid[j] * centroid[j];
+        const norm = Math.sqrt(sum) || 1;
+        for (let j = 0; j < dim; j++) centroid[j] /= norm;
+    });
+    return { records, matrix, dim, norms, dishRows, centroids };
+}
+
+// Expand int8 codes with one float32 scale per row into a Float32Array
+async function dequantizeInt8(codes, scalesUrl, dim) {
+    const response = await fetch(scalesUrl);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status} for ${scalesUrl}`);
+    }
+    const scales = new Float32Array(await response.arrayBuffer());
+    const out = new Float32Array(codes.length);
+    for (let i = 0; i < scales.length; i++) {
+        for (let j = i * dim; j < (i + 1) * dim; j++) out[j] = codes[j] * scales[i];
+    }
+    return out;
+}
+
+// Decode IEEE 754 half-precision values into a Float32Array
+function float16ToFloat32(halves) {
+    const out = new Float32Array(halves.length);
+    for (let i = 0; i < halves.length; i++) {
+        const h = halves[i];
+        const sign = h & 0x8000 ? -1 : 1;
+        const exponent = (h >> 10) & 0x1f;
+        const fraction = h & 0x3ff;
+        if (exponent === 0) {
+            out[i] = sign * Math.pow(2, -14) * (fraction / 1024);
+        } else if (exponent === 0x1f) {
+            out[i] = fraction ? NaN : sign * Infinity;
+        } else {
+            out[i] = sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+        }
+    }
+    return out;
+}
+
 // Find similar dishes and fetch ingredients for each dish
 async function findSimilarDishes(dishNames) {
     const apiKey = openaiKeyInput.value.trim();
+    await Promise.all([loadDishEmbeddings(), loadKnownTextEmbeddings()]);
     const results = [];
     for (const dish of dishNames) {
         log(`🔍 Finding similar dishes for: ${dish.translated}`, 'info');
-        // Generate text embedding
-        const textEmbedding = await generateTextEmbedding(dish.translated);
+        // Look up or generate the text embedding
+        const textEmbedding = await getTextEmbedding(dish.translated);
         // Find similar dishes
         const similarDishes = findTopSimilarDishes(textEmbedding, 3);
         // Fetch key ingredients from API
@@ -354,39 +499,94 @@ async function findSimilarDishes(dishNames) {
     return results;
 }
 
-// Find top similar dishes (array logic, use match.image_path)
+// Two-stage search: rank dishes by centroid, then pick the best image of each top dish
 function findTopSimilarDishes(textEmbedding, topK = 3) {
-    log(`🔍 Comparing text embedding (${textEmbedding.length} dimensions) with ${dishEmbeddings.length} dish embeddings`, 'info');
-    const similarities = dishEmbeddings.map(dish => ({
-        ...dish,
-        similarity: cosineSimilarity(textEmbedding, dish.embedding)
-    }));
-    similarities.sort((a, b) => b.similarity - a.similarity);
-    return similarities.slice(0, topK);
+    const { records, matrix, dim, norms, dishRows, centroids } = dishStore;
+    log(`🔍 Comparing text embedding (${textEmbedding.length} dimensions) with ${dishRows.length} dishes (${records.length} images)`, 'info');
+    if (textEmbedding.length !== dim) {
+        console.error('Vector length mismatch:', textEmbedding.length, 'vs', dim);
+        return [];
+    }
+    let queryNorm = 0;
+    for (let j = 0; j < dim; j++) queryNorm += textEmbedding[j] * textEmbedding[j];
+    queryNorm = Math.sqrt(queryNorm);
+    if (queryNorm === 0) return [];
+
+    const cosine = (vectors, index, norm) => {
+        let dot = 0;
+        const offset = index * dim;
+        for (let j = 0; j < dim; j++) dot += textEmbedding[j] * vectors[offset + j];
+        return dot / (queryNorm * norm);
+    };
+    const topDishes = runningTopK(dishRows.length, d => cosine(centroids, d, 1), topK);
+    const matches = topDishes.map(({ index }) => {
+        const best = runningTopK(dishRows[index].length,
+            k => norms[dishRows[index][k]] === 0 ? -Infinity : cosine(matrix, dishRows[index][k], norms[dishRows[index][k]]), 1)[0];
+        return { index: dishRows[index][best.index], similarity: best.similarity };
+    });
+    matches.sort((a, b) => b.similarity - a.similarity);
+    return matches.map(({ index, similarity }) => ({ ...records[index], similarity }));
 }
 
-// Calculate cosine similarity
-function cosineSimilarity(vecA, vecB) {
-    // Ensure both vectors are arrays
-    const arrayA = Array.isArray(vecA) ? vecA : Array.from(vecA);
-    const arrayB = Array.isArray(vecB) ? vecB : Array.from(vecB);
-    
-    // Check if vectors have the same length
-    if (arrayA.length !== arrayB.length) {
-        console.error('Vector length mismatch:', arrayA.length, 'vs', arrayB.length);
-        return 0;
+// Keep a small sorted list of the best scores instead of sorting every candidate
+function runningTopK(count, score, topK) {
+    const top = [];
+    for (let i = 0; i < count; i++) {
+        const similarity = score(i);
+        if (top.length < topK || similarity > top[top.length - 1].similarity) {
+            top.push({ index: i, similarity });
+            top.sort((a, b) => b.similarity - a.similarity);
+            if (top.length > topK) top.pop();
+        }
     }
-    
-    const dotProduct = arrayA.reduce((sum, a, i) => sum + a * arrayB[i], 0);
-    const normA = Math.sqrt(arrayA.reduce((sum, a) => sum + a * a, 0));
-    const normB = Math.sqrt(arrayB.reduce((sum, b) => sum + b * b, 0));
-    
-    // Avoid division by zero
-    if (normA === 0 || normB === 0) {
-        return 0;
+    return top;
+}
+
+// Load precomputed embeddings of known dish names keyed by normalized name (optional file)
+function loadKnownTextEmbeddings() {
+    if (!knownTextEmbeddingsPromise) {
+        knownTextEmbeddingsPromise = loadBinaryEmbeddings(TEXT_EMBEDDINGS_META_URL)
+            .then(store => {
+                const known = new Map();
+                store.records.forEach((record, i) => {
+                    known.set(normalizeDishName(record.text), store.matrix.subarray(i * store.dim, (i + 1) * store.dim));
+                });
+                log(`📚 Loaded ${known.size} precomputed dish name embeddings`, 'success');
+                return known;
+            })
+            .catch(error => {
+                log(`⚠️ Precomputed text embeddings unavailable (${error.message}), using CLIP for every dish`, 'warning');
+                return new Map();
+            });
     }
-    
-    return dotProduct / (normA * normB);
+    return knownTextEmbeddingsPromise;
+}
+
+// Same lookup key as normalize_text() in scripts/embedding_cache.py
+function normalizeDishName(text) {
+    return text.normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase().replace(/[^a-z0-9]+/g, ' ').trim();
+}
+
+// Text embedding from the precomputed table, the LRU cache, or CLIP (loaded on first miss)
+async function getTextEmbedding(text) {
+    const known = (await loadKnownTextEmbeddings()).get(normalizeDishName(text));
+    if (known) {
+        log(`⚡ Using precomputed embedding for: ${text}`, 'info');
+        return known;
+    }
+    if (textEmbeddingCache.has(text)) {
+        const cached = textEmbeddingCache.get(text);
+        textEmbeddingCache.delete(text);
+        textEmbeddingCache.set(text, cached);
+        return cached;
+    }
+    await loadCLIPModel();
+    const embedding = await generateTextEmbedding(text);
+    textEmbeddingCache.set(text, embedding);
+    if (textEmbeddingCache.size > TEXT_EMBEDDING_CACHE_SIZE) {
+        textEmbeddingCache.delete(textEmbeddingCache.keys().next().value);
+    }
+    return embedding;
 }
 
 // Generate text embedding
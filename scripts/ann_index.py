@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Approximate Nearest-Neighbour Index
+IVF-PQ index over the dish embeddings, implemented in NumPy: a k-means coarse
+quantizer splits the catalog into inverted lists and residuals are product-quantized
+to one byte per sub-vector. Queries probe the nprobe closest lists, score candidates
+with lookup tables and optionally re-rank the best ones with exact vectors.
+
+Usage:
+  python ann_index.py build --embeddings dish_images/dish_embeddings.json
+  python ann_index.py eval --embeddings dish_images/dish_embeddings.json --nprobe 1 4 8 16
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from embedding_index import EmbeddingIndex, SearchResultsMixin, normalize_rows, top_k_indices
+from embedding_store import load_embedding_matrix, binary_paths
+
+
+def ann_index_path(embeddings_file):
+    """Default location of the ANN index next to the embeddings file"""
+    return os.path.splitext(binary_paths(embeddings_file)[0])[0] + '.ivfpq.npz'
+
+
+def kmeans(x, k, iters=20, seed=0, chunk_size=8192):
+    """Plain Lloyd k-means; returns (centroids, assignments)"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    assignments = np.zeros(len(x), dtype=np.int64)
+    for _ in range(iters):
+        assignments = assign(x, centroids, chunk_size)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[~empty]
+        centroids[~empty] = np.add.reduceat(x[order], starts, axis=0) / counts[~empty, None]
+        # Reseed empty clusters with random points so every list stays usable
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids, assign(x, centroids, chunk_size)
+
+
+def assign(x, centroids, chunk_size=8192):
+    """Index of the nearest centroid (L2) for every row, computed in chunks"""
+    half_sq_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        out[start:start + chunk_size] = np.argmax(x[start:start + chunk_size] @ centroids.T - half_sq_norms, axis=1)
+    return out
+
+
+class IVFPQIndex(SearchResultsMixin):
+    def __init__(self, records, centroids, codebooks, codes, list_order, list_offsets, nprobe=8,
+                 matrix=None, rerank=50):
+        self.records = records
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.list_order = list_order
+        self.list_offsets = list_offsets
+        self.nprobe = nprobe
+        # Optional exact vectors used to re-rank the best `rerank` approximate candidates
+        self.matrix = normalize_rows(matrix) if matrix is not None else None
+        self.rerank = rerank
+
+    @classmethod
+    def build(cls, records, matrix, nlist=None, m=16, iters=20, train_size=50000, seed=0, nprobe=8):
+        """Train the coarse quantizer and PQ codebooks and encode every vector"""
+        x = normalize_rows(matrix)
+        n, dim = x.shape
+        if n == 0:
+            raise ValueError("Cannot build an ANN index over an empty embedding set")
+        if dim % m != 0:
+            raise ValueError(f"Embedding dim {dim} is not divisible by m={m}")
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        train = x[rng.choice(n, min(n, train_size), replace=False)]
+
+        centroids, _ = kmeans(train, nlist, iters=iters, seed=seed)
+        assignments = assign(x, centroids)
+        residuals = x - centroids[assignments]
+
+        dsub = dim // m
+        ksub = min(256, n)
+        codebooks = np.empty((m, ksub, dsub), dtype=np.float32)
+        codes = np.empty((n, m), dtype=np.uint8)
+        train_residuals = residuals[rng.choice(n, min(n, train_size), replace=False)]
+        for j in range(m):
+            sub = slice(j * dsub, (j + 1) * dsub)
+            codebooks[j], _ = kmeans(train_residuals[:, sub], ksub, iters=iters, seed=seed + j + 1)
+            codes[:, j] = assign(residuals[:, sub], codebooks[j])
+
+        list_order = np.argsort(assignments, kind='stable')
+        list_offsets = np.searchsorted(assignments[list_order], np.arange(len(centroids) + 1))
+        return cls(records, centroids, codebooks, codes, list_order, list_offsets, nprobe=nprobe)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_file = path + '.tmp.npz'
+        np.savez(tmp_file, centroids=self.centroids, codebooks=self.codebooks, codes=self.codes,
+                 list_order=self.list_order, list_offsets=self.list_offsets,
+                 records=np.array(json.dumps(self.records, ensure_ascii=False)))
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path, nprobe=8, matrix=None, rerank=50):
+        """Load a persisted index; pass the exact embedding matrix to enable re-ranking"""
+        with np.load(path) as data:
+            return cls(json.loads(str(data["records"])), data["centroids"], data["codebooks"], data["codes"],
+                       data["list_order"], data["list_offsets"], nprobe=nprobe, matrix=matrix, rerank=rerank)
+
+    def search_indices(self, queries, top_k=5):
+        """Return (indices, scores) arrays of shape (n_queries, k); missing slots are -1 / -inf"""
+        queries = normalize_rows(np.atleast_2d(queries))
+        m, ksub, dsub = self.codebooks.shape
+        nprobe = min(self.nprobe, len(self.centroids))
+        coarse = queries @ self.centroids.T
+        probes = top_k_indices(coarse, nprobe)[0]
+        # Inner product tables: lut[q, j, c] = <query sub-vector j, codeword c>
+        luts = np.einsum('qjd,jcd->qjc', queries.reshape(len(queries), m, dsub), self.codebooks)
+
+        out_indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for qi, lists in enumerate(probes):
+            ids = np.concatenate([self.list_order[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists])
+            if len(ids) == 0:
+                continue
+            list_scores = np.repeat(coarse[qi, lists], np.diff(self.list_offsets)[lists])
+            scores = list_scores + luts[qi][np.arange(m), self.codes[ids]].sum(axis=1)
+            if self.matrix is not None and self.rerank > 0:
+                best, _ = top_k_indices(scores[None, :], max(top_k, self.rerank))
+                ids = ids[best[0]]
+                scores = self.matrix[ids] @ queries[qi]
+            best, best_scores = top_k_indices(scores[None, :], top_k)
+            out_indices[qi, :best.shape[1]] = ids[best[0]]
+            out_scores[qi, :best.shape[1]] = best_scores[0]
+        return out_indices, out_scores
+
+
+def evaluate_recall(ann, exact, queries, top_k=5):
+    """Recall@k of the ANN index against exact search, plus mean per-query latency (ms) of both"""
+    start = time.perf_counter()
+    exact_indices, _ = exact.search_indices(queries, top_k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    ann_indices, _ = ann.search_indices(queries, top_k)
+    ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    hits = sum(len(set(a[a >= 0]) & set(e)) for a, e in zip(ann_indices, exact_indices))
+    return hits / exact_indices.size, ann_ms, exact_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF-PQ ANN index for dish embeddings.")
+    parser.add_argument('command', choices=['build', 'eval'], help='build: train and save the index; eval: report recall vs exact search')
+    parser.add_argument('--embeddings', type=str, default='dish_images/dish_embeddings.json', help='Embeddings file (.json, .pkl, .bin or .meta.json)')
+    parser.add_argument('--index', type=str, default=None, help='Index path (default: <embeddings>.ivfpq.npz)')
+    parser.add_argument('--nlist', type=int, default=None, help='Number of inverted lists (default: 4*sqrt(n))')
+    parser.add_argument('--m', type=int, default=16, help='PQ sub-vectors per embedding (must divide the dimension)')
+    parser.add_argument('--iters', type=int, default=20, help='k-means iterations')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16], help='Lists probed per query (eval accepts several)')
+    parser.add_argument('--rerank', type=int, default=50, help='Candidates re-ranked with exact vectors (0 = PQ scores only)')
+    parser.add_argument('--top-k', type=int, default=5, help='k for recall@k')
+    parser.add_argument('--queries', type=int, default=200, help='Number of stored embeddings sampled as eval queries')
+    args = parser.parse_args()
+
+    index_path = args.index or ann_index_path(args.embeddings)
+    records, matrix = load_embedding_matrix(args.embeddings)
+    print(f"Loaded {len(records)} embeddings from: {args.embeddings}")
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        ann = IVFPQIndex.build(records, matrix, nlist=args.nlist, m=args.m, iters=args.iters)
+        ann.save(index_path)
+        print(f"Built IVF-PQ index ({len(ann.centroids)} lists, m={args.m}) in {time.perf_counter() - start:.1f}s")
+        print(f"Index saved to: {index_path}")
+        return
+
+    exact = EmbeddingIndex(records, matrix)
+    rng = np.random.default_rng(0)
+    queries = exact.matrix[rng.choice(len(exact), min(args.queries, len(exact)), replace=False)]
+    print(f"{'nprobe':>6} {'recall@' + str(args.top_k):>10} {'ann ms':>8} {'exact ms':>9}")
+    for nprobe in args.nprobe:
+        ann = IVFPQIndex.load(index_path, nprobe=nprobe, matrix=exact.matrix if args.rerank else None, rerank=args.rerank)
+        recall, ann_ms, exact_ms = evaluate_recall(ann, exact, queries, args.top_k)
+        print(f"{nprobe:>6} {recall:>10.3f} {ann_ms:>8.3f} {exact_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite
+Offline, reproducible benchmarks for the data pipeline and search paths. A local
+fixture server stands in for the image search engines, the image hosts and the
+OpenAI endpoint, and all data is synthetic with fixed seeds. Results are written as
+JSON; pass --baseline to compare a run against an earlier results file.
+
+Cases:
+  validation  validate_image throughput, plus scrape_dish and the GPT filter against the fixture server
+  embedding   ImageEmbeddingGenerator images/sec at several batch sizes (skipped if CLIP is unavailable)
+  search      exact, int8 and two-stage search latency at 1k/10k/100k rows, and search_by_text /
+              find_similar_images end to end when CLIP is available
+  storage     save_embeddings / load time and on-disk size per format
+
+Usage:
+  python benchmark.py --output benchmark_results.json
+  python benchmark.py --quick --baseline benchmark_results.json
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from PIL import Image
+
+import dish_image_scraper
+from dish_image_scraper import validate_image, scrape_dish, HostRateLimiter, PerceptualHashIndex
+from filter_scraped_images import ask_gpt_filter_image
+from http_session import configure_session, get_session
+from embedding_index import EmbeddingIndex, QuantizedIndex
+from dish_index import DishIndex
+from clip_backends import BACKENDS
+from embedding_store import save_embeddings, load_embedding_matrix, binary_paths, scales_path
+
+CASES = ["validation", "embedding", "search", "storage"]
+
+
+def synthetic_jpeg(seed, width=640, height=480, quality=85):
+    """Deterministic colorful JPEG: smooth gradients plus noise, like a food photo"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, size=3)
+    pixels = np.stack([(base[c] + 80 * np.sin(x / rng.uniform(20, 80) + c) + 60 * np.cos(y / rng.uniform(20, 80)))
+                       for c in range(3)], axis=-1)
+    pixels += rng.normal(0, 12, size=pixels.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def synthetic_embeddings(n, dim=512, images_per_dish=10, seed=0):
+    """Clustered unit vectors with one cluster per dish; returns (records, matrix)"""
+    rng = np.random.default_rng(seed)
+    dishes = max(1, n // images_per_dish)
+    centers = rng.normal(size=(dishes, dim)).astype(np.float32)
+    assignments = np.arange(n) % dishes
+    matrix = centers[assignments] + 0.7 * rng.normal(size=(n, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    records = [{"cuisine": f"cuisine{d % 4}", "dish": f"dish{d}", "url": f"http://example.com/{i}.jpg"}
+               for i, d in enumerate(assignments)]
+    return records, matrix
+
+
+class FixtureServer:
+    """Local stand-in for the image search engines, image hosts and the OpenAI chat endpoint.
+    GET /search?q=...  HTML page with image links (Google-style <img src>)
+    GET /i/<n>.jpg     synthetic JPEG; every fifth one is too small for the scraper's rules
+    POST /v1/chat/completions  deterministic 'yes,yes,no,no' / 'no,yes,no,no' answers"""
+
+    def __init__(self, results_per_search=12, latency=0.0):
+        self.results_per_search = results_per_search
+        self.latency = latency
+        self.images = {}
+        self.lock = threading.Lock()
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send(self, status, body, content_type):
+                time.sleep(fixture.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path == '/search':
+                    query = parse_qs(parsed.query).get('q', [''])[0]
+                    start = int(hashlib.sha1(query.encode('utf-8')).hexdigest()[:6], 16)
+                    links = ''.join(f'<img src="{fixture.url}/i/{start + i}.jpg">' for i in range(fixture.results_per_search))
+                    self.send(200, f'<html><body>{links}</body></html>'.encode('utf-8'), 'text/html')
+                elif parsed.path.startswith('/i/'):
+                    self.send(200, fixture.image(int(parsed.path[3:-4])), 'image/jpeg')
+                else:
+                    self.send(404, b'', 'text/plain')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                # The verdict depends only on the image number, not on the fixture's random port
+                image = re.search(r'/i/(\d+)\.jpg', body.decode('utf-8'))
+                rejected = image is not None and int(hashlib.sha1(image.group(1).encode('utf-8')).hexdigest(), 16) % 4 == 0
+                answer = 'no,yes,no,no' if rejected else 'yes,yes,no,no'
+                self.send(200, json.dumps({"choices": [{"message": {"content": answer}}]}).encode('utf-8'),
+                          'application/json')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def image(self, n):
+        with self.lock:
+            if n not in self.images:
+                size = (160, 120) if n % 5 == 0 else (640, 480)
+                self.images[n] = synthetic_jpeg(n, *size)
+            return self.images[n]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def timed(fn, *args, repeats=1, **kwargs):
+    """Best wall time in seconds over repeats, and the last result"""
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_validation(args, workdir):
+    results = {}
+    for width, height in [(640, 480), (1280, 960), (2048, 1536)]:
+        images = [synthetic_jpeg(seed, width, height) for seed in range(args.validation_images)]
+        seconds, _ = timed(lambda: [validate_image(img, 300, 300, 20 * 1024) for img in images], repeats=3)
+        results[f"validate_{width}x{height}_images_per_sec"] = len(images) / seconds
+
+    configure_session(pool_size=16, retries=0)
+    with FixtureServer(latency=args.fixture_latency) as fixture:
+        def local_search(query, max_results=10, headers=None):
+            resp = get_session().get(f"{fixture.url}/search", params={"q": query}, timeout=10)
+            return re.findall(r'<img src="([^"]+)"', resp.text)[:max_results]
+
+        original = dish_image_scraper.SEARCHERS
+        dish_image_scraper.SEARCHERS = [(local_search, fixture.url)]
+        try:
+            scrape_args = SimpleNamespace(max_images=args.scrape_images_per_dish, output_dir=os.path.join(workdir, 'scrape'),
+                                          min_width=300, min_height=300, min_filesize=10 * 1024,
+                                          max_filesize=10 * 1024 * 1024)
+            dishes = [f"Benchmark Dish {i}" for i in range(args.scrape_dishes)]
+            limiter = HostRateLimiter(0)
+            dedup = PerceptualHashIndex()
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                seconds, saved = timed(lambda: sum(len(scrape_dish("Bench", "food", dish, scrape_args, {}, pool, limiter, dedup))
+                                                   for dish in dishes))
+        finally:
+            dish_image_scraper.SEARCHERS = original
+        results["scrape_images_per_sec"] = saved / seconds
+        results["scrape_images_saved"] = saved
+
+        urls = [f"{fixture.url}/i/{i}.jpg" for i in range(args.filter_requests)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            seconds, verdicts = timed(lambda: list(pool.map(
+                lambda url: ask_gpt_filter_image(url, "Benchmark Dish", "test-key", f"{fixture.url}/v1/chat/completions",
+                                                 "gpt-4.1-nano"), urls)))
+        results["filter_requests_per_sec"] = len(urls) / seconds
+        results["filter_pass_rate"] = sum(bool(v) for v in verdicts) / len(verdicts)
+    return results
+
+
+def load_generator(args):
+    """The CLIP generator, or None (with the reason) when torch/transformers or the model are unavailable"""
+    try:
+        from image_embedding_generator import ImageEmbeddingGenerator
+        generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device, backend=args.backend,
+                                            onnx_dir=args.onnx_dir, quantize=args.quantize)
+        generator.load_model()
+        return generator, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def bench_embedding(args, workdir, generator):
+    image_dir = os.path.join(workdir, 'embed')
+    os.makedirs(image_dir, exist_ok=True)
+    paths = []
+    for seed in range(args.embedding_images):
+        path = os.path.join(image_dir, f"{seed}.jpg")
+        with open(path, 'wb') as f:
+            f.write(synthetic_jpeg(seed))
+        paths.append(path)
+    results = {}
+    for batch_size in args.batch_sizes:
+        generator.batch_size = batch_size
+        generator.num_workers = args.num_workers
+        seconds, embeddings = timed(lambda: list(generator.generate_embeddings(paths, desc=f"batch {batch_size}")))
+        results[f"batch_{batch_size}_images_per_sec"] = len(embeddings) / seconds
+    return results
+
+
+def bench_search(args, workdir, generator):
+    rng = np.random.default_rng(1)
+    results = {}
+    for n in args.search_sizes:
+        records, matrix = synthetic_embeddings(n, args.dim)
+        queries = matrix[rng.choice(n, args.search_queries, replace=False)] + 0.3 * rng.normal(size=(args.search_queries, args.dim))
+        row = {}
+        build_seconds, exact = timed(EmbeddingIndex, records, matrix)
+        row["exact_build_ms"] = build_seconds * 1000
+        int8 = QuantizedIndex.from_matrix(records, matrix)
+        dishes = DishIndex.build(records, matrix)
+        for name, index in [("exact", exact), ("int8", int8), ("two_stage", dishes)]:
+            single, _ = timed(lambda: [index.search_indices(q, args.top_k) for q in queries[:20]], repeats=3)
+            batch, _ = timed(index.search_indices, queries, args.top_k, repeats=3)
+            row[f"{name}_single_query_ms"] = single * 1000 / 20
+            row[f"{name}_batched_query_ms"] = batch * 1000 / len(queries)
+        if generator is not None and args.dim == 512:
+            texts = [f"dish{i}" for i in range(20)]
+            generator.search_by_text_batch(texts[:1], exact, args.top_k)  # warm-up
+            seconds, _ = timed(lambda: [generator.search_by_text(text, exact, args.top_k) for text in texts])
+            row["search_by_text_ms"] = seconds * 1000 / len(texts)
+            path = os.path.join(workdir, 'query.jpg')
+            with open(path, 'wb') as f:
+                f.write(synthetic_jpeg(0))
+            seconds, _ = timed(generator.find_similar_images, path, exact, args.top_k, repeats=3)
+            row["find_similar_images_ms"] = seconds * 1000
+        results[f"rows_{n}"] = row
+    return results
+
+
+def bench_storage(args, workdir):
+    results = {}
+    for n in args.storage_sizes:
+        records, matrix = synthetic_embeddings(n, args.dim)
+        embeddings_data = [dict(record, embedding=row.tolist(), embedding_dim=args.dim) for record, row in zip(records, matrix)]
+        row = {}
+        for output_format, dtype in [("json", "float32"), ("binary", "float32"), ("binary", "float16"), ("binary", "int8")]:
+            name = f"{output_format}_{dtype}" if output_format == "binary" else output_format
+            output_file = os.path.join(workdir, f"storage_{n}_{name}.json")
+            save_seconds, _ = timed(save_embeddings, embeddings_data, output_file, output_format, dtype)
+            if output_format == "json":
+                files, load_path = [output_file, output_file.replace('.json', '.js')], output_file
+            else:
+                bin_file, meta_file = binary_paths(output_file)
+                files, load_path = [bin_file, meta_file], meta_file
+                if dtype == "int8":
+                    files.append(scales_path(bin_file))
+            load_seconds, _ = timed(load_embedding_matrix, load_path, repeats=3)
+            row[f"{name}_save_ms"] = save_seconds * 1000
+            row[f"{name}_load_ms"] = load_seconds * 1000
+            row[f"{name}_bytes"] = sum(os.path.getsize(path) for path in files)
+        results[f"rows_{n}"] = row
+    return results
+
+
+def flatten(results, prefix=""):
+    """Numeric leaves as {"case.group.metric": value} for baseline comparison"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline):
+    """Print every metric present in both runs with its relative change"""
+    now, before = flatten(current), flatten(baseline)
+    print(f"\n{'metric':<60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(now) & set(before)):
+        change = (now[name] - before[name]) / before[name] * 100 if before[name] else 0.0
+        print(f"{name:<60} {before[name]:>12.3f} {now[name]:>12.3f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for the data pipeline and search paths.")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES, help='Benchmarks to run')
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier results file to compare against')
+    parser.add_argument('--quick', action='store_true', help='Smaller sizes for a fast smoke run')
+    parser.add_argument('--model', type=str, default='openai/clip-vit-base-patch32', help='CLIP model for the embedding and end-to-end search cases')
+    parser.add_argument('--device', type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend for the model-dependent cases')
+    parser.add_argument('--onnx-dir', type=str, default=None, help='Directory of the exported ONNX towers (default: onnx_models/<model>)')
+    parser.add_argument('--quantize', action='store_true', help='With --backend onnx, use int8 dynamically quantized towers')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32], help='Embedding batch sizes')
+    parser.add_argument('--num-workers', type=int, default=4, help='Preprocessing threads for the embedding case')
+    parser.add_argument('--search-sizes', type=int, nargs='+', default=None, help='Catalog sizes for the search case (default: 1000 10000 100000)')
+    parser.add_argument('--dim', type=int, default=512, help='Embedding dimension of the synthetic catalogs')
+    parser.add_argument('--top-k', type=int, default=5, help='Results per search')
+    parser.add_argument('--fixture-latency', type=float, default=0.0, help='Seconds the fixture server waits before each response')
+    args = parser.parse_args()
+
+    args.search_sizes = args.search_sizes or ([1000, 10000] if args.quick else [1000, 10000, 100000])
+    args.storage_sizes = [1000] if args.quick else [1000, 10000]
+    args.validation_images = 10 if args.quick else 50
+    args.scrape_dishes = 2 if args.quick else 8
+    args.scrape_images_per_dish = 5
+    args.filter_requests = 20 if args.quick else 100
+    args.embedding_images = 16 if args.quick else 64
+    args.search_queries = 32 if args.quick else 128
+
+    generator, generator_error = None, None
+    if "embedding" in args.cases or "search" in args.cases:
+        generator, generator_error = load_generator(args)
+        if generator is None:
+            print(f"CLIP unavailable, skipping model-dependent benchmarks: {generator_error}")
+
+    workdir = tempfile.mkdtemp(prefix='menu_guide_bench_')
+    results = {}
+    try:
+        for case in args.cases:
+            print(f"\n=== Benchmark: {case} ===")
+            start = time.perf_counter()
+            if case == "validation":
+                results[case] = bench_validation(args, workdir)
+            elif case == "embedding":
+                results[case] = bench_embedding(args, workdir, generator) if generator else {"skipped": generator_error}
+            elif case == "search":
+                results[case] = bench_search(args, workdir, generator)
+            elif case == "storage":
+                results[case] = bench_storage(args, workdir)
+            print(f"{case} finished in {time.perf_counter() - start:.1f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    for name, value in flatten(results).items():
+        print(f"{name:<60} {value:>12.3f}")
+    print(f"\nResults saved to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
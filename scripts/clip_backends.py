@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+CLIP Backends
+Inference backends for ImageEmbeddingGenerator. Both take preprocessed numpy inputs
+(CLIPProcessor with return_tensors="np") and return L2-normalized float32 embeddings.
+
+  torch  the transformers CLIPModel (default; CPU or GPU)
+  onnx   the vision and text towers exported once to ONNX, optionally with int8 dynamic
+         quantization, run with onnxruntime on CPU; torch is only needed for the export
+
+torch, transformers and onnxruntime are imported only when a backend is created, so
+scripts that just load embeddings start without them.
+
+Usage:
+  python clip_backends.py export --quantize
+  python clip_backends.py check --images dish_images/Italian --quantize
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+
+BACKENDS = ["torch", "onnx"]
+
+
+def onnx_model_dir(model_name, root="onnx_models"):
+    """Directory of the exported towers of a model, e.g. onnx_models/openai__clip-vit-base-patch32"""
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def onnx_paths(model_dir, quantize=False):
+    """(vision, text) model files; the int8 variants sit next to the float32 export"""
+    suffix = ".int8.onnx" if quantize else ".onnx"
+    return os.path.join(model_dir, "vision" + suffix), os.path.join(model_dir, "text" + suffix)
+
+
+def normalize(features):
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.maximum(norms, 1e-12)
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model_name, device=None, num_threads=None):
+        import torch
+        from transformers import CLIPModel
+
+        self.torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.device = device if device else ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = CLIPModel.from_pretrained(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+
+    def embed_images(self, pixel_values):
+        batch = self.torch.from_numpy(np.ascontiguousarray(pixel_values)).to(self.device)
+        with self.torch.no_grad():
+            image_features = self.model.get_image_features(pixel_values=batch)
+            image_features = self.torch.nn.functional.normalize(image_features, p=2, dim=1)
+        return image_features.cpu().numpy()
+
+    def embed_texts(self, inputs):
+        inputs = {k: self.torch.from_numpy(v).to(self.device) for k, v in inputs.items()}
+        with self.torch.no_grad():
+            text_features = self.model.get_text_features(**inputs)
+            text_features = self.torch.nn.functional.normalize(text_features, p=2, dim=1)
+        return text_features.cpu().numpy()
+
+
+def export_onnx(model_name, model_dir, quantize=False, opset=17):
+    """Export CLIP's vision and text towers to model_dir (and their int8 dynamic-quantized
+    copies with quantize). Existing files are kept; returns the (vision, text) paths."""
+    vision_path, text_path = onnx_paths(model_dir)
+    if not (os.path.exists(vision_path) and os.path.exists(text_path)):
+        import torch
+        from transformers import CLIPModel
+
+        class Tower(torch.nn.Module):
+            def __init__(self, model, features):
+                super().__init__()
+                self.model = model
+                self.features = features
+
+            def forward(self, *inputs):
+                return torch.nn.functional.normalize(self.features(*inputs), p=2, dim=1)
+
+        print(f"Exporting {model_name} to ONNX in: {model_dir}")
+        os.makedirs(model_dir, exist_ok=True)
+        model = CLIPModel.from_pretrained(model_name).eval()
+        size = model.config.vision_config.image_size
+        vision = Tower(model, lambda pixel_values: model.get_image_features(pixel_values=pixel_values))
+        text = Tower(model, lambda input_ids, attention_mask: model.get_text_features(input_ids=input_ids,
+                                                                                     attention_mask=attention_mask))
+        with torch.no_grad():
+            torch.onnx.export(vision, (torch.zeros(1, 3, size, size),), vision_path + '.tmp',
+                              input_names=['pixel_values'], output_names=['embeddings'],
+                              dynamic_axes={'pixel_values': {0: 'batch'}, 'embeddings': {0: 'batch'}},
+                              opset_version=opset)
+            tokens = torch.ones(1, 8, dtype=torch.int64)
+            torch.onnx.export(text, (tokens, tokens), text_path + '.tmp',
+                              input_names=['input_ids', 'attention_mask'], output_names=['embeddings'],
+                              dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                            'attention_mask': {0: 'batch', 1: 'sequence'},
+                                            'embeddings': {0: 'batch'}},
+                              opset_version=opset)
+        os.replace(vision_path + '.tmp', vision_path)
+        os.replace(text_path + '.tmp', text_path)
+    if not quantize:
+        return vision_path, text_path
+
+    quantized = onnx_paths(model_dir, quantize=True)
+    for source, target in zip((vision_path, text_path), quantized):
+        if not os.path.exists(target):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            print(f"Quantizing {source} to int8")
+            quantize_dynamic(source, target + '.tmp', weight_type=QuantType.QInt8)
+            os.replace(target + '.tmp', target)
+    return quantized
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_name, model_dir=None, quantize=False, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime "
+                              "(plus torch and onnx for the one-time export)")
+        model_dir = model_dir or onnx_model_dir(model_name)
+        vision_path, text_path = export_onnx(model_name, model_dir, quantize=quantize)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = ['CPUExecutionProvider']
+        self.device = "cpu"
+        self.quantize = quantize
+        self.vision = onnxruntime.InferenceSession(vision_path, options, providers=providers)
+        self.text = onnxruntime.InferenceSession(text_path, options, providers=providers)
+
+    def embed_images(self, pixel_values):
+        return normalize(self.vision.run(None, {'pixel_values': np.asarray(pixel_values, dtype=np.float32)})[0])
+
+    def embed_texts(self, inputs):
+        feeds = {'input_ids': inputs['input_ids'].astype(np.int64),
+                 'attention_mask': inputs['attention_mask'].astype(np.int64)}
+        return normalize(self.text.run(None, feeds)[0])
+
+
+def create_backend(backend, model_name, device=None, num_threads=None, onnx_dir=None, quantize=False):
+    if backend == "torch":
+        return TorchBackend(model_name, device=device, num_threads=num_threads)
+    if backend == "onnx":
+        if device not in (None, "cpu"):
+            print(f"The onnx backend runs on CPU; ignoring device {device}")
+        return OnnxBackend(model_name, model_dir=onnx_dir, quantize=quantize, num_threads=num_threads)
+    raise ValueError(f"Unknown backend {backend}; choose one of {', '.join(BACKENDS)}")
+
+
+def check_equivalence(model_name, image_paths, texts, onnx_dir=None, quantize=False):
+    """Embed the same images and texts with torch and onnx.
+    Returns {"image": {...}, "text": {...}} with the minimum cosine similarity, the maximum
+    absolute difference and the ms per item of each backend."""
+    from transformers import CLIPProcessor
+    from PIL import Image
+
+    processor = CLIPProcessor.from_pretrained(model_name)
+    pixel_values = processor(images=[Image.open(path).convert('RGB') for path in image_paths],
+                             return_tensors="np")["pixel_values"]
+    text_inputs = dict(processor(text=list(texts), return_tensors="np", padding=True))
+    text_inputs = {k: text_inputs[k] for k in ('input_ids', 'attention_mask')}
+    backends = [TorchBackend(model_name, device="cpu"), OnnxBackend(model_name, onnx_dir, quantize=quantize)]
+
+    report = {}
+    for kind, inputs, count in [("image", pixel_values, len(image_paths)), ("text", text_inputs, len(texts))]:
+        outputs, timings = [], []
+        for backend in backends:
+            embed = backend.embed_images if kind == "image" else backend.embed_texts
+            start = time.perf_counter()
+            outputs.append(embed(inputs))
+            timings.append((time.perf_counter() - start) * 1000 / max(1, count))
+        reference, candidate = outputs
+        report[kind] = {
+            "min_cosine": float(np.min(np.sum(reference * candidate, axis=1))),
+            "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+            "torch_ms": timings[0],
+            "onnx_ms": timings[1],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export CLIP to ONNX or check the onnx backend against torch.")
+    parser.add_argument('command', choices=['export', 'check'], help='export: write the ONNX towers; check: compare onnx and torch embeddings')
+    parser.add_argument('--model', type=str, default='openai/clip-vit-base-patch32', help='Name of the CLIP model')
+    parser.add_argument('--onnx-dir', type=str, default=None, help='Directory of the exported towers (default: onnx_models/<model>)')
+    parser.add_argument('--quantize', action='store_true', help='Use int8 dynamic quantization')
+    parser.add_argument('--images', type=str, default='dish_images', help='Image directory sampled for the check')
+    parser.add_argument('--samples', type=int, default=16, help='Images used for the check')
+    parser.add_argument('--min-cosine', type=float, default=None, help='Fail the check below this cosine similarity (default: 0.999, or 0.98 with --quantize)')
+    args = parser.parse_args()
+
+    model_dir = args.onnx_dir or onnx_model_dir(args.model)
+    if args.command == 'export':
+        for path in export_onnx(args.model, model_dir, quantize=args.quantize):
+            print(f"ONNX model: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+        return
+
+    image_paths = sorted(os.path.join(root, name) for root, _, files in os.walk(args.images)
+                         for name in files if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')))[:args.samples]
+    texts = ["pizza margherita", "pad thai", "borscht", "a photo of sushi", "chicken tikka masala", "paella"]
+    if not image_paths:
+        print(f"No images found in: {args.images}")
+        return
+    report = check_equivalence(args.model, image_paths, texts, model_dir, quantize=args.quantize)
+    threshold = args.min_cosine if args.min_cosine is not None else (0.98 if args.quantize else 0.999)
+    print(f"{'':>6} {'min cosine':>11} {'max |diff|':>11} {'torch ms':>9} {'onnx ms':>8}")
+    for kind, row in report.items():
+        print(f"{kind:>6} {row['min_cosine']:>11.5f} {row['max_abs_diff']:>11.5f} {row['torch_ms']:>9.2f} {row['onnx_ms']:>8.2f}")
+    passed = all(row["min_cosine"] >= threshold for row in report.values())
+    print(f"Equivalence check {'passed' if passed else 'FAILED'} (min cosine >= {threshold})")
+    if not passed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,14 +7,23 @@ All configuration is via command-line arguments.
 import os
 import json
 import time
-import requests
+from http_session import get_session, configure_session
+from progress_log import ProgressLog, iter_records
+import metrics
+from search_stats import SearchStats
 from PIL import Image
 import io
 from bs4 import BeautifulSoup
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlparse
 import re
 import argparse
+import threading
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+BLACKLIST_KEYWORDS = [
+    'store', 'logo', 'icon', 'vector', 'menu', 'sign', 'ad', 'stock', 'cartoon', 'drawing', 'clipart', 'illustration', 'banner', 'poster', 'symbol', 'button', 'emoji', 'emoticon', 'avatar', 'animation', 'sketch', 'painting', 'art', 'graphic', 'template', 'background', 'frame', 'label', 'price', 'discount', 'sale', 'offer', 'deal', 'shopping', 'buy', 'sell', 'order', 'delivery', 'restaurant', 'fastfood', 'cafe', 'bar', 'pub', 'drink', 'beverage', 'juice', 'soda', 'water', 'milk', 'coffee', 'tea', 'beer', 'wine', 'cocktail', 'liquor', 'alcohol', 'spirit', 'champagne', 'whiskey', 'vodka', 'rum', 'gin', 'brandy', 'cognac', 'liqueur', 'aperitif', 'digestif', 'mocktail', 'smoothie', 'shake', 'frappe', 'slush', 'ice', 'cream', 'dessert', 'cake', 'pie', 'tart', 'pudding', 'custard', 'mousse', 'souffle', 'brownie', 'cookie', 'biscuit', 'cracker', 'wafer', 'bar', 'candy', 'chocolate', 'sweet', 'sugar', 'honey', 'jam', 'jelly', 'marmalade', 'spread', 'butter', 'cheese', 'yogurt', 'curd', 'paneer', 'tofu', 'egg', 'omelette', 'scramble', 'boil', 'poach', 'fry', 'bake', 'roast', 'grill', 'barbecue', 'smoke', 'steam', 'stew', 'soup', 'broth', 'stock', 'consomme', 'bouillon', 'chowder', 'bisque', 'gazpacho', 'minestrone', 'goulash', 'borscht', 'tomato', 'vegetable', 'fruit', 'salad', 'greens', 'lettuce', 'spinach', 'kale', 'arugula', 'rocket', 'cabbage', 'coleslaw', 'slaw', 'kimchi', 'sauerkraut', 'pickle', 'relish', 'chutney', 'salsa', 'dip', 'spread', 'paste', 'puree', 'mash', 'mousse', 'foam', 'gel', 'jelly', 'pate', 'terrine', 'galantine', 'aspic', 'headcheese', 'brawn', 'souse', 'scrapple', 'liver', 'kidney', 'heart', 'tongue', 'tripe', 'sweetbread', 'brain', 'marrow', 'tail', 'feet', 'trotter', 'hock', 'shank', 'rib', 'loin', 'chop', 'cutlet', 'steak', 'roast', 'joint', 'rack', 'crown', 'saddle', 'haunch', 'leg', 'shoulder', 'breast', 'wing', 'drumstick', 'thigh', 'fillet', 'tenderloin', 'sirloin', 'rump', 'flank', 'brisket', 'plate', 'shortrib', 'back', 'neck', 'cheek', 'jowl', 'snout', 'ear', 'tail', 'hoof', 'horn', 'antler', 'bone', 'cartilage', 'gristle', 'fat', 'suet', 'lard', 'tallow', 'oil', 'butter', 'ghee', 'margarine', 'shortening', 'dripping', 'schmaltz', 'bacon', 'ham', 'sausage', 'salami', 'bologna', 'mortadella', 'prosciutto', 'pancetta', 'guanciale', 'lardo', 'coppa', 'capicola', 'soppressata', 'nduja', 'chorizo', 'linguica', 'andouille', 'boudin', 'blood', 'black', 'white', 'red', 'green', 'blue', 'yellow', 'orange', 'purple', 'pink', 'brown', 'grey', 'gray', 'beige', 'tan', 'ivory', 'cream', 'gold', 'silver', 'bronze', 'copper', 'pewter', 'platinum']
 
 
 def flatten_dish_list(dish_dict, path=None):
@@ -35,30 +44,136 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
-def is_large_image(img_bytes, min_width, min_height):
+def colorfulness(arr):
+    """Colorfulness of an RGB array (computed in float, so channel differences cannot wrap)"""
+    r, g, b = arr[:, :, 0], arr[:, :, 1], arr[:, :, 2]
+    rg = np.abs(r - g)
+    yb = np.abs(0.5 * (r + g) - b)
+    return float(np.sqrt(np.std(rg) ** 2 + np.std(yb) ** 2))
+
+
+def dhash(img, hash_size=8):
+    """64-bit difference hash of a PIL image: robust to resizing and recompression"""
+    pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class PerceptualHashIndex:
+    """Thread-safe set of perceptual hashes answering "is there a hash within max_distance bits?".
+    Hashes are bucketed by max_distance + 1 bands of 64 // bands bits; two hashes within
+    max_distance bits always agree on at least one band (pigeonhole), so only bucket-mates
+    need a Hamming distance check."""
+
+    def __init__(self, max_distance=6):
+        self.max_distance = max_distance
+        self.bands = min(64, max_distance + 1)
+        self.band_bits = 64 // self.bands
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _band_keys(self, h):
+        mask = (1 << self.band_bits) - 1
+        return [(b, (h >> (b * self.band_bits)) & mask) for b in range(self.bands)]
+
+    def add_if_new(self, h):
+        """Add h and return True, or return False if a near-duplicate is already present"""
+        keys = self._band_keys(h)
+        with self._lock:
+            for key in keys:
+                for other in self._buckets.get(key, ()):
+                    if bin(h ^ other).count('1') <= self.max_distance:
+                        return False
+            for key in keys:
+                self._buckets.setdefault(key, []).append(h)
+            return True
+
+
+def validate_image(img_bytes, min_width, min_height, min_filesize,
+                   min_aspect=0.7, max_aspect=1.5, colorfulness_threshold=20, thumbnail_size=128):
+    """Validate a candidate image with a single decode.
+    Cheap checks run first: file size, then width/height/aspect ratio from the header
+    (no pixel decode). Only survivors are decoded, straight to a small thumbnail, for
+    the colorfulness check. Returns (ok, stats) where stats holds the measured values
+    and, for rejected images, the rejection "reason"."""
+    stats = {"filesize": len(img_bytes)}
+    if len(img_bytes) < min_filesize:
+        return False, dict(stats, reason="filesize")
     try:
         img = Image.open(io.BytesIO(img_bytes))
         w, h = img.size
-        return w >= min_width and h >= min_height
     except Exception:
-        return False
+        return False, dict(stats, reason="unreadable")
+    stats.update(width=w, height=h, aspect=w / h if h else 0)
+    if w < min_width or h < min_height:
+        return False, dict(stats, reason="dimensions")
+    if not min_aspect < stats["aspect"] < max_aspect:
+        return False, dict(stats, reason="aspect_ratio")
+    try:
+        # draft() lets the JPEG decoder downscale while decoding instead of after
+        img.draft('RGB', (thumbnail_size, thumbnail_size))
+        img = img.convert('RGB')
+        img.thumbnail((thumbnail_size, thumbnail_size))
+        stats["colorfulness"] = colorfulness(np.asarray(img, dtype=np.float32))
+        stats["phash"] = dhash(img)
+    except Exception:
+        # Keep images whose pixels cannot be analysed; the header already looked fine
+        return True, stats
+    if stats["colorfulness"] <= colorfulness_threshold:
+        return False, dict(stats, reason="colorfulness")
+    return True, stats
+
+
+def probe_dimensions(prefix):
+    """Image (width, height) parsed from the first bytes of a file, or None if the header is incomplete"""
+    try:
+        return Image.open(io.BytesIO(prefix)).size
+    except Exception:
+        return None
 
 
-def download_image(url, min_width, min_height, min_filesize, headers):
+def download_image(url, min_width, min_height, min_filesize, headers,
+                   max_filesize=10 * 1024 * 1024, probe_bytes=16 * 1024, chunk_size=16 * 1024):
+    """Stream and validate a candidate. Returns (img_bytes, stats); img_bytes is None if rejected.
+    Content-Type and Content-Length are checked before the body is read, dimensions are parsed
+    from the first few KB, and the transfer is aborted as soon as a rule clearly fails or the
+    body grows past max_filesize."""
     try:
-        resp = requests.get(url, headers=headers, timeout=15)
-        if resp.status_code == 200 and resp.headers.get('content-type', '').startswith('image'):
-            if len(resp.content) >= min_filesize and is_large_image(resp.content, min_width, min_height):
-                return resp.content
+        with get_session().get(url, headers=headers, timeout=15, stream=True) as resp:
+            if resp.status_code != 200:
+                return None, {"reason": "http_status", "status": resp.status_code}
+            if not resp.headers.get('content-type', '').startswith('image'):
+                return None, {"reason": "content_type"}
+            content_length = resp.headers.get('content-length')
+            if content_length and content_length.isdigit():
+                if int(content_length) < min_filesize:
+                    return None, {"reason": "filesize", "filesize": int(content_length)}
+                if int(content_length) > max_filesize:
+                    return None, {"reason": "max_filesize", "filesize": int(content_length)}
+
+            body = bytearray()
+            dims = None
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                body.extend(chunk)
+                if len(body) > max_filesize:
+                    return None, {"reason": "max_filesize", "filesize": len(body)}
+                # Give up probing after a few attempts; validate_image checks the full file anyway
+                if dims is None and probe_bytes <= len(body) <= 4 * probe_bytes:
+                    dims = probe_dimensions(bytes(body))
+                    if dims and (dims[0] < min_width or dims[1] < min_height):
+                        return None, {"reason": "dimensions", "width": dims[0], "height": dims[1],
+                                      "bytes_read": len(body)}
+        img_bytes = bytes(body)
+        ok, stats = validate_image(img_bytes, min_width, min_height, min_filesize)
+        return (img_bytes if ok else None), stats
     except Exception:
-        pass
-    return None
+        return None, {"reason": "request_error"}
 
 
 def google_image_search(query, max_results=10, headers=None):
     search_url = f"https://www.google.com/search?q={quote_plus(query)}&tbm=isch"
     try:
-        resp = requests.get(search_url, headers=headers, timeout=10)
+        resp = get_session().get(search_url, headers=headers, timeout=10)
         soup = BeautifulSoup(resp.text, 'html.parser')
         image_urls = []
         for img in soup.find_all('img'):
@@ -75,7 +190,7 @@ def google_image_search(query, max_results=10, headers=None):
 def bing_image_search(query, max_results=10, headers=None):
     search_url = f"https://www.bing.com/images/search?q={quote_plus(query)}"
     try:
-        resp = requests.get(search_url, headers=headers, timeout=10)
+        resp = get_session().get(search_url, headers=headers, timeout=10)
         soup = BeautifulSoup(resp.text, 'html.parser')
         image_urls = []
         for a in soup.find_all('a', class_='iusc'):
@@ -100,7 +215,7 @@ def bing_image_search(query, max_results=10, headers=None):
 def duckduckgo_image_search(query, max_results=10, headers=None):
     try:
         url = f"https://duckduckgo.com/?q={quote_plus(query)}&iax=images&ia=images"
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = get_session().get(url, headers=headers, timeout=10)
         vqd = re.search(r'vqd=([\d-]+)&', resp.text)
         if not vqd:
             vqd = re.search(r'vqd=([\d-]+)', resp.text)
@@ -108,7 +223,7 @@ def duckduckgo_image_search(query, max_results=10, headers=None):
             return []
         vqd = vqd.group(1)
         api_url = f"https://duckduckgo.com/i.js?l=us-en&o=json&q={quote_plus(query)}&vqd={vqd}"
-        resp = requests.get(api_url, headers=headers, timeout=10)
+        resp = get_session().get(api_url, headers=headers, timeout=10)
         data = resp.json()
         return [r['image'] for r in data.get('results', [])[:max_results]]
     except Exception:
@@ -120,110 +235,253 @@ def is_blacklisted(url, blacklist_keywords):
     return any(keyword in url_lower for keyword in blacklist_keywords)
 
 
-def is_reasonable_aspect_ratio(img_bytes):
-    try:
-        img = Image.open(io.BytesIO(img_bytes))
-        w, h = img.size
-        aspect = w / h if h != 0 else 0
-        return 0.7 < aspect < 1.5
-    except Exception:
-        return False
+class HostRateLimiter:
+    """Enforces a minimum interval between requests to the same host (replaces a global sleep)"""
 
+    def __init__(self, min_interval=0.5):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+SEARCHERS = [
+    (google_image_search, "https://www.google.com/"),
+    (bing_image_search, "https://www.bing.com/"),
+    (duckduckgo_image_search, "https://duckduckgo.com/"),
+]
 
-def is_colorful(img_bytes, threshold=20):
-    try:
-        img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-        arr = np.array(img)
-        (r, g, b) = arr[:,:,0], arr[:,:,1], arr[:,:,2]
-        rg = np.abs(r - g)
-        yb = np.abs(0.5 * (r + g) - b)
-        std_rg = np.std(rg)
-        std_yb = np.std(yb)
-        colorfulness = np.sqrt(std_rg**2 + std_yb**2)
-        return colorfulness > threshold
-    except Exception:
-        return True
+
+QUERY_VARIANTS = [
+    "{dish} food dish",
+    "traditional {dish} food",
+    "homemade {dish}",
+    "{dish} recipe",
+    "{dish} cooked dish",
+]
+
+
+def query_variants(dish_name):
+    return [variant.format(dish=dish_name) for variant in QUERY_VARIANTS]
+
+
+def engine_name(searcher):
+    return searcher.__name__.replace('_image_search', '')
+
+
+def run_search(searcher, host_url, query, headers, limiter, search_stats=None, key=None):
+    limiter.wait(host_url)
+    start = time.perf_counter()
+    urls = searcher(query, max_results=15, headers=headers)
+    elapsed = time.perf_counter() - start
+    metrics.observe('search_request', elapsed, engine=engine_name(searcher))
+    metrics.incr('search_results', len(urls), engine=engine_name(searcher))
+    if search_stats is not None:
+        search_stats.record_search(key, elapsed, len(urls))
+    return urls
+
+
+def fetch_candidate(url, args, headers, limiter):
+    """Download a candidate image. Returns (img_bytes, stats); img_bytes is None unless it passes all checks"""
+    limiter.wait(url)
+    start = time.perf_counter()
+    img_bytes, stats = download_image(url, args.min_width, args.min_height, args.min_filesize, headers,
+                                      max_filesize=args.max_filesize)
+    stats["seconds"] = time.perf_counter() - start
+    metrics.observe('download', stats["seconds"])
+    if img_bytes is None:
+        metrics.incr('rejections', reason=stats.get('reason', 'unknown'))
+    return img_bytes, stats
+
+
+def scrape_dish(cuisine, subcuisine, dish_name, args, headers, pool, limiter, dedup=None, existing=(), progress=None,
+                search_stats=None, search_parallelism=2):
+    """Search engines/query variants and download candidates concurrently until
+    --max-images images are accepted. `existing` holds records saved by an earlier run,
+    so a partial dish continues from its next index. Each new record is appended to the
+    `progress` log as soon as its file is written. Returns the records of the new images.
+    Searches start in order of expected yield (`search_stats`, fixed order without it),
+    at most search_parallelism at a time and only while more candidate URLs are needed."""
+    max_images = args.max_images - len(existing)
+    cuisine_dir = os.path.join(args.output_dir, cuisine)
+    ensure_dir(cuisine_dir)
+    safe_dish_name = dish_name.replace(" ", "_").replace("/", "_")
+
+    searchers = {engine_name(searcher): (searcher, host_url) for searcher, host_url in SEARCHERS}
+    plan = [(engine, variant) for engine in searchers for variant in QUERY_VARIANTS]
+    if search_stats is not None:
+        plan, skipped = search_stats.schedule(plan)
+        for engine, variant in skipped:
+            metrics.incr('searches_skipped', engine=engine)
+    plan = deque(plan)
+    searches = {}
+    pending_urls = deque()
+    # Every candidate URL is credited to the (engine, variant) whose search found it first
+    url_sources = {}
+    tried_urls = {rec.get("url") for rec in existing}
+    downloads = {}
+    saved = []
+
+    while len(saved) < max_images:
+        # Keep a bounded number of downloads in flight so we do not overshoot --max-images by much
+        window = 2 * (max_images - len(saved))
+        # Start the next best search only while the known candidates cannot fill the window
+        while plan and len(searches) < search_parallelism and len(pending_urls) + len(downloads) < window:
+            engine, variant = plan.popleft()
+            searcher, host_url = searchers[engine]
+            query = variant.format(dish=dish_name)
+            future = pool.submit(run_search, searcher, host_url, query, headers, limiter, search_stats, (engine, variant))
+            searches[future] = (engine, variant)
+        while pending_urls and len(downloads) < window:
+            url = pending_urls.popleft()
+            downloads[pool.submit(fetch_candidate, url, args, headers, limiter)] = url
+        if not searches and not downloads:
+            break
+        done, _ = wait(list(searches) + list(downloads), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in searches:
+                source = searches.pop(future)
+                for url in future.result():
+                    if url in tried_urls or is_blacklisted(url, BLACKLIST_KEYWORDS):
+                        continue
+                    tried_urls.add(url)
+                    url_sources[url] = source
+                    pending_urls.append(url)
+                continue
+            url = downloads.pop(future)
+            img_bytes, stats = future.result()
+            accepted = img_bytes is not None and len(saved) < max_images
+            if accepted and dedup is not None and "phash" in stats and not dedup.add_if_new(stats["phash"]):
+                metrics.incr('rejections', reason='near_duplicate')
+                print(f"  Skipped near-duplicate: {url}")
+                accepted = False
+            if search_stats is not None:
+                search_stats.record_download(url_sources[url], stats["seconds"], accepted)
+            if not accepted:
+                continue
+            filename = os.path.join(cuisine_dir, f"{safe_dish_name}_{len(existing)+len(saved)+1}.jpg")
+            with open(filename, 'wb') as out:
+                out.write(img_bytes)
+            record = {
+                "cuisine": cuisine,
+                "subcategory": subcuisine,
+                "dish": dish_name,
+                "filename": filename,
+                "url": url,
+                "phash": f"{stats['phash']:016x}" if "phash" in stats else None,
+                "engine": url_sources[url][0],
+                "query_variant": url_sources[url][1]
+            }
+            saved.append(record)
+            metrics.incr('images_saved')
+            if progress is not None:
+                progress.append(record)
+            print(f"  Downloaded: {filename}")
+
+    # Stop early: drop searches and downloads that have not started yet
+    for future in list(searches) + list(downloads):
+        future.cancel()
+    return saved
 
 
 def main():
     parser = argparse.ArgumentParser(description="Scrape dish images from the web using a dish list.")
     parser.add_argument('--output-dir', type=str, default='dish_images', help='Directory to save images and progress file')
     parser.add_argument('--max-images', type=int, default=10, help='Max images per dish')
-    parser.add_argument('--progress-file', type=str, default=None, help='Path to save progress JSON (default: <output-dir>/scraping_progress.json)')
+    parser.add_argument('--progress-file', type=str, default=None, help='Append-only JSON Lines progress log, also used to resume (default: <output-dir>/scraping_progress.jsonl)')
     parser.add_argument('--dish-list', type=str, default='../data/dish_lists.json', help='Path to dish_lists.json')
     parser.add_argument('--min-width', type=int, default=300, help='Minimum image width')
     parser.add_argument('--min-height', type=int, default=300, help='Minimum image height')
     parser.add_argument('--min-filesize', type=int, default=20*1024, help='Minimum image file size in bytes')
+    parser.add_argument('--max-filesize', type=int, default=10*1024*1024, help='Abort downloads larger than this many bytes')
+    parser.add_argument('--phash-distance', type=int, default=6, help='Skip images within this many bits (dHash) of an already saved image; -1 disables')
+    parser.add_argument('--dish-workers', type=int, default=4, help='Dishes scraped in parallel')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Global cap on concurrent search/download requests')
+    parser.add_argument('--host-interval', type=float, default=0.5, help='Minimum seconds between requests to the same host')
+    parser.add_argument('--retries', type=int, default=3, help='Retries with backoff on 429/5xx responses')
+    parser.add_argument('--search-stats', type=str, default=None, help='Per engine/query variant yield and latency statistics, kept across runs (default: <output-dir>/search_stats.json)')
+    parser.add_argument('--verdicts', type=str, default=None, help='GPT verdict cache joined with the statistics (default: <output-dir>/gpt_verdicts.jsonl)')
+    parser.add_argument('--no-adaptive', action='store_true', help='Search engines and query variants in fixed order and never skip one')
+    parser.add_argument('--min-trials', type=int, default=20, help='Searches before an engine/variant without saved or GPT-approved images is skipped (one without any results is skipped after its warm-up)')
+    parser.add_argument('--warmup-trials', type=int, default=3, help='Searches every engine/variant gets before the statistics decide the order')
+    parser.add_argument('--explore', type=float, default=0.05, help='Probability of still trying a skipped engine/variant for a dish')
+    parser.add_argument('--search-parallelism', type=int, default=2, help='Searches in flight per dish')
     parser.add_argument('--user-agent', type=str, default='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36', help='User-Agent header for requests')
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    with metrics.instrument('scrape', args):
+        scrape_all(args)
+
 
+def scrape_all(args):
     output_dir = args.output_dir
-    max_images = args.max_images
-    progress_file = args.progress_file or os.path.join(output_dir, 'scraping_progress.json')
+    progress_file = args.progress_file or os.path.join(output_dir, 'scraping_progress.jsonl')
     dish_list_file = args.dish_list
-    min_width = args.min_width
-    min_height = args.min_height
-    min_filesize = args.min_filesize
     HEADERS = {'User-Agent': args.user_agent}
-    BLACKLIST_KEYWORDS = [
-        'store', 'logo', 'icon', 'vector', 'menu', 'sign', 'ad', 'stock', 'cartoon', 'drawing', 'clipart', 'illustration', 'banner', 'poster', 'symbol', 'button', 'emoji', 'emoticon', 'avatar', 'animation', 'sketch', 'painting', 'art', 'graphic', 'template', 'background', 'frame', 'label', 'price', 'discount', 'sale', 'offer', 'deal', 'shopping', 'buy', 'sell', 'order', 'delivery', 'restaurant', 'fastfood', 'cafe', 'bar', 'pub', 'drink', 'beverage', 'juice', 'soda', 'water', 'milk', 'coffee', 'tea', 'beer', 'wine', 'cocktail', 'liquor', 'alcohol', 'spirit', 'champagne', 'whiskey', 'vodka', 'rum', 'gin', 'brandy', 'cognac', 'liqueur', 'aperitif', 'digestif', 'mocktail', 'smoothie', 'shake', 'frappe', 'slush', 'ice', 'cream', 'dessert', 'cake', 'pie', 'tart', 'pudding', 'custard', 'mousse', 'souffle', 'brownie', 'cookie', 'biscuit', 'cracker', 'wafer', 'bar', 'candy', 'chocolate', 'sweet', 'sugar', 'honey', 'jam', 'jelly', 'marmalade', 'spread', 'butter', 'cheese', 'yogurt', 'curd', 'paneer', 'tofu', 'egg', 'omelette', 'scramble', 'boil', 'poach', 'fry', 'bake', 'roast', 'grill', 'barbecue', 'smoke', 'steam', 'stew', 'soup', 'broth', 'stock', 'consomme', 'bouillon', 'chowder', 'bisque', 'gazpacho', 'minestrone', 'goulash', 'borscht', 'tomato', 'vegetable', 'fruit', 'salad', 'greens', 'lettuce', 'spinach', 'kale', 'arugula', 'rocket', 'cabbage', 'coleslaw', 'slaw', 'kimchi', 'sauerkraut', 'pickle', 'relish', 'chutney', 'salsa', 'dip', 'spread', 'paste', 'puree', 'mash', 'mousse', 'foam', 'gel', 'jelly', 'pate', 'terrine', 'galantine', 'aspic', 'headcheese', 'brawn', 'souse', 'scrapple', 'liver', 'kidney', 'heart', 'tongue', 'tripe', 'sweetbread', 'brain', 'marrow', 'tail', 'feet', 'trotter', 'hock', 'shank', 'rib', 'loin', 'chop', 'cutlet', 'steak', 'roast', 'joint', 'rack', 'crown', 'saddle', 'haunch', 'leg', 'shoulder', 'breast', 'wing', 'drumstick', 'thigh', 'fillet', 'tenderloin', 'sirloin', 'rump', 'flank', 'brisket', 'plate', 'shortrib', 'back', 'neck', 'cheek', 'jowl', 'snout', 'ear', 'tail', 'hoof', 'horn', 'antler', 'bone', 'cartilage', 'gristle', 'fat', 'suet', 'lard', 'tallow', 'oil', 'butter', 'ghee', 'margarine', 'shortening', 'dripping', 'schmaltz', 'bacon', 'ham', 'sausage', 'salami', 'bologna', 'mortadella', 'prosciutto', 'pancetta', 'guanciale', 'lardo', 'coppa', 'capicola', 'soppressata', 'nduja', 'chorizo', 'linguica', 'andouille', 'boudin', 'blood', 'black', 'white', 'red', 'green', 'blue', 'yellow', 'orange', 'purple', 'pink', 'brown', 'grey', 'gray', 'beige', 'tan', 'ivory', 'cream', 'gold', 'silver', 'bronze', 'copper', 'pewter', 'platinum']
+    configure_session(pool_size=max(1, args.max_concurrency), retries=args.retries)
 
     ensure_dir(output_dir)
     with open(dish_list_file, 'r', encoding='utf-8') as f:
         dish_dict = json.load(f)
     flat_dishes = flatten_dish_list(dish_dict)
-    downloaded_images = []
+    limiter = HostRateLimiter(args.host_interval)
+    dedup = PerceptualHashIndex(args.phash_distance) if args.phash_distance >= 0 else None
+    search_stats = None
+    if not args.no_adaptive:
+        search_stats = SearchStats(args.search_stats or os.path.join(output_dir, 'search_stats.json'),
+                                   min_trials=args.min_trials, explore=args.explore, warmup_trials=args.warmup_trials)
+        search_stats.apply_verdicts(progress_file, args.verdicts or os.path.join(output_dir, 'gpt_verdicts.jsonl'))
+
+    # Resume: records from earlier runs, grouped per dish
+    existing = {}
+    if os.path.exists(progress_file):
+        for rec in iter_records(progress_file):
+            existing.setdefault((rec["cuisine"], rec["dish"]), []).append(rec)
+            if dedup is not None and rec.get("phash"):
+                dedup.add_if_new(int(rec["phash"], 16))
+        print(f"Resuming: {sum(len(r) for r in existing.values())} images already saved for {len(existing)} dishes")
+    downloaded = sum(len(r) for r in existing.values())
+    count_lock = threading.Lock()
 
-    for cuisine, subcuisine, dish_obj in flat_dishes:
+    def scrape(cuisine, subcuisine, dish_obj):
+        nonlocal downloaded
         dish_name = dish_obj["name"]
-        print(f"\nSearching for: {dish_name} ({cuisine}/{subcuisine})")
-        cuisine_dir = os.path.join(output_dir, cuisine)
-        ensure_dir(cuisine_dir)
-        found = 0
-        tried_urls = set()
-        query_variants = [
-            f"{dish_name} food dish",
-            f"traditional {dish_name} food",
-            f"homemade {dish_name}",
-            f"{dish_name} recipe",
-            f"{dish_name} cooked dish"
-        ]
-        for searcher in [google_image_search, bing_image_search, duckduckgo_image_search]:
-            for query in query_variants:
-                image_urls = searcher(query, max_results=15, headers=HEADERS)
-                for url in image_urls:
-                    if url in tried_urls or is_blacklisted(url, BLACKLIST_KEYWORDS):
-                        continue
-                    tried_urls.add(url)
-                    img_bytes = download_image(url, min_width, min_height, min_filesize, HEADERS)
-                    if img_bytes and is_reasonable_aspect_ratio(img_bytes) and is_colorful(img_bytes):
-                        safe_dish_name = dish_name.replace(" ", "_").replace("/", "_")
-                        filename = os.path.join(cuisine_dir, f"{safe_dish_name}_{found+1}.jpg")
-                        with open(filename, 'wb') as out:
-                            out.write(img_bytes)
-                        downloaded_images.append({
-                            "cuisine": cuisine,
-                            "subcategory": subcuisine,
-                            "dish": dish_name,
-                            "filename": filename,
-                            "url": url
-                        })
-                        print(f"  Downloaded: {filename}")
-                        found += 1
-                        if found >= max_images:
-                            break
-                    time.sleep(0.5)
-                if found >= max_images:
-                    break
-            if found >= max_images:
-                break
-        if found == 0:
+        previous = existing.get((cuisine, dish_name), [])
+        if len(previous) >= args.max_images:
+            return
+        print(f"\nSearching for: {dish_name} ({cuisine}/{subcuisine})"
+              + (f", continuing from image {len(previous) + 1}" if previous else ""))
+        saved = scrape_dish(cuisine, subcuisine, dish_name, args, HEADERS, network_pool, limiter, dedup,
+                            existing=previous, progress=progress, search_stats=search_stats,
+                            search_parallelism=max(1, args.search_parallelism))
+        if not saved and not previous:
             print(f"  No suitable images found for {dish_name}")
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(downloaded_images, f, indent=2)
+        with count_lock:
+            downloaded += len(saved)
+            if search_stats is not None:
+                search_stats.save()
+
+    with ProgressLog(progress_file) as progress, \
+            ThreadPoolExecutor(max_workers=max(1, args.max_concurrency)) as network_pool, \
+            ThreadPoolExecutor(max_workers=max(1, args.dish_workers)) as dish_pool:
+        for future in [dish_pool.submit(scrape, *dish) for dish in flat_dishes]:
+            future.result()
     print(f"\n=== Scraping completed! ===")
-    print(f"Total images downloaded: {len(downloaded_images)}")
+    print(f"Total images downloaded: {downloaded}")
     print(f"Results saved to: {progress_file}")
+    if search_stats is not None:
+        search_stats.save()
+        print(f"\n=== Search yield (saved to {search_stats.stats_file}) ===")
+        search_stats.print_table()
 
 
 if __name__ == "__main__":
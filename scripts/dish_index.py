@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Dish Index
+Dish-level aggregation of the image embeddings for two-stage retrieval. Every dish
+gets a centroid (the normalized mean of its image embeddings) and optionally a few
+medoid representatives. A query first ranks dishes by their best representative and
+then re-ranks only the images of the top dishes, so results are distinct dishes and
+the candidate set shrinks by the images-per-dish factor.
+
+Usage:
+  python dish_index.py build --embeddings dish_images/dish_embeddings.json --medoids 2
+  python dish_index.py eval --embeddings dish_images/dish_embeddings.json
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from embedding_index import EmbeddingIndex, SearchResultsMixin, normalize_rows, top_k_indices
+from embedding_store import load_embedding_matrix, binary_paths
+
+
+def dish_index_path(embeddings_file):
+    """Default location of the dish index next to the embeddings file"""
+    return os.path.splitext(binary_paths(embeddings_file)[0])[0] + '.dishes.npz'
+
+
+def medoid_representatives(x, count):
+    """Rows of x to use as representatives: the medoid, then farthest-first picks"""
+    sims = x @ x.T
+    chosen = [int(np.argmax(sims.sum(axis=1)))]
+    closest = sims[chosen[0]].copy()
+    while len(chosen) < min(count, len(x)):
+        chosen.append(int(np.argmin(closest)))
+        closest = np.maximum(closest, sims[chosen[-1]])
+    return chosen
+
+
+class DishIndex(SearchResultsMixin):
+    def __init__(self, records, matrix, dishes, centroids, image_order, image_offsets,
+                 representatives=None, rep_offsets=None):
+        self.records = records
+        self.matrix = normalize_rows(matrix)
+        self.dishes = dishes
+        self.centroids = centroids
+        # Image rows grouped by dish: image_order[image_offsets[d]:image_offsets[d + 1]]
+        self.image_order = image_order
+        self.image_offsets = image_offsets
+        # Optional medoids, grouped by dish the same way
+        self.representatives = representatives
+        self.rep_offsets = rep_offsets
+
+    @classmethod
+    def build(cls, records, matrix, medoids=0):
+        """Group image rows by (cuisine, dish) and compute centroids and medoid representatives"""
+        x = normalize_rows(matrix)
+        keys = [(record.get("cuisine", ""), record.get("dish", "")) for record in records]
+        dishes = sorted(set(keys))
+        dish_ids = {key: i for i, key in enumerate(dishes)}
+        assignments = np.array([dish_ids[key] for key in keys], dtype=np.int64)
+        image_order = np.argsort(assignments, kind='stable')
+        image_offsets = np.searchsorted(assignments[image_order], np.arange(len(dishes) + 1))
+
+        dim = x.shape[1] if x.ndim == 2 else 0
+        centroids = np.empty((len(dishes), dim), dtype=np.float32)
+        representatives, rep_counts = [], []
+        for d in range(len(dishes)):
+            rows = x[image_order[image_offsets[d]:image_offsets[d + 1]]]
+            centroids[d] = rows.mean(axis=0)
+            if medoids > 0:
+                chosen = medoid_representatives(rows, medoids)
+                representatives.append(rows[chosen])
+                rep_counts.append(len(chosen))
+        centroids = normalize_rows(centroids)
+        if medoids <= 0:
+            return cls(records, x, [{"cuisine": c, "dish": n} for c, n in dishes], centroids, image_order, image_offsets)
+        rep_offsets = np.concatenate(([0], np.cumsum(rep_counts))).astype(np.int64)
+        return cls(records, x, [{"cuisine": c, "dish": n} for c, n in dishes], centroids, image_order, image_offsets,
+                   np.concatenate(representatives).astype(np.float32), rep_offsets)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = dict(centroids=self.centroids, image_order=self.image_order, image_offsets=self.image_offsets,
+                      dishes=np.array(json.dumps(self.dishes, ensure_ascii=False)))
+        if self.representatives is not None:
+            arrays.update(representatives=self.representatives, rep_offsets=self.rep_offsets)
+        tmp_file = path + '.tmp.npz'
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path, records, matrix):
+        """Load a persisted dish index; records and matrix are the image embeddings it was built from"""
+        with np.load(path) as data:
+            if len(records) != int(data["image_offsets"][-1]):
+                raise ValueError(f"Dish index {path} was built for {int(data['image_offsets'][-1])} images, "
+                                 f"embeddings have {len(records)}; rebuild it")
+            has_reps = "representatives" in data
+            return cls(records, matrix, json.loads(str(data["dishes"])), data["centroids"], data["image_order"],
+                       data["image_offsets"], data["representatives"] if has_reps else None,
+                       data["rep_offsets"] if has_reps else None)
+
+    def dish_scores(self, queries):
+        """Similarity of every query to every dish: best of centroid and representatives"""
+        scores = queries @ self.centroids.T
+        if self.representatives is not None and len(self.representatives):
+            rep_scores = queries @ self.representatives.T
+            scores = np.maximum(scores, np.maximum.reduceat(rep_scores, self.rep_offsets[:-1], axis=1))
+        return scores
+
+    def search_indices(self, queries, top_k=5, images_per_dish=1):
+        """Return (indices, scores) of shape (n_queries, top_k * images_per_dish): the best images of the
+        top_k dishes, sorted by image similarity; missing slots are -1 / -inf"""
+        queries = normalize_rows(np.atleast_2d(queries))
+        width = top_k * images_per_dish
+        out_indices = np.full((len(queries), width), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), width), -np.inf, dtype=np.float32)
+        if len(self.dishes) == 0:
+            return out_indices, out_scores
+        top_dishes, _ = top_k_indices(self.dish_scores(queries), top_k)
+        for qi, dishes in enumerate(top_dishes):
+            ids, scores = [], []
+            for d in dishes:
+                rows = self.image_order[self.image_offsets[d]:self.image_offsets[d + 1]]
+                best, best_scores = top_k_indices((self.matrix[rows] @ queries[qi])[None, :], images_per_dish)
+                ids.append(rows[best[0]])
+                scores.append(best_scores[0])
+            ids, scores = np.concatenate(ids), np.concatenate(scores)
+            order = np.argsort(-scores, kind='stable')
+            out_indices[qi, :len(ids)] = ids[order]
+            out_scores[qi, :len(ids)] = scores[order]
+        return out_indices, out_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate the dish-level centroid index for two-stage search.")
+    parser.add_argument('command', choices=['build', 'eval'], help='build: aggregate and save the dish index; eval: compare with exact image search')
+    parser.add_argument('--embeddings', type=str, default='dish_images/dish_embeddings.json', help='Embeddings file (.json, .pkl, .bin or .meta.json)')
+    parser.add_argument('--index', type=str, default=None, help='Index path (default: <embeddings>.dishes.npz)')
+    parser.add_argument('--medoids', type=int, default=0, help='Medoid representatives per dish in addition to the centroid')
+    parser.add_argument('--top-k', type=int, default=3, help='Results per query')
+    parser.add_argument('--queries', type=int, default=200, help='Number of stored embeddings sampled as eval queries')
+    args = parser.parse_args()
+
+    index_path = args.index or dish_index_path(args.embeddings)
+    records, matrix = load_embedding_matrix(args.embeddings)
+    print(f"Loaded {len(records)} embeddings from: {args.embeddings}")
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        index = DishIndex.build(records, matrix, medoids=args.medoids)
+        index.save(index_path)
+        print(f"Built dish index ({len(index.dishes)} dishes, {args.medoids} medoids each) in {time.perf_counter() - start:.1f}s")
+        print(f"Index saved to: {index_path}")
+        return
+
+    exact = EmbeddingIndex(records, matrix)
+    index = DishIndex.load(index_path, records, exact.matrix)
+    rng = np.random.default_rng(0)
+    queries = exact.matrix[rng.choice(len(exact), min(args.queries, len(exact)), replace=False)]
+
+    start = time.perf_counter()
+    exact_indices, _ = exact.search_indices(queries, args.top_k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    dish_indices, _ = index.search_indices(queries, args.top_k)
+    dish_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    def distinct_dishes(rows):
+        return np.mean([len({(records[i].get("cuisine"), records[i].get("dish")) for i in row if i >= 0}) for row in rows])
+
+    sizes = np.diff(index.image_offsets)
+    print(f"{len(index.dishes)} dishes, {len(records) / max(1, len(index.dishes)):.1f} images per dish on average")
+    print(f"{'':>12} {'distinct dishes@' + str(args.top_k):>18} {'ms/query':>9}")
+    print(f"{'exact':>12} {distinct_dishes(exact_indices):>18.2f} {exact_ms:>9.3f}")
+    print(f"{'two-stage':>12} {distinct_dishes(dish_indices):>18.2f} {dish_ms:>9.3f}")
+    print(f"Top-1 agreement with exact search: {np.mean(dish_indices[:, 0] == exact_indices[:, 0]):.3f}")
+    print(f"Candidates scored per query: {len(index.dishes) + args.top_k * sizes.mean():.0f} (exact: {len(records)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Embedding Cache
+Persistent CLIP embedding cache keyed by image content hash plus model name,
+so reruns of the embedding step only send new or changed images through the model.
+The cache is an append-only JSON Lines log, so several processes can share it.
+Text embeddings get an in-memory LRU cache, optionally backed by the precomputed
+dish-name embeddings written by text_embeddings.py.
+"""
+
+import os
+import re
+import json
+import base64
+import hashlib
+import pickle
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking, run one writer at a time
+    fcntl = None
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on <path>.lock shared by every process using the file (no-op without fcntl)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def encode_record(key, embedding=None, paths=()):
+    rec = {'model': key[0], 'hash': key[1], 'paths': sorted(paths)}
+    if embedding is not None:
+        rec['embedding'] = base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode('ascii')
+    return json.dumps(rec, ensure_ascii=False)
+
+
+class EmbeddingCache:
+    """Append-only JSON Lines log of {model, hash, paths, embedding (base64 float32)} records.
+    Every new embedding is appended under a file lock as soon as it is computed, so stages
+    running at the same time (prefilter and embed with --stream) share their work:
+    refresh() picks up whatever other processes appended since the last read.
+    Entries remember the image files they were computed for and are pruned once all of
+    them are gone, so embeddings of images a stage skipped (e.g. pre-filter rejects) stay.
+    A pre-JSON Lines embedding_cache.pkl next to the log is imported once.
+
+    With write_file (shard workers, possibly on other hosts), the shared cache_file is only
+    read and new records go to write_file; fold_cache() merges them in afterwards."""
+
+    def __init__(self, cache_file, model_name, write_file=None):
+        self.cache_file = cache_file
+        self.write_file = write_file or cache_file
+        self.model_name = model_name
+        self.entries = {}
+        # Absolute paths of the images each entry was computed for or served to
+        self.paths = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        # (inode, offset) of the part of each log already read
+        self._positions = {}
+        self.load()
+
+    def load(self):
+        """Load cache entries from disk, starting empty if the file is missing or unreadable"""
+        legacy_file = os.path.splitext(self.cache_file)[0] + '.pkl'
+        if not os.path.exists(self.cache_file) and legacy_file != self.cache_file and os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, 'rb') as f:
+                    self.entries = pickle.load(f)
+                print(f"Imported {len(self.entries)} cached embeddings from: {legacy_file}")
+                self.save()
+            except Exception as e:
+                print(f"Could not read embedding cache {legacy_file}, starting empty: {e}")
+                self.entries = {}
+        self.refresh()
+        if self.write_file != self.cache_file:
+            self._read(self.write_file)
+        if self.entries:
+            print(f"Loaded {len(self.entries)} cached embeddings from: {self.cache_file}")
+
+    def refresh(self):
+        """Read the records appended to the cache since the last read"""
+        self._read(self.cache_file)
+
+    def _read(self, path):
+        """Read the records appended to path since the last read (everything if it was rewritten)"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        inode, offset = self._positions.get(path, (None, 0))
+        if stat.st_ino != inode or stat.st_size < offset:
+            offset = 0
+        if stat.st_size == offset:
+            self._positions[path] = (stat.st_ino, offset)
+            return
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # A record still being written is read on the next refresh
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                rec = json.loads(line)
+                key = (rec['model'], rec['hash'])
+                if 'embedding' in rec:
+                    self.entries[key] = np.frombuffer(base64.b64decode(rec['embedding']), dtype=np.float32)
+                self.paths.setdefault(key, set()).update(rec.get('paths', []))
+            except (ValueError, KeyError):
+                continue  # torn line from a crash
+        self._positions[path] = (stat.st_ino, offset + end)
+
+    def get(self, content_hash, path=None):
+        """Return the cached embedding for this image content, or None on a miss.
+        A hit for a new copy of the image (path) is recorded so pruning keeps the entry."""
+        key = (self.model_name, content_hash)
+        embedding = self.entries.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used.add(key)
+        if path is not None and os.path.abspath(path) not in self.paths.get(key, ()):
+            self.paths.setdefault(key, set()).add(os.path.abspath(path))
+            self._append(encode_record(key, paths=[os.path.abspath(path)]))
+        return embedding
+
+    def put(self, content_hash, embedding, path=None):
+        key = (self.model_name, content_hash)
+        self.entries[key] = np.asarray(embedding, dtype=np.float32)
+        self.used.add(key)
+        if path is not None:
+            self.paths.setdefault(key, set()).add(os.path.abspath(path))
+        self._append(encode_record(key, embedding, self.paths.get(key, ())))
+
+    def _append(self, record):
+        line = (record + '\n').encode('utf-8')
+        with file_lock(self.write_file):
+            with open(self.write_file, 'ab') as f:
+                position = (os.fstat(f.fileno()).st_ino, f.tell())
+                f.write(line)
+                # Skip our own record on the next read unless others appended before it
+                if self._positions.get(self.write_file) == position:
+                    self._positions[self.write_file] = (position[0], position[1] + len(line))
+
+    def prune(self):
+        """Drop entries whose image files are all gone. Entries without known files (imported
+        from the old cache) are dropped for this model when the current run did not use them."""
+        def stale(key):
+            paths = self.paths.get(key)
+            if paths:
+                return not any(os.path.exists(path) for path in paths)
+            return key[0] == self.model_name and key not in self.used
+
+        keys = [key for key in self.entries if stale(key)]
+        for key in keys:
+            del self.entries[key]
+            self.paths.pop(key, None)
+        return len(keys)
+
+    def save(self, prune=False):
+        """Rewrite the log compactly. Records appended by other processes are merged in first,
+        under the lock, so nothing they added is lost; returns the number of pruned entries."""
+        with file_lock(self.cache_file):
+            self.refresh()
+            pruned = self.prune() if prune else 0
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for key, embedding in self.entries.items():
+                    f.write(encode_record(key, embedding, self.paths.get(key, ())) + '\n')
+            os.replace(tmp_file, self.cache_file)
+            stat = os.stat(self.cache_file)
+            self._positions[self.cache_file] = (stat.st_ino, stat.st_size)
+        return pruned
+
+    def finish_run(self):
+        """Prune stale entries, compact the cache and print a hit/miss summary.
+        A shard leaves the shared cache alone; its new records wait in write_file for fold_cache()."""
+        if self.write_file != self.cache_file:
+            print(f"Embedding cache: {self.hits} hits, {self.misses} misses "
+                  f"(new entries in {self.write_file})")
+            return
+        pruned = self.save(prune=True)
+        print(f"Embedding cache: {self.hits} hits, {self.misses} misses, {pruned} pruned "
+              f"({len(self.entries)} entries in {self.cache_file})")
+
+
+def fold_cache(cache_file, shard_file):
+    """Append the complete records of a shard's cache log to the shared cache and remove it.
+    Returns the number of records folded in."""
+    if not os.path.exists(shard_file):
+        return 0
+    with open(shard_file, 'rb') as f:
+        data = f.read()
+    data = data[:data.rfind(b'\n') + 1]
+    with file_lock(cache_file):
+        with open(cache_file, 'ab') as f:
+            f.write(data)
+    os.remove(shard_file)
+    if os.path.exists(shard_file + '.lock'):
+        os.remove(shard_file + '.lock')
+    return data.count(b'\n')
+
+
+def normalize_text(text):
+    """Lookup key for dish names: lowercase, accents stripped, punctuation collapsed.
+    app.js uses the same rule (normalizeDishName)."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip()
+
+
+class TextEmbeddingCache:
+    """LRU cache of text embeddings keyed by exact text. Precomputed embeddings
+    (known dish names and aliases) are looked up by normalize_text() and never evicted."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.known = {}
+        self.hits = 0
+        self.misses = 0
+
+    def preload(self, texts, matrix):
+        for text, embedding in zip(texts, matrix):
+            self.known[normalize_text(text)] = np.asarray(embedding, dtype=np.float32)
+
+    def get(self, text):
+        embedding = self.entries.get(text)
+        if embedding is not None:
+            self.entries.move_to_end(text)
+        else:
+            embedding = self.known.get(normalize_text(text))
+        if embedding is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return embedding
+
+    def put(self, text, embedding):
+        if self.maxsize <= 0:
+            return
+        self.entries[text] = np.asarray(embedding, dtype=np.float32)
+        self.entries.move_to_end(text)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
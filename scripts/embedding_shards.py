@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Embedding Shards
+Splits one embedding build into N deterministic shards. Records are assigned to a
+shard by a stable hash of their dish name, so every image of a dish lands in the same
+shard and near-duplicate removal stays per dish. Each shard writes its own output
+(<name>.shard-<i>-of-<N>.json/.bin), and the merge command combines them. Shards read
+the shared embedding cache and log their new entries to embedding_cache.shard-<i>-of-<N>.jsonl,
+which merge folds back into the shared cache.
+
+Usage:
+  # all cores of one machine: N worker processes, then merge
+  python embedding_shards.py launch --shards 4 --input dish_images/filtered_progress.json
+  # several machines: run shard i of N on each host, copy the outputs together, then merge
+  python image_embedding_generator.py --shard 0/4 --torch-threads 8
+  python embedding_shards.py merge --shards 4
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+import subprocess
+import numpy as np
+
+from embedding_store import save_embeddings, load_embedding_matrix, binary_paths
+from embedding_cache import fold_cache
+from ann_index import IVFPQIndex, ann_index_path
+
+EMBED = 'image_embedding_generator.py'
+
+
+def parse_shard(text):
+    """Parse "i/N" into (i, N) with 0 <= i < N"""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, e.g. 0/4: {text}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, N): {text}")
+    return index, count
+
+
+def shard_of(key, count):
+    """Stable shard number for a key; unlike hash() it is the same in every process and host"""
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big') % count
+
+
+def in_shard(dish, shard):
+    return shard is None or shard_of(dish, shard[1]) == shard[0]
+
+
+def shard_path(path, shard):
+    """Per-shard variant of an output or cache path, e.g. dish_embeddings.shard-0-of-4.json"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def merge_shards(output_file, count, output_format="all", dtype="float32"):
+    """Concatenate the outputs of shards 0..count-1 into output_file; returns embeddings_data"""
+    embeddings_data = []
+    for index in range(count):
+        path = shard_path(output_file, (index, count))
+        if not os.path.exists(path):
+            path = binary_paths(path)[1]
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing output of shard {index}/{count}: {path}")
+        records, matrix = load_embedding_matrix(path)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        embeddings_data.extend(dict(record, embedding=row.tolist(), embedding_dim=len(row))
+                               for record, row in zip(records, matrix))
+        print(f"Shard {index}/{count}: {len(records)} embeddings from {path}")
+    save_embeddings(embeddings_data, output_file, output_format=output_format, dtype=dtype)
+    return embeddings_data
+
+
+def merge_caches(cache_file, count):
+    """Fold the cache logs of shards 0..count-1 into the shared cache; returns the records added"""
+    return sum(fold_cache(cache_file, shard_path(cache_file, (index, count))) for index in range(count))
+
+
+def launch(count, threads, output_file, cache_file, extra_args, output_format="all", dtype="float32"):
+    """Run count embedding workers in parallel on this machine, each limited to threads torch threads.
+    Returns True if every worker succeeded."""
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+    processes = []
+    for index in range(count):
+        cmd = [sys.executable, EMBED, '--shard', f'{index}/{count}', '--torch-threads', str(threads),
+               '--output', output_file, '--cache-file', cache_file, '--output-format', output_format,
+               '--embedding-dtype', dtype] + extra_args
+        processes.append(subprocess.Popen(cmd, env=env))
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    for index in failed:
+        print(f"Shard {index}/{count} failed")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded embedding generation: launch local workers or merge shard outputs.",
+                                     epilog="Unrecognized arguments of launch are passed on to image_embedding_generator.py.")
+    parser.add_argument('command', choices=['launch', 'merge'], help='launch: run N local workers and merge; merge: combine existing shard outputs')
+    parser.add_argument('--shards', type=int, default=os.cpu_count() or 1, help='Number of shards (default: one per core)')
+    parser.add_argument('--threads', type=int, default=None, help='Torch threads per worker (default: cores / shards)')
+    parser.add_argument('--output', type=str, default='dish_images/dish_embeddings.json', help='Merged output; shards write <output>.shard-<i>-of-<N>.*')
+    parser.add_argument('--cache-file', type=str, default='dish_images/embedding_cache.jsonl', help='Shared embedding cache the shard cache logs are folded into')
+    parser.add_argument('--output-format', choices=['json', 'binary', 'all'], default='all', help='Format of the shard and merged outputs')
+    parser.add_argument('--embedding-dtype', choices=['float32', 'float16', 'int8'], default='float32', help='Element type of the binary embedding matrix (int8 = per-vector quantized codes + scales)')
+    parser.add_argument('--build-ann-index', action='store_true', help='Also build the IVF-PQ ANN index for the merged output')
+    args, extra_args = parser.parse_known_args()
+    if args.command == 'merge' and extra_args:
+        parser.error(f"unrecognized arguments: {' '.join(extra_args)}")
+
+    count = max(1, args.shards)
+    if args.command == 'launch':
+        threads = args.threads or max(1, (os.cpu_count() or 1) // count)
+        print(f"Launching {count} embedding workers with {threads} torch threads each")
+        if not launch(count, threads, args.output, args.cache_file, extra_args, args.output_format, args.embedding_dtype):
+            sys.exit(1)
+
+    embeddings_data = merge_shards(args.output, count, args.output_format, args.embedding_dtype)
+    print(f"Merged {len(embeddings_data)} embeddings from {count} shards into: {args.output}")
+    print(f"Folded {merge_caches(args.cache_file, count)} shard cache records into: {args.cache_file}")
+    if args.build_ann_index and embeddings_data:
+        records = [{k: v for k, v in item.items() if k not in ("embedding", "embedding_dim")} for item in embeddings_data]
+        matrix = np.asarray([item["embedding"] for item in embeddings_data], dtype=np.float32)
+        IVFPQIndex.build(records, matrix).save(ann_index_path(args.output))
+        print(f"ANN index saved to: {ann_index_path(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Embedding Store
+Compact binary embedding format: a contiguous little-endian float32/float16 matrix
+(<name>.bin) plus a small JSON metadata file (<name>.meta.json) with the per-row
+cuisine, dish and url. Read back with np.memmap, or as a typed array in app.js.
+int8 stores symmetric per-vector quantization codes with one float32 scale per
+row in <name>.scales.bin (about 4x smaller than float32).
+"""
+
+import os
+import json
+import pickle
+import numpy as np
+
+METADATA_FIELDS = ("cuisine", "dish", "url", "relative_path", "text")
+SUPPORTED_DTYPES = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+
+
+def quantize_int8(matrix):
+    """Per-row symmetric int8 quantization; returns (codes, scales) with row ~= codes * scale"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+    scales = scales.astype('<f4')
+    safe = np.where(scales == 0, 1.0, scales)
+    codes = np.clip(np.rint(matrix / safe[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize_int8(codes, scales):
+    return np.asarray(codes, dtype=np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def scales_path(bin_file):
+    return os.path.splitext(bin_file)[0] + '.scales.bin'
+
+
+def binary_paths(output_file):
+    """Matrix and metadata paths for an embeddings output file (e.g. dish_embeddings.json)"""
+    base = output_file
+    for suffix in ('.meta.json', '.json', '.bin', '.pkl'):
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+    return base + '.bin', base + '.meta.json'
+
+
+def is_binary_embeddings_file(path):
+    return path.endswith('.bin') or path.endswith('.meta.json')
+
+
+def save_binary_embeddings(embeddings_data, output_file, dtype="float32"):
+    """Write embeddings as a contiguous matrix plus metadata; returns (matrix_file, meta_file).
+    Every file is written to a temporary name and renamed into place, metadata last, so readers
+    (and memmaps of the previous version) never see a half-written matrix."""
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}. Use one of {sorted(SUPPORTED_DTYPES)}")
+    bin_file, meta_file = binary_paths(output_file)
+    os.makedirs(os.path.dirname(bin_file) or ".", exist_ok=True)
+
+    dim = len(embeddings_data[0]["embedding"]) if embeddings_data else 0
+    matrix = np.empty((len(embeddings_data), dim), dtype="<f4" if dtype == "int8" else SUPPORTED_DTYPES[dtype])
+    for i, item in enumerate(embeddings_data):
+        matrix[i] = item["embedding"]
+    extra = {}
+    if dtype == "int8":
+        matrix, scales = quantize_int8(matrix)
+        scales.tofile(scales_path(bin_file) + '.tmp')
+        os.replace(scales_path(bin_file) + '.tmp', scales_path(bin_file))
+        extra["scale_file"] = os.path.basename(scales_path(bin_file))
+    matrix.tofile(bin_file + '.tmp')
+    os.replace(bin_file + '.tmp', bin_file)
+
+    meta = {
+        "format": 1,
+        "dtype": dtype,
+        "count": len(embeddings_data),
+        "dim": dim,
+        "matrix_file": os.path.basename(bin_file),
+        **extra,
+        "records": [{k: item[k] for k in METADATA_FIELDS if k in item} for item in embeddings_data],
+    }
+    with open(meta_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(meta_file + '.tmp', meta_file)
+    return bin_file, meta_file
+
+
+def save_embeddings(embeddings_data, output_file, output_format="all", dtype="float32"):
+    """Save embeddings as JSON/JS ("json"), a binary matrix with metadata ("binary") or both ("all")"""
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+
+    if output_format in ("json", "all"):
+        with open(output_file, 'w') as f:
+            json.dump(embeddings_data, f, indent=2)
+
+        # Save as JS file for fast loading in the web app
+        js_file = output_file.replace('.json', '.js')
+        with open(js_file, 'w', encoding='utf-8') as f:
+            f.write('const dishEmbeddings = ')
+            json.dump(embeddings_data, f, indent=2, ensure_ascii=False)
+            f.write(';\n')
+
+        print(f"Embeddings saved as JSON: {output_file}")
+        print(f"Embeddings saved as JS: {js_file}")
+
+    if output_format in ("binary", "all"):
+        bin_file, meta_file = save_binary_embeddings(embeddings_data, output_file, dtype=dtype)
+        print(f"Embeddings saved as {dtype} matrix: {bin_file}")
+        print(f"Embedding metadata saved to: {meta_file}")
+
+
+def load_binary_embeddings(path):
+    """Return (records, matrix) where matrix is a read-only np.memmap of shape (count, dim).
+    int8 files are dequantized to a float32 array; use load_quantized_embeddings to keep the codes."""
+    records, matrix, scales = load_quantized_embeddings(path)
+    if scales is not None:
+        matrix = dequantize_int8(matrix, scales)
+    return records, matrix
+
+
+def load_quantized_embeddings(path):
+    """Return (records, matrix, scales); scales is None unless the file stores int8 codes"""
+    _, meta_file = binary_paths(path)
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get("dtype") not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype in {meta_file}: {meta.get('dtype')}")
+    bin_file = os.path.join(os.path.dirname(meta_file), meta["matrix_file"])
+    shape = (meta["count"], meta["dim"])
+    if meta["count"] == 0:
+        matrix = np.empty(shape, dtype=SUPPORTED_DTYPES[meta["dtype"]])
+    else:
+        matrix = np.memmap(bin_file, dtype=SUPPORTED_DTYPES[meta["dtype"]], mode='r', shape=shape)
+    scales = None
+    if meta["dtype"] == "int8":
+        scale_file = os.path.join(os.path.dirname(meta_file), meta["scale_file"])
+        scales = np.fromfile(scale_file, dtype='<f4') if meta["count"] else np.empty(0, dtype=np.float32)
+    return meta["records"], matrix, scales
+
+
+def load_embedding_matrix(path):
+    """Return (records, matrix) from any embeddings file (.json, .pkl, .bin/.meta.json) without loading CLIP.
+    Records keep their metadata but not the "embedding" list."""
+    if is_binary_embeddings_file(path):
+        return load_binary_embeddings(path)
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            embeddings_data = json.load(f)
+    elif path.endswith('.pkl'):
+        with open(path, 'rb') as f:
+            embeddings_data = pickle.load(f)
+    else:
+        raise ValueError("Unsupported file format. Use .json, .pkl, .bin or .meta.json")
+    records = [{k: v for k, v in item.items() if k not in ("embedding", "embedding_dim")} for item in embeddings_data]
+    if not embeddings_data:
+        return records, np.empty((0, 0), dtype=np.float32)
+    return records, np.asarray([item["embedding"] for item in embeddings_data], dtype=np.float32)
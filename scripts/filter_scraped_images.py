@@ -1,11 +1,39 @@
 import os
+import re
 import json
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http_session import get_session, configure_session
+from progress_log import ProgressLog, iter_records, iter_record_batches
+import metrics
 from tqdm import tqdm
 import argparse
 
 
-def ask_gpt_filter_image(image_url, dish_name, api_key, api_url, model):
+class VerdictCache:
+    """Append-only JSON Lines cache of GPT verdicts keyed by (url, dish, model).
+    Every verdict is flushed as soon as it is known, so a crashed run loses nothing."""
+
+    def __init__(self, cache_file):
+        self.verdicts = {}
+        if os.path.exists(cache_file):
+            for rec in iter_records(cache_file):
+                self.verdicts[(rec['url'], rec['dish'], rec['model'])] = rec['passed']
+        self._log = ProgressLog(cache_file, fsync=False)
+
+    def get(self, url, dish, model):
+        return self.verdicts.get((url, dish, model))
+
+    def put(self, url, dish, model, passed):
+        self.verdicts[(url, dish, model)] = passed
+        self._log.append({'url': url, 'dish': dish, 'model': model, 'passed': passed})
+
+    def close(self):
+        self._log.close()
+
+
+def ask_gpt_filter_image(image_url, dish_name, api_key, api_url, model, timeout=60):
+    """Ask GPT whether the image is a clean photo of the dish.
+    Returns True/False, or None when no verdict was obtained (API or format error)."""
     prompt = f"""
 You are a food image expert. Given the following image and dish name, answer the following questions with only 'yes' or 'no' for each (in order, separated by commas):
 
@@ -32,65 +60,264 @@ Return your answer as a comma-separated list of 'yes' or 'no' (e.g., 'yes,yes,no
         'max_tokens': 10,
         'temperature': 0.0,
     }
-    response = requests.post(api_url, headers=headers, json=data)
+    with metrics.timer('gpt_call', mode='single'):
+        response = get_session().post(api_url, headers=headers, json=data, timeout=timeout)
+    metrics.incr('gpt_calls', mode='single', status=response.status_code)
     if response.status_code == 200:
         answer = response.json()['choices'][0]['message']['content'].strip().lower()
-        parts = [x.strip() for x in answer.split(',')]
-        if len(parts) == 4:
-            is_dish, is_food_photo, has_text_or_watermark, has_people = parts
-            return (
-                is_dish.startswith('yes') and
-                is_food_photo.startswith('yes') and
-                has_text_or_watermark.startswith('no') and
-                has_people.startswith('no')
-            )
-        else:
+        verdict = parse_answer(answer)
+        if verdict is None:
             print(f"Unexpected GPT answer format: {answer}")
-            return False
+        return verdict
     else:
         print(f"Error from GPT API: {response.status_code} {response.text}")
-        return False
+        return None
+
+
+def parse_answer(answer):
+    """Turn a 'yes,yes,no,no' answer into a pass/fail verdict, or None if it is malformed"""
+    parts = [x.strip() for x in answer.strip().lower().split(',')]
+    if len(parts) != 4 or not all(p.startswith(('yes', 'no')) for p in parts):
+        return None
+    is_dish, is_food_photo, has_text_or_watermark, has_people = parts
+    return (
+        is_dish.startswith('yes') and
+        is_food_photo.startswith('yes') and
+        has_text_or_watermark.startswith('no') and
+        has_people.startswith('no')
+    )
+
+
+def parse_batch_answer(answer, n_images):
+    """Parse a multi-image answer into a list of n_images verdicts (None where missing/malformed).
+    Accepts a JSON list like [{"image": 1, "answer": "yes,yes,no,no"}, ...] or lines like '1: yes,yes,no,no'.
+    Returns None if nothing usable was found."""
+    verdicts = [None] * n_images
+    match = re.search(r'\[.*\]', answer, re.S)
+    if match:
+        try:
+            for i, item in enumerate(json.loads(match.group(0))):
+                if isinstance(item, dict):
+                    number, text = item.get('image', i + 1), item.get('answer', '')
+                else:
+                    number, text = i + 1, item
+                if isinstance(number, int) and 1 <= number <= n_images and isinstance(text, str):
+                    verdicts[number - 1] = parse_answer(text)
+        except ValueError:
+            pass
+    if all(v is None for v in verdicts):
+        for number, text in re.findall(r'^\W*(?:image\s*)?(\d+)\s*[:.)\-]\s*(.+)$', answer, re.M | re.I):
+            if 1 <= int(number) <= n_images:
+                verdicts[int(number) - 1] = parse_answer(text)
+    if all(v is None for v in verdicts):
+        return None
+    return verdicts
+
+
+class GPTAPIError(RuntimeError):
+    """Non-200 response from the GPT API (after the session's retries)"""
+
+
+def ask_gpt_filter_images(image_urls, dish_name, api_key, api_url, model, timeout=60):
+    """Check several candidate images of the same dish in one request.
+    Returns a list of verdicts aligned with image_urls (None for images without a usable answer),
+    or None if the answer could not be parsed at all. Raises GPTAPIError on an error response."""
+    image_list = "\n".join(f"Image {i + 1}: {url}" for i, url in enumerate(image_urls))
+    prompt = f"""
+You are a food image expert. For each of the following images of the same dish, answer the following questions with only 'yes' or 'no' for each (in order, separated by commas):
+
+1. Does this image represent the dish? (Is it a correct match for the dish name?)
+2. Is this a real photo of a cooked food dish (not a drawing, logo, menu, or people)?
+3. Does this image contain visible text or a watermark?
+4. Does this image contain people?
+
+Dish name: {dish_name}
+{image_list}
+
+Return only a JSON array with one object per image, in order, e.g.
+[{{"image": 1, "answer": "yes,yes,no,no"}}, {{"image": 2, "answer": "no,yes,no,no"}}]
+Do not add any explanation.
+"""
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json',
+    }
+    data = {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": "You are a food image expert."},
+            {"role": "user", "content": prompt}
+        ],
+        'max_tokens': 20 + 25 * len(image_urls),
+        'temperature': 0.0,
+    }
+    with metrics.timer('gpt_call', mode='batch'):
+        response = get_session().post(api_url, headers=headers, json=data, timeout=timeout)
+    metrics.incr('gpt_calls', mode='batch', status=response.status_code)
+    metrics.incr('gpt_images', len(image_urls), mode='batch')
+    if response.status_code != 200:
+        raise GPTAPIError(f"Error from GPT API: {response.status_code} {response.text}")
+    answer = response.json()['choices'][0]['message']['content']
+    verdicts = parse_batch_answer(answer, len(image_urls))
+    if verdicts is None:
+        print(f"Unexpected GPT batch answer format: {answer.strip()}")
+    return verdicts
+
 
 def main():
     parser = argparse.ArgumentParser(description="Filter scraped images using GPT for dish relevance and quality.")
-    parser.add_argument('--input', type=str, default='dish_images/scraping_progress.json', help='Input JSON file with scraped images')
-    parser.add_argument('--output', type=str, default='dish_images/filtered_progress.json', help='Output JSON file for filtered images')
+    parser.add_argument('--input', type=str, default='dish_images/scraping_progress.jsonl', help='Scraped images (JSON Lines progress log or JSON array)')
+    parser.add_argument('--output', type=str, default='dish_images/filtered_progress.json', help='Output file for filtered images (.jsonl is appended to as verdicts arrive)')
     parser.add_argument('--api-key', type=str, default=None, help='OpenAI API key (or set OPENAI_API_KEY env var)')
-    parser.add_argument('--api-url', type=str, default='https://api.openai.com/v1/chat/completions', help='OpenAI API URL')
+    parser.add_argument('--api-url', type=str, default='https://api.openai.com/v1/chat/completions', help='OpenAI API URL (point at a local mock for testing)')
     parser.add_argument('--model', type=str, default='gpt-4.1-nano', help='OpenAI model name')
+    parser.add_argument('--retries', type=int, default=5, help='Retries with backoff on 429/5xx responses (honours Retry-After)')
+    parser.add_argument('--backoff', type=float, default=1.0, help='Exponential backoff factor in seconds between retries')
+    parser.add_argument('--timeout', type=float, default=60, help='Timeout in seconds for each GPT request')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent GPT requests')
+    parser.add_argument('--verdict-cache', type=str, default='dish_images/gpt_verdicts.jsonl', help='Persistent verdict cache (JSON Lines) keyed by url, dish and model')
+    parser.add_argument('--batch-size', type=int, default=1, help='Images of the same dish checked per GPT request (1 = one request per image)')
+    parser.add_argument('--no-cache', action='store_true', help='Query GPT for every image, ignoring the verdict cache')
+    parser.add_argument('--follow', action='store_true', help='Keep reading a .jsonl input while an upstream stage is still writing it (until <input>.done exists)')
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    with metrics.instrument('filter', args):
+        filter_images(args)
 
+
+def filter_images(args):
     input_json = args.input
     output_json = args.output or input_json
     api_key = args.api_key or os.getenv('OPENAI_API_KEY')
     api_url = args.api_url
     model = args.model
+    configure_session(pool_size=max(1, args.workers), retries=args.retries, backoff=args.backoff)
 
     if not api_key:
         print("Error: OpenAI API key must be provided via --api-key or OPENAI_API_KEY env var.")
         return
 
-    with open(input_json, 'r', encoding='utf-8') as f:
-        images = json.load(f)
+    cache = None if args.no_cache else VerdictCache(args.verdict_cache)
+    # A .jsonl output is appended to as verdicts arrive so a following stage can stream it
+    stream_output = output_json.endswith('.jsonl')
+    if stream_output and os.path.exists(output_json):
+        # Truncate in place so a follower that already opened the log keeps reading this file
+        open(output_json, 'w').close()
+    output_log = ProgressLog(output_json, fsync=False) if stream_output else None
 
-    filtered = []
-    for rec in tqdm(images, desc='Filtering images'):
-        url = rec.get('url')
-        dish = rec.get('dish')
-        if not url or not dish:
-            continue
+    images = []
+    verdicts = {}
+    known = 0
+
+    def record(i, passed):
+        # Only real verdicts are cached; errors are retried on the next run
+        if passed is not None and cache:
+            cache.put(images[i]['url'], images[i]['dish'], model, passed)
+        return i, passed
+
+    def check(i):
+        rec = images[i]
         try:
-            passed = ask_gpt_filter_image(url, dish, api_key, api_url, model)
+            passed = ask_gpt_filter_image(rec['url'], rec['dish'], api_key, api_url, model, timeout=args.timeout)
         except Exception as e:
-            print(f"Error for {url}: {e}")
-            passed = False
-        if passed:
+            print(f"Error for {rec['url']}: {e}")
+            metrics.incr('gpt_calls', mode='single', status='error')
+            passed = None
+        return record(i, passed)
+
+    def check_batch(batch):
+        if len(batch) == 1:
+            return [check(batch[0])]
+        try:
+            batch_verdicts = ask_gpt_filter_images([images[i]['url'] for i in batch], images[batch[0]]['dish'],
+                                                   api_key, api_url, model, timeout=args.timeout)
+        except Exception as e:
+            # The endpoint is failing (retries are spent): splitting the batch would only multiply
+            # the requests, so leave the images without a verdict for the next run
+            print(f"Error for batch of {len(batch)} images: {e}")
+            if not isinstance(e, GPTAPIError):
+                metrics.incr('gpt_calls', mode='batch', status='error')
+            return [record(i, None) for i in batch]
+        if batch_verdicts is None:
+            batch_verdicts = [None] * len(batch)
+        # Fall back to single-image requests where the answer was malformed or skipped an image
+        return [record(i, passed) if passed is not None else check(i) for i, passed in zip(batch, batch_verdicts)]
+
+    def decide(i, passed, source='gpt'):
+        metrics.incr('verdicts', source=source, verdict='pass' if passed else ('reject' if passed is False else 'none'))
+        if not passed:
+            metrics.incr('rejections', reason='gpt' if passed is False else 'no_verdict')
+        verdicts[i] = bool(passed)
+        if passed and output_log:
+            output_log.append(images[i])
+
+    batch_size = max(1, args.batch_size)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool, \
+                tqdm(total=0, desc='Filtering images') as pbar:
+            futures = set()
+
+            def collect(done):
+                for future in done:
+                    results = future.result()
+                    for i, passed in results:
+                        decide(i, passed)
+                    pbar.update(len(results))
+                futures.difference_update(done)
+
+            # With --follow, new records arrive in batches while the upstream stage runs
+            for new_records in iter_record_batches(input_json, follow=args.follow):
+                start = len(images)
+                images.extend(new_records)
+                pending = []
+                for i in range(start, len(images)):
+                    rec = images[i]
+                    url = rec.get('url')
+                    dish = rec.get('dish')
+                    if not url or not dish:
+                        continue
+                    # Confident local pre-filter accepts (prefilter_images.py) skip the API
+                    if rec.get('prefilter') == 'accept':
+                        decide(i, True, source='prefilter')
+                        known += 1
+                        continue
+                    cached = cache.get(url, dish, model) if cache else None
+                    if cached is None:
+                        pending.append(i)
+                    else:
+                        decide(i, cached, source='cache')
+                        known += 1
+
+                # Group pending images by dish so a batch always shares one dish name
+                by_dish = {}
+                for i in pending:
+                    by_dish.setdefault(images[i]['dish'], []).append(i)
+                pbar.total += len(pending)
+                pbar.refresh()
+                for indices in by_dish.values():
+                    for offset in range(0, len(indices), batch_size):
+                        futures.add(pool.submit(check_batch, indices[offset:offset + batch_size]))
+                collect({future for future in futures if future.done()})
+            collect(list(as_completed(futures)))
+    finally:
+        if cache:
+            cache.close()
+        if output_log:
+            output_log.close()
+    print(f"{known} verdicts from cache or pre-filter, {len(verdicts) - known} images queried")
+
+    filtered = []
+    for i, rec in enumerate(images):
+        if i not in verdicts:
+            continue
+        if verdicts[i]:
             filtered.append(rec)
         else:
-            print(f"Filtered out: {dish} | {url}")
+            print(f"Filtered out: {rec['dish']} | {rec['url']}")
 
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(filtered, f, indent=2, ensure_ascii=False)
+    if not stream_output:
+        with open(output_json, 'w', encoding='utf-8') as f:
+            json.dump(filtered, f, indent=2, ensure_ascii=False)
     print(f"Filtered {len(images) - len(filtered)} images. Remaining: {len(filtered)}")
 
 
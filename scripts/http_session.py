@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+HTTP Session
+Shared pooled requests session for all pipeline network calls: keep-alive
+connection pools with a configurable size per host, and retries with
+exponential backoff on 429/5xx responses (honouring Retry-After).
+"""
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=16, retries=3, backoff=0.5, max_hosts=64):
+    """Build a session whose adapters keep up to pool_size connections alive per host"""
+    retry = Retry(
+        total=retries,
+        connect=0,
+        read=0,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure_session(pool_size=16, retries=3, backoff=0.5):
+    """Replace the shared session, e.g. with settings from command-line arguments"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_size=pool_size, retries=retries, backoff=backoff)
+    return _session
+
+
+def get_session():
+    """Return the shared session, creating it with default settings on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
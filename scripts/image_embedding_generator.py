@@ -8,62 +8,228 @@ import os
 import json
 import numpy as np
 from PIL import Image
-import torch
-from transformers import CLIPProcessor, CLIPModel
 import pickle
 from tqdm import tqdm
 import argparse
 import sys
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import EmbeddingCache, TextEmbeddingCache, file_hash
+from progress_log import iter_records, iter_record_batches
+from embedding_store import save_embeddings, load_binary_embeddings, is_binary_embeddings_file
+from embedding_index import EmbeddingIndex, near_duplicate_mask
+from ann_index import IVFPQIndex, ann_index_path
+from clip_backends import BACKENDS, create_backend
+import metrics
+from embedding_shards import parse_shard, in_shard, shard_path
 
 
 class ImageEmbeddingGenerator:
-    def __init__(self, model_name="Xenova/clip-vit-base-patch32", device=None):
+    def __init__(self, model_name="Xenova/clip-vit-base-patch32", device=None, batch_size=32,
+                 num_workers=0, prefetch_batches=2, cache_file=None, cache_write_file=None,
+                 output_format="all", embedding_dtype="float32", dedup_threshold=None, shard=None,
+                 text_cache_size=1024, text_embeddings_file=None, backend="torch", onnx_dir=None, quantize=False,
+                 num_threads=None):
         self.model_name = model_name
-        self.device = device if device else ("cuda" if torch.cuda.is_available() else "cpu")
-        
-        print(f"Loading CLIP model: {model_name}")
-        print(f"Using device: {self.device}")
+        self.device = device
+        self.batch_size = max(1, batch_size)
+        # num_workers > 0 decodes/preprocesses images in a thread pool ahead of inference
+        self.num_workers = max(0, num_workers)
+        self.prefetch_batches = max(1, prefetch_batches)
+        # "torch" or "onnx" (see clip_backends.py); the model is loaded on first use
+        self.backend_name = backend
+        self.onnx_dir = onnx_dir
+        self.quantize = quantize
+        self.num_threads = num_threads
+        self._backend = None
+        self._processor = None
+        self._load_lock = threading.Lock()
+        # int8 embeddings are close to but not the same as float ones, so they get their own cache entries
+        cache_key = f"{model_name}#onnx-int8" if quantize and backend == "onnx" else model_name
+        self.cache = EmbeddingCache(cache_file, cache_key, write_file=cache_write_file) if cache_file else None
+        # "json" (JSON + JS), "binary" (matrix + metadata) or "all"
+        self.output_format = output_format
+        self.embedding_dtype = embedding_dtype
+        # Cosine similarity at which images of the same dish count as near-duplicates (None = keep all)
+        self.dedup_threshold = dedup_threshold
+        # (i, N): only embed the dishes that hash to shard i of N (see embedding_shards.py)
+        self.shard = shard
+        # Repeated text queries and known dish names (text_embeddings.py) skip the text tower
+        self.text_cache = TextEmbeddingCache(text_cache_size)
+        if text_embeddings_file:
+            self.load_text_embeddings(text_embeddings_file)
+        # Search index built once per loaded embeddings_data list
+        self._index_source = None
+        self._index = None
 
-        self.model = CLIPModel.from_pretrained(model_name)
-        self.processor = CLIPProcessor.from_pretrained(model_name)
+    def load_model(self):
+        """Load the processor and the inference backend (imports torch/transformers/onnxruntime)"""
+        with self._load_lock:
+            if self._backend is not None:
+                return
+            from transformers import CLIPProcessor
+
+            print(f"Loading CLIP model: {self.model_name} ({self.backend_name} backend"
+                  f"{', int8' if self.quantize else ''})")
+            start = time.perf_counter()
+            self._processor = CLIPProcessor.from_pretrained(self.model_name)
+            self._backend = create_backend(self.backend_name, self.model_name, device=self.device,
+                                           num_threads=self.num_threads, onnx_dir=self.onnx_dir, quantize=self.quantize)
+            self.device = self._backend.device
+            print(f"Using device: {self.device}")
+            print(f"Model loaded successfully in {time.perf_counter() - start:.1f}s!")
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            self.load_model()
+        return self._processor
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self.load_model()
+        return self._backend
 
-        self.model.to(self.device)
-        self.model.eval()
-        
-        print("Model loaded successfully!")
-        
     def preprocess_image(self, image_path):
-        """Preprocess image for CLIP model"""
+        """Decode an image and preprocess it for CLIP (pixel values stay on CPU)"""
         try:
-            image = Image.open(image_path).convert('RGB')
-            inputs = self.processor(images=image, return_tensors="pt", padding=True)
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            return inputs
-            
+            with metrics.timer('decode'):
+                image = Image.open(image_path).convert('RGB')
+            with metrics.timer('preprocess'):
+                inputs = self.processor(images=image, return_tensors="np")
+            return inputs["pixel_values"]
+
         except Exception as e:
             print(f"Error preprocessing {image_path}: {e}")
+            metrics.incr('rejections', reason='unreadable')
             return None
-    
-    def generate_embedding(self, image_path):
-        """Generate embedding for a single image"""
+
+    def embed_pixel_values(self, pixel_values):
+        """Run a single forward pass over a list of preprocessed images"""
+        backend = self.backend
+        start = time.perf_counter()
+        embeddings = backend.embed_images(np.concatenate(pixel_values, axis=0))
+        elapsed = time.perf_counter() - start
+        metrics.observe('inference_batch', elapsed)
+        metrics.observe('inference_per_image', elapsed / len(pixel_values))
+        return embeddings
+
+    def embed_batch(self, pixel_values):
+        """Embed preprocessed images in one forward pass.
+        Returns a list aligned with pixel_values; None entries are skipped and
+        if the batched pass fails, images are retried one by one so only the bad image is dropped."""
+        results = [None] * len(pixel_values)
+        valid = [i for i, pv in enumerate(pixel_values) if pv is not None]
+        if not valid:
+            return results
         try:
-            inputs = self.preprocess_image(image_path)
-            if inputs is None:
-                return None
-            
-            # Generate embedding
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
-                image_features = torch.nn.functional.normalize(image_features, p=2, dim=1)
-                embedding = image_features.cpu().numpy().flatten()
-                
-            return embedding
-            
+            embeddings = self.embed_pixel_values([pixel_values[i] for i in valid])
+            for i, embedding in zip(valid, embeddings):
+                results[i] = embedding
         except Exception as e:
-            print(f"Error generating embedding for {image_path}: {e}")
+            print(f"Error generating batch embeddings, retrying images one by one: {e}")
+            for i in valid:
+                try:
+                    results[i] = self.embed_pixel_values([pixel_values[i]])[0]
+                except Exception as e:
+                    print(f"Error generating embedding for image {i} of batch: {e}")
+        return results
+
+    def generate_embedding(self, image_path):
+        """Generate embedding for a single image"""
+        pixel_values = self.preprocess_image(image_path)
+        if pixel_values is None:
             return None
-    
+        embedding = self.embed_batch([pixel_values])[0]
+        if embedding is None:
+            print(f"Error generating embedding for {image_path}")
+        return embedding
+
+    def iter_preprocessed_batches(self, image_paths):
+        """Yield (start, pixel_values) batches of preprocessed images.
+        With num_workers > 0 a producer thread preprocesses batches in a thread pool
+        into a bounded queue of prefetch_batches, so the caller only runs inference."""
+        starts = range(0, len(image_paths), self.batch_size)
+        if self.num_workers == 0:
+            for start in starts:
+                batch_paths = image_paths[start:start + self.batch_size]
+                yield start, [self.preprocess_image(path) for path in batch_paths]
+            return
+
+        prefetched = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+                    for start in starts:
+                        if stop.is_set():
+                            break
+                        batch_paths = image_paths[start:start + self.batch_size]
+                        prefetched.put((start, list(pool.map(self.preprocess_image, batch_paths))))
+            finally:
+                prefetched.put(done)
+
+        producer = threading.Thread(target=produce, name="clip-preprocess", daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = prefetched.get()
+                if batch is done:
+                    break
+                yield batch
+        finally:
+            stop.set()
+            # Drain so a producer blocked on a full queue can see the stop flag and exit
+            while producer.is_alive():
+                try:
+                    prefetched.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def generate_embeddings(self, image_paths, desc="Generating embeddings"):
+        """Generate embeddings for many images, batch_size images per forward pass.
+        Images already in the embedding cache are served from it without touching the model.
+        Yields (index, embedding) for every image that was embedded successfully."""
+        misses = list(range(len(image_paths)))
+        hashes = {}
+        if self.cache is not None:
+            # Pick up embeddings another stage (the prefilter) appended meanwhile
+            self.cache.refresh()
+            misses = []
+            for index, image_path in enumerate(image_paths):
+                try:
+                    hashes[index] = file_hash(image_path)
+                except OSError as e:
+                    print(f"Error reading {image_path}: {e}")
+                    continue
+                embedding = self.cache.get(hashes[index], image_path)
+                if embedding is None:
+                    misses.append(index)
+                else:
+                    metrics.incr('embedding_cache', result='hit')
+                    yield index, embedding
+
+        miss_paths = [image_paths[index] for index in misses]
+        if miss_paths:
+            # Load up front so model loading is not counted as preprocessing time
+            self.load_model()
+        if self.cache is not None:
+            metrics.incr('embedding_cache', len(miss_paths), result='miss')
+        with tqdm(total=len(miss_paths), desc=desc) as pbar:
+            for start, pixel_values in self.iter_preprocessed_batches(miss_paths):
+                for offset, embedding in enumerate(self.embed_batch(pixel_values)):
+                    if embedding is not None:
+                        index = misses[start + offset]
+                        if index in hashes:
+                            self.cache.put(hashes[index], embedding, image_paths[index])
+                        yield index, embedding
+                pbar.update(len(pixel_values))
+
     def process_image_directory(self, image_dir, output_file="embeddings.json", scraped_json=None):
         """Process all images in a directory and generate embeddings.
          If scraped_json is provided, use it to add URLs to metadata."""
@@ -74,55 +240,67 @@ class ImageEmbeddingGenerator:
             for file in files:
                 if any(file.lower().endswith(ext) for ext in image_extensions):
                     image_files.append(os.path.join(root, file))
+        if self.shard is not None:
+            image_files = [path for path in image_files if in_shard(self._dish_from_path(path), self.shard)]
         print(f"Found {len(image_files)} images")
         url_lookup = {}
         if scraped_json and os.path.exists(scraped_json):
-            with open(scraped_json, 'r', encoding='utf-8') as f:
-                for rec in json.load(f):
-                    url_lookup[os.path.abspath(rec['filename'])] = rec.get('url', '')
+            for rec in iter_records(scraped_json):
+                url_lookup[os.path.abspath(rec['filename'])] = rec.get('url', '')
+        embeddings = dict(self.generate_embeddings(image_files))
         embeddings_data = []
-        for image_path in tqdm(image_files, desc="Generating embeddings"):
-            embedding = self.generate_embedding(image_path)
-            if embedding is not None:
-                relative_path = os.path.relpath(image_path, image_dir)
-                cuisine = relative_path.split(os.sep)[0] if os.sep in relative_path else "unknown"
-                filename = os.path.basename(image_path)
-                dish_name = os.path.splitext(filename)[0].replace("_", " ").replace("-", " ")
-                url = url_lookup.get(os.path.abspath(image_path), "")
-                embeddings_data.append({
-                    "relative_path": relative_path,
-                    "cuisine": cuisine,
-                    "dish": dish_name,
-                    "url": url,
-                    "embedding": embedding.tolist(),
-                    "embedding_dim": len(embedding)
-                })
+        for index in sorted(embeddings):
+            embedding = embeddings[index]
+            image_path = image_files[index]
+            relative_path = os.path.relpath(image_path, image_dir)
+            cuisine = relative_path.split(os.sep)[0] if os.sep in relative_path else "unknown"
+            dish_name = self._dish_from_path(image_path)
+            url = url_lookup.get(os.path.abspath(image_path), "")
+            embeddings_data.append({
+                "relative_path": relative_path,
+                "cuisine": cuisine,
+                "dish": dish_name,
+                "url": url,
+                "embedding": embedding.tolist(),
+                "embedding_dim": len(embedding)
+            })
+        embeddings_data = self.deduplicate(embeddings_data)
         self.save_embeddings(embeddings_data, output_file)
+        if self.cache is not None:
+            self.cache.finish_run()
         print(f"Generated embeddings for {len(embeddings_data)} images")
         print(f"Embeddings saved to: {output_file}")
         return embeddings_data
     
-    def process_scraped_images(self, scraped_images_file, output_file="dish_embeddings.json"):
-        """Process images from scraped images JSON file"""
-        print(f"Processing scraped images from: {scraped_images_file}")
+    @staticmethod
+    def _dish_from_path(image_path):
+        return os.path.splitext(os.path.basename(image_path))[0].replace("_", " ").replace("-", " ")
 
-        with open(scraped_images_file, 'r') as f:
-            scraped_data = json.load(f)
-        
-        print(f"Found {len(scraped_data)} scraped images")
+    def process_scraped_images(self, scraped_images_file, output_file="dish_embeddings.json", follow=False):
+        """Process images from scraped images JSON file.
+        With follow, embed records as an upstream stage appends them to a .jsonl log."""
+        print(f"Processing scraped images from: {scraped_images_file}")
 
         embeddings_data = []
-        
-        for item in tqdm(scraped_data, desc="Generating embeddings"):
-            image_path = item["filename"]
-
-            if not os.path.exists(image_path):
-                print(f"Image file not found: {image_path}")
+        found = 0
+        for records in iter_record_batches(scraped_images_file, follow=follow):
+            items = []
+            for item in records:
+                if not in_shard(item["dish"], self.shard):
+                    continue
+                found += 1
+                if not os.path.exists(item["filename"]):
+                    print(f"Image file not found: {item['filename']}")
+                    continue
+                items.append(item)
+            if not items:
                 continue
 
-            embedding = self.generate_embedding(image_path)
-            
-            if embedding is not None:
+            image_paths = [item["filename"] for item in items]
+            embeddings = dict(self.generate_embeddings(image_paths))
+            for index in sorted(embeddings):
+                embedding = embeddings[index]
+                item = items[index]
                 embeddings_data.append({
                     "cuisine": item["cuisine"],
                     "dish": item["dish"],
@@ -131,112 +309,172 @@ class ImageEmbeddingGenerator:
                     "embedding_dim": len(embedding)
                 })
 
+        print(f"Found {found} scraped images")
+
+        embeddings_data = self.deduplicate(embeddings_data)
         self.save_embeddings(embeddings_data, output_file)
-        
+        if self.cache is not None:
+            self.cache.finish_run()
+
         print(f"Generated embeddings for {len(embeddings_data)} images")
         print(f"Embeddings saved to: {output_file}")
         
         return embeddings_data
     
-    def save_embeddings(self, embeddings_data, output_file):
-        """Save embeddings to JSON file"""
+    def deduplicate(self, embeddings_data):
+        """Drop near-duplicate images of the same dish (embedding cosine >= dedup_threshold)"""
+        if not self.dedup_threshold or len(embeddings_data) < 2:
+            return embeddings_data
+        matrix = np.asarray([item["embedding"] for item in embeddings_data], dtype=np.float32)
+        keep = near_duplicate_mask(matrix, self.dedup_threshold, groups=[item["dish"] for item in embeddings_data])
+        print(f"Removed {int((~keep).sum())} near-duplicate images (cosine >= {self.dedup_threshold})")
+        return [item for item, kept in zip(embeddings_data, keep) if kept]
 
-        os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else ".", exist_ok=True)
-
-        with open(output_file, 'w') as f:
-            json.dump(embeddings_data, f, indent=2)
+    def save_embeddings(self, embeddings_data, output_file):
+        """Save embeddings as JSON/JS and/or as a compact binary matrix with metadata"""
+        save_embeddings(embeddings_data, output_file, output_format=self.output_format, dtype=self.embedding_dtype)
 
-        # Save as JS file for fast loading in the web app
-        js_file = output_file.replace('.json', '.js')
-        with open(js_file, 'w', encoding='utf-8') as f:
-            f.write('const dishEmbeddings = ')
-            json.dump(embeddings_data, f, indent=2, ensure_ascii=False)
-            f.write(';\n')
-        
-        print(f"Embeddings saved as JSON: {output_file}")
-        print(f"Embeddings saved as JS: {js_file}")
-    
     def load_embeddings(self, embeddings_file):
-        """Load embeddings from file"""
-        if embeddings_file.endswith('.json'):
+        """Load embeddings from file (.json, .pkl, or binary .bin/.meta.json via np.memmap)"""
+        if is_binary_embeddings_file(embeddings_file):
+            records, matrix = load_binary_embeddings(embeddings_file)
+            return [dict(record, embedding=matrix[i], embedding_dim=matrix.shape[1])
+                    for i, record in enumerate(records)]
+        elif embeddings_file.endswith('.json'):
             with open(embeddings_file, 'r') as f:
                 return json.load(f)
         elif embeddings_file.endswith('.pkl'):
             with open(embeddings_file, 'rb') as f:
                 return pickle.load(f)
         else:
-            raise ValueError("Unsupported file format. Use .json or .pkl")
+            raise ValueError("Unsupported file format. Use .json, .pkl, .bin or .meta.json")
     
-    def find_similar_images(self, query_image_path, embeddings_data, top_k=5):
-        """Find similar images using cosine similarity"""
+    def get_index(self, embeddings_data):
+        """Return a search index for embeddings_data, building it only once per dataset.
+        Anything that already provides search_batch (an EmbeddingIndex or IVFPQIndex) is used as is."""
+        if hasattr(embeddings_data, "search_batch"):
+            return embeddings_data
+        if self._index_source is not embeddings_data:
+            self._index = EmbeddingIndex.from_embeddings_data(embeddings_data)
+            self._index_source = embeddings_data
+        return self._index
 
-        query_embedding = self.generate_embedding(query_image_path)
-        
-        if query_embedding is None:
-            print("Could not generate embedding for query image")
-            return []
+    def load_text_embeddings(self, text_embeddings_file):
+        """Preload precomputed dish-name embeddings (.bin/.meta.json from text_embeddings.py)"""
+        records, matrix = load_binary_embeddings(text_embeddings_file)
+        self.text_cache.preload([record["text"] for record in records], matrix)
+        print(f"Loaded {len(records)} precomputed text embeddings from: {text_embeddings_file}")
 
-        similarities = []
-        for item in embeddings_data:
-            item_embedding = np.array(item["embedding"])
-            similarity = np.dot(query_embedding, item_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(item_embedding)
-            )
-            similarities.append((similarity, item))
+    def embed_texts(self, texts):
+        """Return L2-normalized text embeddings, shape (len(texts), dim).
+        Cached and precomputed texts are served without running the model."""
+        embeddings = [self.text_cache.get(text) for text in texts]
+        misses = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        computed = {}
+        for start in range(0, len(misses), self.batch_size):
+            batch = misses[start:start + self.batch_size]
+            inputs = self.processor(text=batch, return_tensors="np", padding=True)
+            text_features = self.backend.embed_texts({k: inputs[k] for k in ("input_ids", "attention_mask")})
+            for text, embedding in zip(batch, text_features):
+                computed[text] = embedding
+                self.text_cache.put(text, embedding)
+        embeddings = [computed[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return np.stack(embeddings).astype(np.float32) if embeddings else np.empty((0, 0), dtype=np.float32)
 
-        similarities.sort(key=lambda x: x[0], reverse=True)
+    def find_similar_images(self, query_image_path, embeddings_data, top_k=5):
+        """Find similar images using cosine similarity"""
+        return self.find_similar_images_batch([query_image_path], embeddings_data, top_k)[0]
+
+    def find_similar_images_batch(self, query_image_paths, embeddings_data, top_k=5):
+        """Find similar images for many query images with one matmul.
+        Returns one [(similarity, item), ...] list per query; empty for queries that failed to embed."""
+        index = self.get_index(embeddings_data)
+        query_embeddings = dict(self.generate_embeddings(query_image_paths, desc="Embedding queries"))
+        results = [[] for _ in query_image_paths]
+        for i, path in enumerate(query_image_paths):
+            if i not in query_embeddings:
+                print(f"Could not generate embedding for query image: {path}")
+        if query_embeddings:
+            order = sorted(query_embeddings)
+            matches = index.search_batch(np.stack([query_embeddings[i] for i in order]), top_k)
+            for i, query_matches in zip(order, matches):
+                results[i] = query_matches
+        return results
 
-        return similarities[:top_k]
-    
     def search_by_text(self, text_query, embeddings_data, top_k=5):
         """Search images by text query"""
+        return self.search_by_text_batch([text_query], embeddings_data, top_k)[0]
 
-        inputs = self.processor(text=text_query, return_tensors="pt", padding=True)
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            text_features = self.model.get_text_features(**inputs)
-            text_features = torch.nn.functional.normalize(text_features, p=2, dim=1)
-            text_embedding = text_features.cpu().numpy().flatten()
-
-        similarities = []
-        for item in embeddings_data:
-            item_embedding = np.array(item["embedding"])
-            similarity = np.dot(text_embedding, item_embedding) / (
-                np.linalg.norm(text_embedding) * np.linalg.norm(item_embedding)
-            )
-            similarities.append((similarity, item))
-
-        similarities.sort(key=lambda x: x[0], reverse=True)
-
-        return similarities[:top_k]
+    def search_by_text_batch(self, text_queries, embeddings_data, top_k=5):
+        """Search images for many text queries with one matmul; one result list per query"""
+        if not text_queries:
+            return []
+        index = self.get_index(embeddings_data)
+        return index.search_batch(self.embed_texts(list(text_queries)), top_k)
 
 
 def main():
     """Main function"""
     parser = argparse.ArgumentParser(description="Image Embedding Generator")
-    parser.add_argument("--input", type=str, default='dish_images/filtered_progress.json', help="Path to the input JSON file with image metadata (from scraper) or directory")
+    parser.add_argument("--input", type=str, default='dish_images/filtered_progress.json', help="Path to the input JSON/JSON Lines file with image metadata (from scraper or filter) or directory")
     parser.add_argument("--output", type=str, default="dish_images/dish_embeddings.json", help="Path to save the output JSON file with embeddings")
     parser.add_argument("--model", type=str, default="openai/clip-vit-base-patch32", help="Name of the CLIP model to use")
     parser.add_argument("--device", type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
     parser.add_argument("--batch-size", type=int, default=32, help="Batch size for processing images")
-    parser.add_argument("--scraped-json", type=str, default=None, help="Optional: path to scraping_progress.json for URL lookup")
+    parser.add_argument("--num-workers", type=int, default=4, help="Threads decoding/preprocessing images ahead of inference (0 = preprocess inline)")
+    parser.add_argument("--prefetch-batches", type=int, default=2, help="Max preprocessed batches queued ahead of the model")
+    parser.add_argument("--cache-file", type=str, default="dish_images/embedding_cache.jsonl", help="Persistent embedding cache keyed by image content hash and model")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every embedding without reading or updating the cache")
+    parser.add_argument("--output-format", choices=["json", "binary", "all"], default="all", help="Write JSON/JS, a compact binary matrix + metadata, or both")
+    parser.add_argument("--embedding-dtype", choices=["float32", "float16", "int8"], default="float32", help="Element type of the binary embedding matrix (int8 = per-vector quantized codes + scales)")
+    parser.add_argument("--dedup-threshold", type=float, default=0.98, help="Drop images of the same dish whose embeddings have cosine similarity >= this (0 disables)")
+    parser.add_argument("--build-ann-index", action="store_true", help="Also build the IVF-PQ ANN index next to the output (see ann_index.py)")
+    parser.add_argument("--scraped-json", type=str, default=None, help="Optional: path to scraping_progress.jsonl for URL lookup")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Embed only shard i/N of the dishes (e.g. 0/4); the output and the new cache entries get a .shard-<i>-of-<N> suffix")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Limit torch/onnxruntime intra-op threads (e.g. cores / shards when running several workers)")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference backend: torch, or onnx (CPU; exports the model on first use, see clip_backends.py)")
+    parser.add_argument("--onnx-dir", type=str, default=None, help="Directory of the exported ONNX towers (default: onnx_models/<model>)")
+    parser.add_argument("--quantize", action="store_true", help="With --backend onnx, use int8 dynamically quantized towers")
+    parser.add_argument("--follow", action="store_true", help="Keep reading a .jsonl input while an upstream stage is still writing it (until <input>.done exists)")
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    with metrics.instrument('embed', args):
+        generate(args)
+    sys.exit(0)
+
+
+def generate(args):
     print("=== Image Embedding Generator ===")
-    print(f"Loading CLIP model: {args.model}")
-    generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device)
+    shard = args.shard
+    if shard is not None:
+        # Shards keep separate outputs and cache logs so parallel workers never write the same
+        # file; every shard reads the shared cache, and embedding_shards.py merge folds the logs in
+        args.output = shard_path(args.output, shard)
+        print(f"Shard {shard[0]}/{shard[1]}: writing {args.output}")
+    generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device, batch_size=args.batch_size,
+                                       num_workers=args.num_workers, prefetch_batches=args.prefetch_batches,
+                                       cache_file=None if args.no_cache else args.cache_file,
+                                       cache_write_file=shard_path(args.cache_file, shard) if shard else None,
+                                       output_format=args.output_format, embedding_dtype=args.embedding_dtype,
+                                       dedup_threshold=args.dedup_threshold, shard=shard, backend=args.backend,
+                                       onnx_dir=args.onnx_dir, quantize=args.quantize, num_threads=args.torch_threads)
     try:
         if os.path.isdir(args.input):
-            generator.process_image_directory(args.input, args.output, scraped_json=args.scraped_json)
-        elif args.input.endswith('.json'):
-            generator.process_scraped_images(args.input, args.output)
+            embeddings_data = generator.process_image_directory(args.input, args.output, scraped_json=args.scraped_json)
+        elif args.input.endswith(('.json', '.jsonl')):
+            embeddings_data = generator.process_scraped_images(args.input, args.output, follow=args.follow)
         else:
-            print(f"Input must be a directory or JSON file: {args.input}")
+            print(f"Input must be a directory, JSON or JSON Lines file: {args.input}")
             return
+        if args.build_ann_index and embeddings_data and shard is None:
+            index_path = ann_index_path(args.output)
+            records = [{k: v for k, v in item.items() if k not in ("embedding", "embedding_dim")} for item in embeddings_data]
+            matrix = np.asarray([item["embedding"] for item in embeddings_data], dtype=np.float32)
+            IVFPQIndex.build(records, matrix).save(index_path)
+            print(f"ANN index saved to: {index_path}")
     except Exception as e:
         print(f"Error during embedding generation: {e}")
         raise
-    sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Pipeline Metrics
+Counters and timing histograms shared by the pipeline stages. Instrumented code calls
+incr() / observe() / timer() on the process-wide registry; instrument() wraps a stage's
+main(), appends the metrics to a JSON Lines file when the stage ends, prints a summary
+table and, with --profile, runs the stage under cProfile. The profile covers the main
+thread and every thread the stage starts (download and GPT worker pools), merged into
+one <stage>.prof.
+
+Each JSON Lines record is one metric of one process:
+  {"time": ..., "stage": "scrape", "pid": 123, "name": "download", "labels": {...},
+   "type": "histogram", "count": 42, "sum": 3.1, "min": 0.01, "max": 0.9, "buckets": [...]}
+
+Usage:
+  python metrics.py dish_images/metrics.jsonl [--stage scrape]
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import pstats
+import cProfile
+import argparse
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the histogram buckets: 0.1 ms doubling up to ~14 min, plus overflow
+BUCKETS = [1e-4 * 2 ** i for i in range(24)]
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, clamped to the observed range"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                bound = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms keyed by (name, labels)"""
+
+    def __init__(self):
+        self.stage = None
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def incr(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_records(self):
+        now = time.time()
+        base = {"time": now, "stage": self.stage, "pid": os.getpid()}
+        with self._lock:
+            records = [dict(base, name=name, labels=dict(labels), type="counter", value=value)
+                       for (name, labels), value in self.counters.items()]
+            records += [dict(base, name=name, labels=dict(labels), type="histogram", count=h.count, sum=h.sum,
+                             min=h.min, max=h.max, buckets=h.buckets)
+                        for (name, labels), h in self.histograms.items()]
+        return records
+
+    def add_record(self, rec):
+        """Merge one JSON Lines record (see to_records) into this registry"""
+        key = (rec["name"], tuple(sorted(rec.get("labels", {}).items())))
+        if rec.get("stage"):
+            key = (f"{rec['stage']}.{key[0]}", key[1])
+        if rec["type"] == "counter":
+            self.counters[key] = self.counters.get(key, 0) + rec["value"]
+            return
+        h = Histogram()
+        h.count, h.sum, h.min, h.max, h.buckets = rec["count"], rec["sum"], rec["min"], rec["max"], rec["buckets"]
+        self.histograms.setdefault(key, Histogram()).merge(h)
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for rec in self.to_records():
+                f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+
+    def print_summary(self, title="Metrics"):
+        def label(name, labels):
+            return name + (f"{{{','.join(f'{k}={v}' for k, v in labels)}}}" if labels else "")
+
+        if not self.counters and not self.histograms:
+            return
+        print(f"\n=== {title} ===")
+        if self.counters:
+            print(f"{'counter':<56} {'value':>10}")
+            for key in sorted(self.counters):
+                print(f"{label(*key):<56} {self.counters[key]:>10g}")
+        if self.histograms:
+            print(f"{'timing (ms)':<56} {'count':>8} {'total s':>9} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+            for key in sorted(self.histograms):
+                h = self.histograms[key]
+                print(f"{label(*key):<56} {h.count:>8} {h.sum:>9.2f} {h.sum / h.count * 1000:>8.1f} "
+                      f"{h.quantile(0.5) * 1000:>8.1f} {h.quantile(0.95) * 1000:>8.1f} {h.max * 1000:>8.1f}")
+
+
+METRICS = Metrics()
+incr = METRICS.incr
+observe = METRICS.observe
+timer = METRICS.timer
+
+
+def read_metrics(path, since=0.0, stage=None):
+    """Merge the records of a metrics file written at or after `since` into one Metrics"""
+    merged = Metrics()
+    if not os.path.exists(path):
+        return merged
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec["time"] >= since and (stage is None or rec.get("stage") == stage):
+                merged.add_record(rec)
+    return merged
+
+
+class ThreadProfiler:
+    """cProfile for the calling thread plus one profiler per thread started while enabled.
+    On Python 3.12+ a single cProfile already sees every thread, so no extra ones are made."""
+
+    def __init__(self):
+        self.profilers = [cProfile.Profile()]
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, *_):
+        # Installed by threading.setprofile; runs once at the start of each new thread
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return
+        with self._lock:
+            self.profilers.append(profiler)
+
+    def enable(self):
+        threading.setprofile(self._profile_thread)
+        self.profilers[0].enable()
+
+    def disable(self):
+        threading.setprofile(None)
+        self.profilers[0].disable()
+
+    def stats(self):
+        """pstats.Stats of all threads merged"""
+        with self._lock:
+            profilers = list(self.profilers)
+        stats = pstats.Stats(profilers[0], stream=sys.stdout)
+        for profiler in profilers[1:]:
+            # Pool threads may still be idle with their profiler on; snapshot what they have
+            profiler.create_stats()
+            stats.add(profiler)
+        return stats
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics-file', type=str, default=None, help='Append counters and timing histograms to this JSON Lines file when the stage ends')
+    parser.add_argument('--profile', action='store_true', help='Run under cProfile (all threads) and save the stats as <stage>.prof next to the metrics file')
+
+
+@contextmanager
+def instrument(stage, args):
+    """Time a stage, optionally profile it, and write and print its metrics when it ends"""
+    METRICS.stage = stage
+    profiler = ThreadProfiler() if getattr(args, 'profile', False) else None
+    metrics_file = getattr(args, 'metrics_file', None)
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield METRICS
+    finally:
+        if profiler:
+            profiler.disable()
+            stats = profiler.stats()
+            profile_file = os.path.join(os.path.dirname(metrics_file or '') or '.', f"{stage}.prof")
+            stats.dump_stats(profile_file)
+            print(f"\n=== Profile: {stage}, {len(profiler.profilers)} thread(s) (top 15 by cumulative time) ===")
+            stats.sort_stats('cumulative').print_stats(15)
+            print(f"Profile saved to: {profile_file} (inspect with python -m pstats or snakeviz)")
+        METRICS.observe('stage_seconds', time.perf_counter() - start)
+        if metrics_file:
+            METRICS.write(metrics_file)
+        METRICS.print_summary(f"Metrics: {stage}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a pipeline metrics file.")
+    parser.add_argument('metrics_file', type=str, help='JSON Lines metrics file written by the pipeline stages')
+    parser.add_argument('--stage', type=str, default=None, help='Only include this stage')
+    parser.add_argument('--since', type=float, default=0.0, help='Only include records written at or after this Unix time')
+    args = parser.parse_args()
+    read_metrics(args.metrics_file, args.since, args.stage).print_summary(f"Metrics: {args.metrics_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Local CLIP Pre-filter
+Runs between dish_image_scraper.py and filter_scraped_images.py. Scores every scraped
+image against its dish name and a few negative prompts with CLIP, drops clear rejects
+(tiny thumbnails, near-duplicates, menus/logos/people/text) locally and passes only the
+remaining images on to the paid GPT filter.
+
+Records that are confident enough (--accept-threshold) are marked with
+"prefilter": "accept" and kept by filter_scraped_images.py without a GPT call.
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from PIL import Image
+
+from image_embedding_generator import ImageEmbeddingGenerator
+from clip_backends import BACKENDS
+from progress_log import ProgressLog, iter_record_batches
+import metrics
+
+NEGATIVE_PROMPTS = [
+    "a restaurant menu",
+    "a logo",
+    "a person",
+    "a photo of text",
+    "a drawing or illustration",
+    "a screenshot of a website",
+]
+
+# CLIP's learned temperature (exp(logit_scale)) for ViT-B/32
+CLIP_LOGIT_SCALE = 100.0
+
+
+def dish_prompt(dish_name):
+    return f"a photo of {dish_name}, a type of food"
+
+
+def image_size(path):
+    """Width and height from the image header, or None if unreadable"""
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+class KeptEmbeddings:
+    """Embeddings kept so far for one dish, stacked in a matrix that grows by doubling,
+    so the near-duplicate check is one matrix-vector product"""
+
+    def __init__(self, dim, capacity=16):
+        self.matrix = np.empty((capacity, dim), dtype=np.float32)
+        self.count = 0
+
+    def max_similarity(self, embedding):
+        if self.count == 0:
+            return -1.0
+        return float(np.max(self.matrix[:self.count] @ embedding))
+
+    def add(self, embedding):
+        if self.count == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+        self.matrix[self.count] = embedding
+        self.count += 1
+
+
+def prefilter(records, generator, reject_threshold=0.3, accept_threshold=None,
+              duplicate_threshold=0.97, min_size=200, kept_by_dish=None):
+    """Return one (decision, stats) per record; decision is "reject", "accept" or "ambiguous".
+    stats carries the dish probability and, for rejects, the reason. Pass the same
+    kept_by_dish dict across calls to deduplicate records that arrive in several batches."""
+    decisions = [None] * len(records)
+    candidates = []
+    for i, rec in enumerate(records):
+        size = image_size(rec["filename"]) if os.path.exists(rec["filename"]) else None
+        if size is None:
+            decisions[i] = ("reject", {"reason": "unreadable"})
+        elif min(size) < min_size:
+            decisions[i] = ("reject", {"reason": "thumbnail", "width": size[0], "height": size[1]})
+        else:
+            candidates.append(i)
+
+    embeddings = dict(generator.generate_embeddings([records[i]["filename"] for i in candidates],
+                                                    desc="Pre-filter embeddings"))
+    dishes = sorted({records[i]["dish"] for i in candidates})
+    text_embeddings = generator.embed_texts([dish_prompt(d) for d in dishes] + NEGATIVE_PROMPTS)
+    dish_vectors = dict(zip(dishes, text_embeddings[:len(dishes)]))
+    negative_vectors = text_embeddings[len(dishes):]
+
+    if kept_by_dish is None:
+        kept_by_dish = {}
+    for k, i in enumerate(candidates):
+        if k not in embeddings:
+            decisions[i] = ("reject", {"reason": "unreadable"})
+            continue
+        embedding = embeddings[k]
+        dish = records[i]["dish"]
+        if dish not in kept_by_dish:
+            kept_by_dish[dish] = KeptEmbeddings(len(embedding))
+        kept = kept_by_dish[dish]
+        if kept.max_similarity(embedding) >= duplicate_threshold:
+            decisions[i] = ("reject", {"reason": "near_duplicate"})
+            continue
+
+        logits = CLIP_LOGIT_SCALE * (np.vstack([dish_vectors[dish][None, :], negative_vectors]) @ embedding)
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        stats = {"dish_probability": round(float(probs[0]), 4),
+                 "top_negative": NEGATIVE_PROMPTS[int(np.argmax(probs[1:]))]}
+        if probs[0] < reject_threshold:
+            decisions[i] = ("reject", dict(stats, reason="clip_negative"))
+            continue
+        kept.add(embedding)
+        if accept_threshold is not None and probs[0] >= accept_threshold:
+            decisions[i] = ("accept", stats)
+        else:
+            decisions[i] = ("ambiguous", stats)
+    return decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cheap local CLIP pre-filter before GPT filtering.")
+    parser.add_argument('--input', type=str, default='dish_images/scraping_progress.jsonl', help='Scraped images (JSON Lines progress log or JSON array)')
+    parser.add_argument('--output', type=str, default='dish_images/prefiltered_progress.json', help='Output file with images that survive the pre-filter (.jsonl is appended to as batches finish)')
+    parser.add_argument('--model', type=str, default='openai/clip-vit-base-patch32', help='Name of the CLIP model to use')
+    parser.add_argument('--device', type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend (see clip_backends.py)')
+    parser.add_argument('--onnx-dir', type=str, default=None, help='Directory of the exported ONNX towers (default: onnx_models/<model>)')
+    parser.add_argument('--quantize', action='store_true', help='With --backend onnx, use int8 dynamically quantized towers')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size for processing images')
+    parser.add_argument('--cache-file', type=str, default='dish_images/embedding_cache.jsonl', help='Embedding cache shared with image_embedding_generator.py')
+    parser.add_argument('--reject-threshold', type=float, default=0.3, help='Drop images whose dish probability (vs. negative prompts) is below this')
+    parser.add_argument('--accept-threshold', type=float, default=None, help='Keep images at or above this dish probability without asking GPT (default: always ask)')
+    parser.add_argument('--duplicate-threshold', type=float, default=0.97, help='Cosine similarity above which an image duplicates an earlier one of the same dish')
+    parser.add_argument('--min-size', type=int, default=200, help='Drop images whose shorter side is below this many pixels')
+    parser.add_argument('--follow', action='store_true', help='Keep reading a .jsonl input while an upstream stage is still writing it (until <input>.done exists)')
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    with metrics.instrument('prefilter', args):
+        run_prefilter(args)
+
+
+def run_prefilter(args):
+    generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device, batch_size=args.batch_size,
+                                        cache_file=args.cache_file, backend=args.backend, onnx_dir=args.onnx_dir,
+                                        quantize=args.quantize)
+    stream_output = args.output.endswith('.jsonl')
+    if stream_output and os.path.exists(args.output):
+        # Truncate in place so a follower that already opened the log keeps reading this file
+        open(args.output, 'w').close()
+    output_log = ProgressLog(args.output, fsync=False) if stream_output else None
+
+    kept = []
+    kept_by_dish = {}
+    reasons = {}
+    counts = {"reject": 0, "accept": 0, "ambiguous": 0}
+    total = 0
+    try:
+        for records in iter_record_batches(args.input, follow=args.follow):
+            total += len(records)
+            print(f"Pre-filtering {len(records)} scraped images")
+            decisions = prefilter(records, generator, reject_threshold=args.reject_threshold,
+                                  accept_threshold=args.accept_threshold, duplicate_threshold=args.duplicate_threshold,
+                                  min_size=args.min_size, kept_by_dish=kept_by_dish)
+            for rec, (decision, stats) in zip(records, decisions):
+                counts[decision] += 1
+                metrics.incr('decisions', decision=decision)
+                if decision == "reject":
+                    metrics.incr('rejections', reason=stats["reason"])
+                    reasons[stats["reason"]] = reasons.get(stats["reason"], 0) + 1
+                    print(f"Pre-filtered out ({stats['reason']}): {rec['dish']} | {rec.get('url', '')}")
+                    continue
+                kept.append(dict(rec, prefilter=decision, prefilter_stats=stats))
+                if output_log:
+                    output_log.append(kept[-1])
+    finally:
+        if output_log:
+            output_log.close()
+    # New embeddings are already in the cache log; pruning is left to the embedding run
+
+    if not stream_output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(kept, f, indent=2, ensure_ascii=False)
+
+    print("\n=== Pre-filter completed! ===")
+    print(f"Rejected locally: {counts['reject']} ({', '.join(f'{k}: {v}' for k, v in sorted(reasons.items())) or 'none'})")
+    print(f"Accepted locally: {counts['accept']}")
+    print(f"Sent to GPT: {counts['ambiguous']}")
+    print(f"GPT API calls saved: {counts['reject'] + counts['accept']} of {total}")
+    print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
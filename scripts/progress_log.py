@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Progress Log
+Append-only JSON Lines progress files shared by the pipeline stages. Each record is
+written as one line and flushed to disk immediately, so a crash loses at most the
+line being written; readers skip a torn last line and stream records one by one.
+Plain JSON array files are still accepted by the readers.
+
+Downstream stages can follow a log while the upstream stage is still writing it;
+the pipeline runner creates <log>.done when the writer has finished.
+"""
+
+import os
+import json
+import time
+import threading
+
+
+class ProgressLog:
+    """Thread-safe append-only JSON Lines writer"""
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        torn = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+        self._file = open(path, 'a', encoding='utf-8')
+        # Terminate a torn last line from a crashed run so the next record starts cleanly
+        if torn:
+            self._file.write('\n')
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_records(path):
+    """Yield records from a .jsonl progress log (streaming) or a JSON array file"""
+    if not path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # torn line from a crash
+
+
+def read_records(path):
+    return list(iter_records(path))
+
+
+def done_marker(path):
+    """Marker file signalling that the writer of a progress log has finished"""
+    return path + '.done'
+
+
+def iter_record_batches(path, follow=False, poll_interval=1.0):
+    """Yield lists of records. Without follow, the whole file is one batch.
+    With follow, tail a JSON Lines log that another process is still appending to and
+    yield whatever complete records arrived since the last poll, until <path>.done exists."""
+    if not follow:
+        yield read_records(path)
+        return
+    marker = done_marker(path)
+    while not os.path.exists(path):
+        if os.path.exists(marker):
+            return
+        time.sleep(poll_interval)
+    buffer = ''
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            finished = os.path.exists(marker)
+            buffer += f.read()
+            *lines, buffer = buffer.split('\n')
+            batch = []
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    continue  # torn line from a crash
+            if batch:
+                yield batch
+            if finished:
+                return
+            time.sleep(poll_interval)
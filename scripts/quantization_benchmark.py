@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Quantization Benchmark
+Measures what each embedding store level (float32, float16, int8 with per-vector
+scales) costs in accuracy and buys in size and speed. Reference results come from
+ImageEmbeddingGenerator.search_by_text and find_similar_images over exact float32
+search; the same calls are repeated against each quantized index and scored by
+top-k recall. Query latency is measured on the index alone (embeddings precomputed).
+
+Usage:
+  python quantization_benchmark.py --embeddings dish_images/dish_embeddings.json \
+      --images dish_images/filtered_progress.json
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+
+from embedding_index import EmbeddingIndex, Float16Index, QuantizedIndex
+from embedding_store import load_embedding_matrix
+from progress_log import read_records
+
+
+def build_indexes(records, matrix):
+    """Exact float32 index plus one index per quantization level, with the payload size of each"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    float16 = Float16Index(records, matrix.astype(np.float16))
+    int8 = QuantizedIndex.from_matrix(records, matrix)
+    return {
+        "float32": (EmbeddingIndex(records, matrix), matrix.size * 4),
+        "float16": (float16, float16.nbytes),
+        "int8": (int8, int8.nbytes),
+    }
+
+
+def recall_at_k(results, reference):
+    """Fraction of the reference top-k records that also appear in results, over all queries"""
+    hits = total = 0
+    for found, expected in zip(results, reference):
+        expected_ids = {id(record) for _, record in expected}
+        hits += len(expected_ids & {id(record) for _, record in found})
+        total += len(expected_ids)
+    return hits / total if total else 1.0
+
+
+def query_latency_ms(index, queries, top_k, repeats=3):
+    """Best-of-repeats mean latency per query when answering all queries in one batch"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        index.search_indices(queries, top_k)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 / max(1, len(queries))
+
+
+def run_benchmark(generator, records, matrix, texts, image_paths, top_k=5):
+    """Return {level: {"bytes", "text_recall", "image_recall", "ms_per_query"}}"""
+    indexes = build_indexes(records, matrix)
+    exact = indexes["float32"][0]
+    text_reference = generator.search_by_text_batch(texts, exact, top_k) if texts else []
+    image_reference = generator.find_similar_images_batch(image_paths, exact, top_k) if image_paths else []
+    queries = generator.embed_texts(texts) if texts else exact.matrix[:100]
+
+    results = {}
+    for level, (index, nbytes) in indexes.items():
+        results[level] = {
+            "bytes": int(nbytes),
+            "text_recall": recall_at_k(generator.search_by_text_batch(texts, index, top_k), text_reference) if texts else None,
+            "image_recall": recall_at_k(generator.find_similar_images_batch(image_paths, index, top_k), image_reference) if image_paths else None,
+            "ms_per_query": query_latency_ms(index, queries, top_k),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of quantized embedding stores vs exact float32 search.")
+    parser.add_argument('--embeddings', type=str, default='dish_images/dish_embeddings.json', help='Embeddings file (.json, .pkl, .bin or .meta.json)')
+    parser.add_argument('--images', type=str, default='dish_images/filtered_progress.json', help='Image records (JSON or JSON Lines with "filename") sampled as query images')
+    parser.add_argument('--text-queries', type=int, default=200, help='Number of dish names used as text queries')
+    parser.add_argument('--image-queries', type=int, default=100, help='Number of images used as image queries')
+    parser.add_argument('--top-k', type=int, default=5, help='k for recall@k')
+    parser.add_argument('--model', type=str, default='openai/clip-vit-base-patch32', help='Name of the CLIP model used for the embeddings')
+    parser.add_argument('--device', type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
+    parser.add_argument('--cache-file', type=str, default='dish_images/embedding_cache.jsonl', help='Embedding cache, so query images are not re-embedded')
+    args = parser.parse_args()
+
+    from image_embedding_generator import ImageEmbeddingGenerator
+
+    records, matrix = load_embedding_matrix(args.embeddings)
+    print(f"Loaded {len(records)} embeddings from: {args.embeddings}")
+    rng = np.random.default_rng(0)
+    dishes = sorted({record["dish"] for record in records})
+    texts = [dishes[i] for i in sorted(rng.choice(len(dishes), min(args.text_queries, len(dishes)), replace=False))]
+    image_paths = []
+    if os.path.exists(args.images):
+        paths = [rec["filename"] for rec in read_records(args.images) if os.path.exists(rec.get("filename", ""))]
+        image_paths = [paths[i] for i in sorted(rng.choice(len(paths), min(args.image_queries, len(paths)), replace=False))]
+
+    generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device, cache_file=args.cache_file)
+    results = run_benchmark(generator, records, matrix, texts, image_paths, args.top_k)
+
+    def fmt(value):
+        return f"{value:.3f}" if value is not None else "n/a"
+
+    k = args.top_k
+    print(f"\n{len(texts)} text queries, {len(image_paths)} image queries")
+    print(f"{'level':>8} {'MB':>8} {'size':>6} {'text recall@' + str(k):>15} {'image recall@' + str(k):>16} {'ms/query':>9}")
+    for level, row in results.items():
+        ratio = row["bytes"] / results["float32"]["bytes"] if results["float32"]["bytes"] else 1.0
+        print(f"{level:>8} {row['bytes'] / 1e6:>8.2f} {ratio:>6.2f} {fmt(row['text_recall']):>15} "
+              f"{fmt(row['image_recall']):>16} {row['ms_per_query']:>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Query Server
+Long-lived local similarity search service. It keeps the CLIP model and a normalized
+embedding matrix in memory and answers text and image queries over HTTP on a TCP port
+or a Unix socket. Concurrent requests that arrive within --batch-window-ms are grouped:
+their texts go through the text tower in one batch, their images through the vision
+tower in one batch, and all query vectors are searched with one matmul. The embedding
+files are polled and the index is swapped in place when they change.
+
+Endpoints:
+  GET  /search?q=<text>&top_k=5
+  POST /search  {"text": "..."} | {"image_path": "..."} | {"image_base64": "..."}, optional "top_k"
+  GET  /health  rows, index type, load time and query counters
+
+Usage:
+  python query_server.py --embeddings dish_images/dish_embeddings.json --port 8765
+  python query_server.py --socket /tmp/menu_guide.sock --index int8
+  curl 'http://127.0.0.1:8765/search?q=pad+thai&top_k=3'
+  curl --unix-socket /tmp/menu_guide.sock 'http://localhost/search?q=borscht'
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import base64
+import socket
+import argparse
+import threading
+import http.client
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+import numpy as np
+
+import metrics
+from embedding_store import binary_paths, scales_path, load_embedding_matrix, load_quantized_embeddings
+from embedding_index import EmbeddingIndex, QuantizedIndex
+from dish_index import DishIndex, dish_index_path
+from clip_backends import BACKENDS
+from image_embedding_generator import ImageEmbeddingGenerator
+
+INDEX_TYPES = ["exact", "int8", "dish"]
+
+
+def resolve_embeddings_file(path):
+    """Prefer the binary copy of a JSON embeddings file: it loads without parsing every vector"""
+    meta_file = binary_paths(path)[1]
+    return meta_file if os.path.exists(meta_file) else path
+
+
+def watched_files(path, index_type="exact"):
+    if path.endswith(('.bin', '.meta.json')):
+        bin_file, meta_file = binary_paths(path)
+        files = [meta_file, bin_file, scales_path(bin_file)]
+    else:
+        files = [path]
+    # The dish index built by dish_index.py (the pipeline's aggregate stage)
+    return files + [dish_index_path(path)] if index_type == "dish" else files
+
+
+def file_signature(paths):
+    """(mtime, size) of every existing file; changes whenever a writer replaces one of them"""
+    return tuple((path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths if os.path.exists(path))
+
+
+def load_index(path, index_type="exact"):
+    """Build an in-memory search index from an embeddings file. Matrices are copied out of
+    the memmap so a later rewrite of the file cannot change the index under a running query."""
+    if index_type == "int8" and path.endswith(('.bin', '.meta.json')):
+        records, codes, scales = load_quantized_embeddings(path)
+        if scales is not None:
+            if len(scales) != len(records):
+                raise ValueError(f"{path} is being rewritten: {len(records)} records, {len(scales)} scales")
+            return QuantizedIndex(records, np.array(codes), scales)
+    records, matrix = load_embedding_matrix(path)
+    if path.endswith(('.bin', '.meta.json')):
+        bin_file = binary_paths(path)[0]
+        if len(records) and os.path.getsize(bin_file) != matrix.size * matrix.itemsize:
+            raise ValueError(f"{bin_file} does not match its metadata yet (being rewritten)")
+    matrix = np.array(matrix, dtype=np.float32)
+    if index_type == "int8":
+        return QuantizedIndex.from_matrix(records, matrix)
+    if index_type == "dish":
+        # Use the persisted index (with its --medoids) unless it predates these embeddings
+        index_file = dish_index_path(path)
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(path):
+            try:
+                return DishIndex.load(index_file, records, matrix)
+            except ValueError as e:
+                print(f"{e}; building it in memory")
+        return DishIndex.build(records, matrix)
+    return EmbeddingIndex(records, matrix)
+
+
+class Query:
+    def __init__(self, text=None, image=None, top_k=5):
+        self.text = text
+        # A local file path or a file-like object with the image bytes
+        self.image = image
+        self.top_k = top_k
+        self.future = Future()
+
+
+class QueryService:
+    """Keeps the model and the index in memory and answers queries in micro-batches"""
+
+    def __init__(self, generator, embeddings_file, index_type="exact", batch_window_ms=5.0, max_batch=64,
+                 max_top_k=100, reload_interval=2.0):
+        self.generator = generator
+        self.embeddings_file = resolve_embeddings_file(embeddings_file)
+        self.index_type = index_type
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.max_top_k = max_top_k
+        self.reload_interval = reload_interval
+        self.requests = queue.Queue()
+        self.stats = {"queries": 0, "batches": 0, "errors": 0, "reloads": 0}
+        self.stopped = threading.Event()
+        self.index = None
+        self.loaded_at = None
+        self.signature = None
+        self.reload()
+        self.threads = [threading.Thread(target=self._serve_batches, name="query-batcher", daemon=True)]
+        if reload_interval > 0:
+            self.threads.append(threading.Thread(target=self._watch, name="embeddings-watcher", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def reload(self):
+        """Load the embeddings and swap the index in; queries in flight keep the old one"""
+        signature = file_signature(watched_files(self.embeddings_file, self.index_type))
+        start = time.perf_counter()
+        index = load_index(self.embeddings_file, self.index_type)
+        self.index, self.signature, self.loaded_at = index, signature, time.time()
+        print(f"Loaded {len(index)} embeddings ({self.index_type}) from {self.embeddings_file} "
+              f"in {time.perf_counter() - start:.2f}s")
+
+    def _watch(self):
+        pending = None
+        while not self.stopped.wait(self.reload_interval):
+            signature = file_signature(watched_files(self.embeddings_file, self.index_type))
+            if signature == self.signature or not signature:
+                pending = None
+                continue
+            # Reload once the files have stopped changing for one interval
+            if signature != pending:
+                pending = signature
+                continue
+            try:
+                self.reload()
+                self.stats["reloads"] += 1
+            except Exception as e:
+                print(f"Reload of {self.embeddings_file} failed, keeping the loaded index: {e}")
+            pending = None
+
+    def submit(self, query):
+        if self.stopped.is_set():
+            raise RuntimeError("Query service is stopped")
+        query.top_k = max(1, min(int(query.top_k), self.max_top_k))
+        self.requests.put(query)
+        return query.future
+
+    def search_text(self, text, top_k=5, timeout=30):
+        return self.submit(Query(text=text, top_k=top_k)).result(timeout)
+
+    def search_image(self, image, top_k=5, timeout=30):
+        return self.submit(Query(image=image, top_k=top_k)).result(timeout)
+
+    def _serve_batches(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.requests.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._answer(batch)
+            except Exception as e:
+                self.stats["errors"] += len(batch)
+                for query in batch:
+                    if not query.future.done():
+                        query.future.set_exception(e)
+
+    def _answer(self, batch):
+        start = time.perf_counter()
+        index = self.index
+        vectors = [None] * len(batch)
+        texts = [i for i, query in enumerate(batch) if query.text is not None]
+        if texts:
+            for i, vector in zip(texts, self.generator.embed_texts([batch[i].text for i in texts])):
+                vectors[i] = vector
+        images = [i for i, query in enumerate(batch) if query.text is None]
+        if images:
+            pixel_values = [self.generator.preprocess_image(batch[i].image) for i in images]
+            for i, vector in zip(images, self.generator.embed_batch(pixel_values)):
+                vectors[i] = vector
+        valid = [i for i, vector in enumerate(vectors) if vector is not None]
+        if valid:
+            top_k = max(batch[i].top_k for i in valid)
+            for i, matches in zip(valid, index.search_batch(np.stack([vectors[i] for i in valid]), top_k)):
+                batch[i].future.set_result(matches[:batch[i].top_k])
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                self.stats["errors"] += 1
+                batch[i].future.set_exception(ValueError("Could not embed the query image"))
+        self.stats["queries"] += len(batch)
+        self.stats["batches"] += 1
+        metrics.incr('queries', len(batch))
+        metrics.observe('query_batch', time.perf_counter() - start)
+
+    def health(self):
+        return dict(self.stats, rows=len(self.index), index=self.index_type, embeddings=self.embeddings_file,
+                    loaded_at=self.loaded_at)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; without this, keep-alive clients wait on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def answer(self, query):
+            try:
+                matches = service.submit(query).result(timeout=60)
+            except ValueError as e:
+                return self.send_json(400, {"error": str(e)})
+            except Exception as e:
+                return self.send_json(500, {"error": str(e)})
+            self.send_json(200, {"results": [dict(record, similarity=score) for score, record in matches]})
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            params = parse_qs(parsed.query)
+            if parsed.path == '/health':
+                return self.send_json(200, service.health())
+            if parsed.path == '/search' and params.get('q'):
+                return self.answer(Query(text=params['q'][0], top_k=params.get('top_k', ['5'])[0]))
+            self.send_json(404, {"error": "use GET /search?q=... or POST /search"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/search':
+                return self.send_json(404, {"error": "use POST /search"})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                top_k = request.get('top_k', 5)
+                if 'text' in request:
+                    query = Query(text=str(request['text']), top_k=top_k)
+                elif 'image_path' in request:
+                    query = Query(image=request['image_path'], top_k=top_k)
+                elif 'image_base64' in request:
+                    query = Query(image=io.BytesIO(base64.b64decode(request['image_base64'])), top_k=top_k)
+                else:
+                    return self.send_json(400, {"error": "expected text, image_path or image_base64"})
+            except (ValueError, TypeError) as e:
+                return self.send_json(400, {"error": f"bad request: {e}"})
+            self.answer(query)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+def create_server(service, host='127.0.0.1', port=8765, socket_path=None):
+    """HTTP server for the service on a TCP port, or on a Unix socket when socket_path is set"""
+    handler = make_handler(service)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class QueryClient:
+    """Keep-alive client for internal tools: QueryClient('127.0.0.1:8765') or QueryClient('/tmp/menu_guide.sock').
+    One client per thread."""
+
+    def __init__(self, address, timeout=60):
+        if address.startswith('/') or address.endswith('.sock'):
+            class UnixConnection(http.client.HTTPConnection):
+                def connect(self):
+                    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self.sock.settimeout(timeout)
+                    self.sock.connect(address)
+
+            self.connection = UnixConnection('localhost', timeout=timeout)
+        else:
+            host, _, port = address.partition(':')
+            self.connection = http.client.HTTPConnection(host, int(port or 8765), timeout=timeout)
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"Query server error {response.status}: {data.get('error')}")
+        return data
+
+    def search_text(self, text, top_k=5):
+        return self.request('GET', f"/search?q={quote(text)}&top_k={top_k}")["results"]
+
+    def search_image(self, image_path, top_k=5):
+        return self.request('POST', '/search', {"image_path": os.path.abspath(image_path), "top_k": top_k})["results"]
+
+    def health(self):
+        return self.request('GET', '/health')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve text and image similarity queries from memory with micro-batching.")
+    parser.add_argument('--embeddings', type=str, default='dish_images/dish_embeddings.json', help='Embeddings file (.json, .pkl, .bin or .meta.json); the binary copy is used when present')
+    parser.add_argument('--index', choices=INDEX_TYPES, default='exact', help='exact float32, int8 codes, or two-stage dish index (distinct dishes)')
+    parser.add_argument('--text-embeddings', type=str, default='dish_images/text_embeddings.meta.json', help='Precomputed dish name embeddings (skipped if missing)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port')
+    parser.add_argument('--socket', type=str, default=None, help='Serve on this Unix socket instead of a TCP port')
+    parser.add_argument('--batch-window-ms', type=float, default=5.0, help='How long the first request of a batch waits for others')
+    parser.add_argument('--max-batch', type=int, default=64, help='Max queries per model batch and matmul')
+    parser.add_argument('--reload-interval', type=float, default=2.0, help='Seconds between checks of the embedding files (0 disables hot reload)')
+    parser.add_argument('--model', type=str, default='openai/clip-vit-base-patch32', help='Name of the CLIP model used for the embeddings')
+    parser.add_argument('--device', type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend (see clip_backends.py)')
+    parser.add_argument('--onnx-dir', type=str, default=None, help='Directory of the exported ONNX towers (default: onnx_models/<model>)')
+    parser.add_argument('--quantize', action='store_true', help='With --backend onnx, use int8 dynamically quantized towers')
+    parser.add_argument('--lazy-model', action='store_true', help='Load the model on the first query that needs it instead of at startup')
+    args = parser.parse_args()
+
+    text_embeddings = args.text_embeddings if os.path.exists(args.text_embeddings) else None
+    generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device, backend=args.backend,
+                                        onnx_dir=args.onnx_dir, quantize=args.quantize,
+                                        text_embeddings_file=text_embeddings)
+    if not args.lazy_model:
+        generator.load_model()
+    service = QueryService(generator, args.embeddings, index_type=args.index, batch_window_ms=args.batch_window_ms,
+                           max_batch=args.max_batch, reload_interval=args.reload_interval)
+    server = create_server(service, args.host, args.port, args.socket)
+    print(f"Serving queries on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        metrics.METRICS.print_summary("Query server metrics")
+
+
+if __name__ == "__main__":
+    main()
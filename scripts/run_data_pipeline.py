@@ -2,70 +2,331 @@
 """
 run_data_pipeline.py
 
-A simple pipeline runner to orchestrate all data steps for the AI Menu Guide project:
+A pipeline runner to orchestrate all data steps for the AI Menu Guide project:
 - Scrape images
+- Pre-filter images locally with CLIP
 - Filter images with GPT
 - Generate image embeddings
+- Aggregate image embeddings into a per-dish centroid index
+- Precompute text embeddings for known dish names (independent of the image stages)
+
+Each stage declares its inputs and outputs and the stages form a DAG. A stage is
+skipped when its outputs are newer than its inputs (including its own script and the
+local modules it imports) and its arguments are unchanged since the last successful
+run; --force reruns everything.
+With --stream, downstream stages start right away and follow the upstream JSON Lines
+progress logs, so a dish is filtered and embedded as soon as its images are scraped.
+The scrape, prefilter, filter and embed stages append counters and timing histograms
+to <data-dir>/metrics.jsonl; a summary of the run is printed at the end.
 
 Usage:
-  python run_data_pipeline.py [--step STEP] [--all]
+  python run_data_pipeline.py [--step STEP] [--all] [--stream] [--force] [--profile]
 
 Options:
-  --step STEP   Run a specific step (scrape, filter, embed)
-  --all         Run all steps in order (default: includes validate before embedding)
-
-Edit script to adjust file paths or script arguments as needed.
+  --step STEP   Run a specific step (scrape, prefilter, filter, embed, aggregate, text)
+  --all         Run all steps (stages whose dependencies are done run in parallel)
+  --stream      Stream records between stages instead of waiting for each to finish
+  --force       Rerun stages even if their outputs are fresh
+  --profile     Run the stages under cProfile (stats are saved next to the metrics file)
+  --serve       Afterwards (or on its own) start the query server on the embeddings
 """
-import subprocess
-import argparse
+import os
+import ast
 import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from progress_log import done_marker
+from metrics import read_metrics
 
 # Paths to scripts
 SCRAPER = 'dish_image_scraper.py'
+PREFILTER = 'prefilter_images.py'
 FILTER = 'filter_scraped_images.py'
 EMBED = 'image_embedding_generator.py'
+AGGREGATE = 'dish_index.py'
+TEXT = 'text_embeddings.py'
+SERVE = 'query_server.py'
 
 
-def run_step(cmd, desc):
-    print(f"\n=== {desc} ===")
-    result = subprocess.run(cmd, shell=True)
-    if result.returncode != 0:
-        print(f"Step failed: {desc}")
-        sys.exit(1)
+def local_modules(script, found=None):
+    """The script plus every module next to it that it imports, directly or indirectly"""
+    found = [] if found is None else found
+    if script in found or not os.path.exists(script):
+        return found
+    found.append(script)
+    with open(script, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), script)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            local_modules(os.path.join(os.path.dirname(script), name.split('.')[0] + '.py'), found)
+    return found
+
+
+class Stage:
+    """One pipeline step: a script with its arguments, the files it reads and writes,
+    and the stages it depends on. Streaming stages accept --follow to tail their input;
+    instrumented stages accept --metrics-file and --profile (see metrics.py). A stage
+    with resumes=True continues its JSON Lines output across runs (the scraper's
+    progress log); the .jsonl outputs of every other stage are cleared before it starts."""
+
+    def __init__(self, name, description, script, args=(), inputs=(), outputs=(), deps=(), streams=False,
+                 instrumented=False, resumes=False):
+        self.name = name
+        self.description = description
+        self.script = script
+        self.args = list(args)
+        # A change to a shared module (e.g. the embedding file format) reruns the stage too
+        self.inputs = local_modules(script) + list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.streams = streams
+        self.instrumented = instrumented
+        self.resumes = resumes
+
+    def command(self, follow=False, metrics_file=None, profile=False):
+        # Metrics options are not part of args, so they do not change the config hash
+        cmd = [sys.executable, self.script] + self.args + (['--follow'] if follow else [])
+        if self.instrumented and metrics_file:
+            cmd += ['--metrics-file', metrics_file]
+        if self.instrumented and profile:
+            cmd += ['--profile']
+        return cmd
+
+    def config_hash(self):
+        return hashlib.sha256(json.dumps([self.script, self.args]).encode('utf-8')).hexdigest()[:16]
+
+    def is_fresh(self, state):
+        """True when every output exists, is newer than every input and was built with the same arguments"""
+        if state.get(self.name) != self.config_hash():
+            return False
+        if not self.outputs or not all(os.path.exists(path) for path in self.outputs):
+            return False
+        oldest_output = min(os.path.getmtime(path) for path in self.outputs)
+        newest_input = max((os.path.getmtime(path) for path in self.inputs if os.path.exists(path)), default=0)
+        return oldest_output >= newest_input
+
+
+def build_stages(args):
+    data_dir = args.data_dir
+    scraped = os.path.join(data_dir, 'scraping_progress.jsonl')
+    prefiltered = os.path.join(data_dir, 'prefiltered_progress.jsonl')
+    filtered = os.path.join(data_dir, 'filtered_progress.jsonl')
+    embeddings = os.path.join(data_dir, 'dish_embeddings.json')
+    dish_index = os.path.join(data_dir, 'dish_embeddings.dishes.npz')
+    text_embeddings = os.path.join(data_dir, 'text_embeddings.meta.json')
+    device = ['--device', args.device] if args.device else []
+
+    stages = [
+        Stage('scrape', 'Scrape images', SCRAPER,
+              args=['--output-dir', data_dir, '--progress-file', scraped, '--dish-list', args.dish_list],
+              inputs=[args.dish_list], outputs=[scraped], instrumented=True, resumes=True),
+        Stage('prefilter', 'Pre-filter images locally with CLIP', PREFILTER,
+              args=['--input', scraped, '--output', prefiltered] + device,
+              inputs=[scraped], outputs=[prefiltered], deps=['scrape'], streams=True, instrumented=True),
+        Stage('filter', 'Filter images with GPT', FILTER,
+              args=['--input', scraped if args.skip_prefilter else prefiltered, '--output', filtered],
+              inputs=[scraped if args.skip_prefilter else prefiltered], outputs=[filtered],
+              deps=['scrape' if args.skip_prefilter else 'prefilter'], streams=True, instrumented=True),
+        Stage('embed', 'Generate image embeddings', EMBED,
+              args=['--input', filtered, '--output', embeddings] + device,
+              inputs=[filtered], outputs=[embeddings], deps=['filter'], streams=True, instrumented=True),
+        Stage('aggregate', 'Aggregate dish centroids', AGGREGATE,
+              args=['build', '--embeddings', embeddings, '--index', dish_index, '--medoids', str(args.medoids)],
+              inputs=[embeddings], outputs=[dish_index], deps=['embed']),
+        Stage('text', 'Precompute dish name text embeddings', TEXT,
+              args=['--dish-list', args.dish_list, '--output', text_embeddings] + device,
+              inputs=[args.dish_list], outputs=[text_embeddings]),
+    ]
+    if args.skip_prefilter:
+        stages = [stage for stage in stages if stage.name != 'prefilter']
+    return stages
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state, state_file):
+    os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+
+def plan(stages, state, force=False):
+    """Names of the stages that need to run; stages are in topological order, and a
+    stage downstream of one that reruns is rerun too"""
+    to_run = set()
+    for stage in stages:
+        if force or any(dep in to_run for dep in stage.deps) or not stage.is_fresh(state):
+            to_run.add(stage.name)
+    return to_run
+
+
+def run_pipeline(stages, to_run, state, state_file, stream=False, env=None, metrics_file=None, profile=False):
+    """Run the stages in dependency order and return {name: (status, seconds)}.
+    Independent stages run in parallel; with stream, a streaming stage starts as soon as
+    its dependencies have started and follows their output logs. Instrumented stages
+    append their metrics to metrics_file and, with profile, save <stage>.prof next to it."""
+    names = {stage.name for stage in stages}
+    started = {stage.name: threading.Event() for stage in stages}
+    finished = {stage.name: threading.Event() for stage in stages}
+    failed = threading.Event()
+    processes = {}
+    report = {}
+    lock = threading.Lock()
+
+    def mark_done(stage):
+        for path in stage.outputs:
+            if path.endswith('.jsonl'):
+                open(done_marker(path), 'w').close()
+
+    def run(stage):
+        deps = [dep for dep in stage.deps if dep in names]
+        follow = stream and stage.streams and any(dep in to_run for dep in deps)
+        for dep in deps:
+            (started if follow else finished)[dep].wait()
+        try:
+            if failed.is_set():
+                report[stage.name] = ('cancelled', 0.0)
+                return
+            if stage.name not in to_run:
+                mark_done(stage)
+                report[stage.name] = ('skipped (fresh)', 0.0)
+                return
+            # Stale markers would stop followers before this run has written anything
+            for path in stage.outputs:
+                if os.path.exists(done_marker(path)):
+                    os.remove(done_marker(path))
+                # Cleared here rather than by the stage: a follower started at the same time
+                # could otherwise open the previous run's log and read its records
+                if path.endswith('.jsonl') and not stage.resumes and os.path.exists(path):
+                    open(path, 'w').close()
+            print(f"\n=== {stage.description}{' (streaming)' if follow else ''} ===")
+            start = time.perf_counter()
+            with lock:
+                if failed.is_set():
+                    report[stage.name] = ('cancelled', 0.0)
+                    return
+                processes[stage.name] = subprocess.Popen(stage.command(follow, metrics_file, profile), env=env)
+            started[stage.name].set()
+            returncode = processes[stage.name].wait()
+            elapsed = time.perf_counter() - start
+            if returncode != 0:
+                with lock:
+                    # A stage terminated after another one failed is reported as cancelled
+                    report[stage.name] = ('cancelled' if failed.is_set() else 'failed', elapsed)
+                    if not failed.is_set():
+                        print(f"Step failed: {stage.description}")
+                        failed.set()
+                        # Followers would otherwise wait forever for this stage's output
+                        for process in processes.values():
+                            if process.poll() is None:
+                                process.terminate()
+                return
+            mark_done(stage)
+            with lock:
+                state[stage.name] = stage.config_hash()
+                save_state(state, state_file)
+            report[stage.name] = ('ran', elapsed)
+        finally:
+            started[stage.name].set()
+            finished[stage.name].set()
+
+    with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+        for future in [pool.submit(run, stage) for stage in stages]:
+            future.result()
+    return report
+
+
+def print_report(stages, report, total):
+    print("\n=== Pipeline report ===")
+    print(f"{'stage':<10} {'status':<16} {'seconds':>8}")
+    for stage in stages:
+        status, seconds = report.get(stage.name, ('not run', 0.0))
+        print(f"{stage.name:<10} {status:<16} {seconds:>8.1f}")
+    print(f"{'total':<10} {'':<16} {total:>8.1f}")
+
+
+def serve(args):
+    cmd = [sys.executable, SERVE, '--embeddings', os.path.join(args.data_dir, 'dish_embeddings.json'),
+           '--text-embeddings', os.path.join(args.data_dir, 'text_embeddings.meta.json'),
+           '--port', str(args.serve_port)] + (['--device', args.device] if args.device else [])
+    print(f"\n=== Serving queries on http://127.0.0.1:{args.serve_port} (Ctrl+C to stop) ===")
+    try:
+        subprocess.call(cmd)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
     parser = argparse.ArgumentParser(description="Run the full data pipeline or individual steps.")
-    parser.add_argument('--step', choices=['scrape', 'filter', 'embed'], help='Run a specific step')
-    parser.add_argument('--all', action='store_true', help='Run all steps in order')
+    parser.add_argument('--step', choices=['scrape', 'prefilter', 'filter', 'embed', 'aggregate', 'text'], help='Run a specific step')
+    parser.add_argument('--all', action='store_true', help='Run all steps')
     parser.add_argument('--api-key', type=str, default=None, help='OpenAI API key (or set OPENAI_API_KEY env var)')
     parser.add_argument("--device", type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
+    parser.add_argument('--skip-prefilter', action='store_true', help='Send every scraped image to the GPT filter without the local CLIP pre-filter')
+    parser.add_argument('--medoids', type=int, default=0, help='Medoid representatives per dish in the dish index, in addition to the centroid')
+    parser.add_argument('--stream', action='store_true', help='Start downstream stages immediately and stream records to them as they are produced')
+    parser.add_argument('--force', action='store_true', help='Rerun stages even when their outputs are newer than their inputs')
+    parser.add_argument('--data-dir', type=str, default='dish_images', help='Directory for images and intermediate files')
+    parser.add_argument('--dish-list', type=str, default='../data/dish_lists.json', help='Path to dish_lists.json')
+    parser.add_argument('--metrics-file', type=str, default=None, help='JSON Lines file the stages append their counters and timings to (default: <data-dir>/metrics.jsonl)')
+    parser.add_argument('--profile', action='store_true', help='Run the scrape, prefilter, filter and embed stages under cProfile (<stage>.prof next to the metrics file)')
+    parser.add_argument('--serve', action='store_true', help='Start the query server (query_server.py) on the embeddings after the run; it hot-reloads when they are rebuilt')
+    parser.add_argument('--serve-port', type=int, default=8765, help='Port of the query server started by --serve')
+    parser.add_argument('--state-file', type=str, default=None, help='Arguments of the last successful run per stage (default: <data-dir>/pipeline_state.json)')
     args = parser.parse_args()
 
-    scraper_cmd = f'python {SCRAPER}'
-    filter_cmd = f'python {FILTER}'
-    embeder_cmd = f'python {EMBED}'
+    stages = build_stages(args)
+    if args.step:
+        if args.step not in [stage.name for stage in stages]:
+            print(f"Step {args.step} is disabled by the other options")
+            sys.exit(1)
+        stages = [stage for stage in stages if stage.name == args.step]
+    elif not args.all:
+        if args.serve:
+            serve(args)
+        else:
+            parser.print_help()
+        return
+
+    # The key goes through the environment so it never ends up in the config hash or process list
+    env = dict(os.environ)
     if args.api_key:
-        filter_cmd += f' --api-key {args.api_key}'
-    if args.device:
-        embeder_cmd += f' --device {args.device}'
-
-    steps = [
-        ('scrape', scraper_cmd, 'Scrape images'),
-        ('filter', filter_cmd, 'Filter images with GPT'),
-        ('embed', embeder_cmd, 'Generate image embeddings'),
-    ]
+        env['OPENAI_API_KEY'] = args.api_key
 
-    if args.all:
-        for key, cmd, desc in steps:
-            run_step(cmd, desc)
-    elif args.step:
-        for key, cmd, desc in steps:
-            if key == args.step:
-                run_step(cmd, desc)
-                break
-    else:
-        parser.print_help()
+    state_file = args.state_file or os.path.join(args.data_dir, 'pipeline_state.json')
+    state = load_state(state_file)
+    to_run = plan(stages, state, force=args.force)
+    metrics_file = args.metrics_file or os.path.join(args.data_dir, 'metrics.jsonl')
+    run_started = time.time()
+    start = time.perf_counter()
+    report = run_pipeline(stages, to_run, state, state_file, stream=args.stream, env=env,
+                          metrics_file=metrics_file, profile=args.profile)
+    print_report(stages, report, time.perf_counter() - start)
+    read_metrics(metrics_file, since=run_started).print_summary("Pipeline metrics")
+    print(f"Metrics appended to: {metrics_file}")
+    if any(status in ('failed', 'cancelled') for status, _ in report.values()):
+        sys.exit(1)
+    if args.serve:
+        serve(args)
 
 
 if __name__ == "__main__":
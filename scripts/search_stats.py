@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Search Statistics
+Per (engine, query variant) yield and latency of the image scraper, persisted across
+runs. Every search and every download of a URL it returned is credited to the
+combination, and GPT verdicts from filter_scraped_images.py are joined back by URL, so
+each combination has an estimate of approved images per second:
+
+  results per search * P(download saved) * P(passes GPT)
+  / (seconds per search + results per search * seconds per download)
+
+Yield is counted per downloaded URL, so results a dish never needed do not count against
+the search that returned them.
+
+Each estimate is shrunk toward the pool-wide rates of all combinations, so a combination
+without data of its own looks average rather than optimistic.
+
+The scraper first gives every combination --warmup-trials searches (spread over the first
+dishes), then tries combinations in order of that rate. It skips ones that returned no
+results during warm-up, or that have saved nothing (or nothing that passed GPT) after
+--min-trials searches; skipped ones are still retried now and then (--explore) so they can
+recover.
+
+Usage:
+  python search_stats.py dish_images/search_stats.json
+"""
+
+import os
+import json
+import random
+import argparse
+import threading
+
+from progress_log import iter_records
+
+FIELDS = ["searches", "search_seconds", "results", "downloads", "download_seconds", "accepted",
+          "gpt_checked", "gpt_passed"]
+# Each combination's estimate starts from the pool-wide rates of all combinations, worth
+# PRIOR_SEARCHES searches / PRIOR_DOWNLOADS downloads / PRIOR_CHECKS GPT verdicts, so untried
+# combinations look average and the prior fades once a combination has data of its own.
+# The pool itself starts from the DEFAULT_* values, worth one search / download.
+PRIOR_SEARCHES = 1
+PRIOR_DOWNLOADS = 2
+PRIOR_CHECKS = 2
+DEFAULT_RESULTS_PER_SEARCH = 10.0
+DEFAULT_SECONDS_PER_SEARCH = 1.0
+DEFAULT_SAVED_RATE = 0.5
+DEFAULT_SECONDS_PER_DOWNLOAD = 0.5
+DEFAULT_PASS_RATE = 0.5
+
+
+class SearchStats:
+    def __init__(self, stats_file=None, min_trials=20, explore=0.05, warmup_trials=3, seed=None):
+        self.stats_file = stats_file
+        self.min_trials = min_trials
+        self.warmup_trials = warmup_trials
+        self.explore = explore
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        if stats_file and os.path.exists(stats_file):
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                for entry in json.load(f):
+                    self.entries[(entry["engine"], entry["variant"])] = {k: entry.get(k, 0) for k in FIELDS}
+
+    def _entry(self, key):
+        if key not in self.entries:
+            self.entries[key] = dict.fromkeys(FIELDS, 0)
+        return self.entries[key]
+
+    def record_search(self, key, seconds, results):
+        with self._lock:
+            entry = self._entry(key)
+            entry["searches"] += 1
+            entry["search_seconds"] += seconds
+            entry["results"] += results
+
+    def record_download(self, key, seconds, accepted):
+        with self._lock:
+            entry = self._entry(key)
+            entry["downloads"] += 1
+            entry["download_seconds"] += seconds
+            entry["accepted"] += int(accepted)
+
+    def apply_verdicts(self, progress_file, verdicts_file):
+        """Recount gpt_checked/gpt_passed from the scraped records (which carry engine and
+        query_variant) and the GPT verdict cache; idempotent, so it can run every time"""
+        if not (progress_file and verdicts_file and os.path.exists(progress_file) and os.path.exists(verdicts_file)):
+            return
+        verdicts = {rec["url"]: rec["passed"] for rec in iter_records(verdicts_file)}
+        counts = {}
+        for rec in iter_records(progress_file):
+            key = (rec.get("engine"), rec.get("query_variant"))
+            if key[0] is None or rec.get("url") not in verdicts:
+                continue
+            checked, passed = counts.get(key, (0, 0))
+            counts[key] = (checked + 1, passed + int(bool(verdicts[rec["url"]])))
+        with self._lock:
+            for key, (checked, passed) in counts.items():
+                entry = self._entry(key)
+                entry["gpt_checked"], entry["gpt_passed"] = checked, passed
+
+    def pooled_rates(self):
+        """Rates over all combinations, used as the prior of each one"""
+        total = {field: sum(entry[field] for entry in self.entries.values()) for field in FIELDS}
+        searches = total["searches"] + 1
+        downloads = total["downloads"] + 1
+        return {
+            "results": (total["results"] + DEFAULT_RESULTS_PER_SEARCH) / searches,
+            "search_seconds": (total["search_seconds"] + DEFAULT_SECONDS_PER_SEARCH) / searches,
+            "saved_rate": (total["accepted"] + DEFAULT_SAVED_RATE) / downloads,
+            "download_seconds": (total["download_seconds"] + DEFAULT_SECONDS_PER_DOWNLOAD) / downloads,
+            "pass_rate": (total["gpt_passed"] + DEFAULT_PASS_RATE) / (total["gpt_checked"] + 1),
+        }
+
+    def expected_rate(self, key, pool=None):
+        """Expected GPT-approved images per second of one more search with this combination"""
+        pool = pool or self.pooled_rates()
+        entry = self.entries.get(key) or dict.fromkeys(FIELDS, 0)
+        searches = entry["searches"] + PRIOR_SEARCHES
+        results = (entry["results"] + PRIOR_SEARCHES * pool["results"]) / searches
+        search_seconds = (entry["search_seconds"] + PRIOR_SEARCHES * pool["search_seconds"]) / searches
+        downloads = entry["downloads"] + PRIOR_DOWNLOADS
+        saved_rate = (entry["accepted"] + PRIOR_DOWNLOADS * pool["saved_rate"]) / downloads
+        download_seconds = (entry["download_seconds"] + PRIOR_DOWNLOADS * pool["download_seconds"]) / downloads
+        pass_rate = (entry["gpt_passed"] + PRIOR_CHECKS * pool["pass_rate"]) / (entry["gpt_checked"] + PRIOR_CHECKS)
+        seconds = search_seconds + results * download_seconds
+        return results * saved_rate * pass_rate / max(seconds, 1e-3)
+
+    def is_useless(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        # A combination that never returned anything is written off after its warm-up
+        if entry["results"] == 0 and entry["searches"] >= max(1, self.warmup_trials):
+            return True
+        if entry["searches"] < self.min_trials:
+            return False
+        if entry["downloads"] >= self.min_trials and entry["accepted"] == 0:
+            return True
+        return entry["gpt_checked"] >= self.min_trials and entry["gpt_passed"] == 0
+
+    def schedule(self, keys):
+        """Keys still in warm-up first, then in order of expected rate, without the useless ones
+        (each kept with probability explore). Returns (scheduled, skipped)."""
+        def priority(key):
+            searches = self.entries[key]["searches"] if key in self.entries else 0
+            return searches >= self.warmup_trials, -self.expected_rate(key, pool)
+
+        with self._lock:
+            pool = self.pooled_rates()
+            ranked = sorted(keys, key=priority)
+            skipped = [key for key in ranked if self.is_useless(key) and self._random.random() >= self.explore]
+        return [key for key in ranked if key not in skipped], skipped
+
+    def save(self):
+        if not self.stats_file:
+            return
+        with self._lock:
+            rows = [dict(engine=engine, variant=variant, **entry) for (engine, variant), entry in sorted(self.entries.items())]
+        os.makedirs(os.path.dirname(self.stats_file) or ".", exist_ok=True)
+        tmp_file = self.stats_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+        os.replace(tmp_file, self.stats_file)
+
+    def print_table(self):
+        print(f"{'engine':<12} {'variant':<26} {'searches':>8} {'saved':>11} {'gpt ok':>9} {'s/search':>8} {'img/s':>7}")
+        pool = self.pooled_rates()
+        for key in sorted(self.entries, key=lambda key: self.expected_rate(key, pool), reverse=True):
+            entry = self.entries[key]
+            seconds = entry["search_seconds"] / max(1, entry["searches"])
+            saved = f"{entry['accepted']}/{entry['downloads']}"
+            gpt = f"{entry['gpt_passed']}/{entry['gpt_checked']}"
+            print(f"{key[0]:<12} {key[1]:<26} {entry['searches']:>8} {saved:>11} {gpt:>9} {seconds:>8.2f} "
+                  f"{self.expected_rate(key, pool):>7.2f}{'  skip' if self.is_useless(key) else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the per engine/query variant yield statistics of the scraper.")
+    parser.add_argument('stats_file', type=str, nargs='?', default='dish_images/search_stats.json', help='Statistics file written by dish_image_scraper.py')
+    parser.add_argument('--progress-file', type=str, default='dish_images/scraping_progress.jsonl', help='Scraped records, joined with the GPT verdicts')
+    parser.add_argument('--verdicts', type=str, default='dish_images/gpt_verdicts.jsonl', help='GPT verdict cache of filter_scraped_images.py')
+    parser.add_argument('--min-trials', type=int, default=20, help='Searches before a combination can be marked useless')
+    args = parser.parse_args()
+
+    stats = SearchStats(args.stats_file, min_trials=args.min_trials)
+    stats.apply_verdicts(args.progress_file, args.verdicts)
+    stats.print_table()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Text Embeddings
+Precomputes CLIP text embeddings for every dish name in dish_lists.json plus common
+aliases (the name without its parenthetical note, the note itself when it is another
+name, and any "aliases" listed for the dish). The result ships with the web app as
+text_embeddings.bin/.meta.json, so queries for known dishes never load the text model;
+ImageEmbeddingGenerator(text_embeddings_file=...) uses it the same way.
+"""
+
+import re
+import json
+import argparse
+
+from embedding_cache import normalize_text
+from embedding_store import save_binary_embeddings
+from clip_backends import BACKENDS
+
+PARENTHETICAL = re.compile(r'\s*\(([^)]*)\)\s*')
+
+
+def dish_aliases(entry):
+    """Texts a menu might use for this dish, starting with the canonical name"""
+    name = entry["name"]
+    aliases = [name]
+    stripped = PARENTHETICAL.sub(' ', name).strip()
+    if stripped:
+        aliases.append(stripped)
+    for note in PARENTHETICAL.findall(name):
+        # "Biscotti (Cantucci)" names the dish again; "(popular in France)" does not
+        if note and ',' not in note and all(word[:1].isupper() for word in note.split()):
+            aliases.append(note.strip())
+    aliases.extend(entry.get("aliases", []))
+    return aliases
+
+
+def collect_texts(dish_lists):
+    """One record per distinct normalized text: {"text", "dish", "cuisine"}"""
+    records = {}
+    for cuisine, categories in dish_lists.items():
+        for entries in categories.values():
+            for entry in entries:
+                for text in dish_aliases(entry):
+                    key = normalize_text(text)
+                    if key and key not in records:
+                        records[key] = {"text": text, "dish": entry["name"], "cuisine": cuisine}
+    return list(records.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute CLIP text embeddings for known dish names and aliases.")
+    parser.add_argument('--dish-list', type=str, default='../data/dish_lists.json', help='Path to dish_lists.json')
+    parser.add_argument('--output', type=str, default='dish_images/text_embeddings.meta.json', help='Output metadata file; the matrix goes next to it as .bin')
+    parser.add_argument('--model', type=str, default='openai/clip-vit-base-patch32', help='Name of the CLIP model to use (same as the image embeddings)')
+    parser.add_argument('--device', type=str, default='cpu', help="Device to use for computation (e.g., 'cuda', 'mps', 'cpu')")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend (see clip_backends.py)')
+    parser.add_argument('--onnx-dir', type=str, default=None, help='Directory of the exported ONNX towers (default: onnx_models/<model>)')
+    parser.add_argument('--quantize', action='store_true', help='With --backend onnx, use int8 dynamically quantized towers')
+    parser.add_argument('--batch-size', type=int, default=64, help='Texts per forward pass')
+    parser.add_argument('--embedding-dtype', choices=['float32', 'float16', 'int8'], default='float32', help='Element type of the binary embedding matrix (int8 = per-vector quantized codes + scales)')
+    args = parser.parse_args()
+
+    from image_embedding_generator import ImageEmbeddingGenerator
+
+    with open(args.dish_list, 'r', encoding='utf-8') as f:
+        records = collect_texts(json.load(f))
+    print(f"Embedding {len(records)} dish names and aliases")
+
+    generator = ImageEmbeddingGenerator(model_name=args.model, device=args.device, batch_size=args.batch_size,
+                                        backend=args.backend, onnx_dir=args.onnx_dir,
+                                        quantize=args.quantize)
+    matrix = generator.embed_texts([record["text"] for record in records])
+    embeddings_data = [dict(record, embedding=embedding) for record, embedding in zip(records, matrix)]
+    bin_file, meta_file = save_binary_embeddings(embeddings_data, args.output, dtype=args.embedding_dtype)
+    print(f"Text embeddings saved to: {bin_file}")
+    print(f"Text embedding metadata saved to: {meta_file}")
+
+
+if __name__ == "__main__":
+    main()